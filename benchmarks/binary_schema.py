@@ -0,0 +1,64 @@
+"""Table sizes and hash lookups before and after migrating hashes and payloads to bytea.
+
+Synthetic blocks are written to an empty scratch database with the text schema, see benchmarks/block_ingest.py.
+The blocks are deleted at the end, the database is left with the binary schema.
+
+usage: python -m benchmarks.binary_schema [blocks]
+"""
+import asyncio
+import random
+import sys
+from time import perf_counter
+
+from denaro.manager import BULK_INGEST_MAX_BLOCKS
+
+from benchmarks.block_ingest import connect, make_blocks
+
+
+async def measure(database, tx_hashes, outputs) -> int:
+    async with database.pool.acquire() as connection:
+        # the migration rewrites the tables, the text tables are compacted too to compare the same rows
+        await connection.execute('VACUUM FULL ANALYZE', timeout=3600)
+    sizes = await database.get_tables_sizes()
+    total = 0
+    for table, (table_size, indexes_size) in sorted(sizes.items()):
+        print(f'  {table}: {table_size / 2 ** 20:.1f} MiB, indexes {indexes_size / 2 ** 20:.1f} MiB')
+        total += table_size + indexes_size
+    print(f'  total: {total / 2 ** 20:.1f} MiB')
+    start = perf_counter()
+    for tx_hash in tx_hashes:
+        await database.get_transaction(tx_hash, check_signatures=False)
+    print(f'  get_transaction: {(perf_counter() - start) / len(tx_hashes) * 1000:.3f}ms')
+    start = perf_counter()
+    for i in range(0, len(outputs), 100):
+        await database.get_unspent_outputs(outputs[i:i + 100])
+    print(f'  get_unspent_outputs: {(perf_counter() - start) / (len(outputs) / 100) * 1000:.3f}ms per 100 outputs')
+    return total
+
+
+async def main(count: int):
+    database = await connect()
+    if database.binary_schema:
+        sys.exit('the database already has the binary schema')
+    blocks = await make_blocks(count)
+    for i in range(0, count, BULK_INGEST_MAX_BLOCKS):
+        await database.add_blocks(blocks[i:i + BULK_INGEST_MAX_BLOCKS])
+    random.seed(0)
+    transactions = [transaction for block in random.sample(blocks, min(count, 1000)) for transaction in block['transactions'] + [block['coinbase_transaction']]]
+    tx_hashes = [transaction.hash() for transaction in transactions]
+    outputs = [(transaction.hash(), 0) for transaction in transactions]
+    try:
+        print('text schema')
+        text_size = await measure(database, tx_hashes, outputs)
+        start = perf_counter()
+        await database.migrate_binary_schema()
+        print(f'migration: {perf_counter() - start:.2f}s')
+        print('binary schema')
+        binary_size = await measure(database, tx_hashes, outputs)
+        print(f'size: {binary_size / text_size:.0%} of the text schema')
+    finally:
+        await database.delete_blocks(0)
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000))
@@ -0,0 +1,89 @@
+"""Per-block inserts against buffered bulk ingestion of a range of synthetic blocks.
+
+The blocks are written to the database configured by the DENARO_DATABASE_* variables, which must be an empty
+scratch database with the node schema; they are deleted at the end of every run.
+
+usage: python -m benchmarks.block_ingest [blocks]
+"""
+import asyncio
+import sys
+from decimal import Decimal
+from os import environ
+from time import perf_counter
+
+from fastecdsa import keys
+
+from denaro import Database
+from denaro.constants import CURVE
+from denaro.helpers import point_to_string, sha256
+from denaro.manager import BULK_INGEST_MAX_BLOCKS
+from denaro.transactions import CoinbaseTransaction, Transaction, TransactionInput, TransactionOutput
+
+REWARD = Decimal(100)
+
+
+async def make_blocks(count: int):
+    private_key = keys.gen_private_key(CURVE)
+    public_key = keys.get_public_key(private_key, CURVE)
+    address = point_to_string(public_key)
+    blocks, previous_coinbase = [], None
+    for block_id in range(1, count + 1):
+        block_hash = sha256(f'benchmark {block_id}'.encode())
+        transactions = []
+        if previous_coinbase is not None:
+            # every block spends the reward of the previous one
+            tx_input = TransactionInput(previous_coinbase.hash(), 0, public_key=public_key, amount=REWARD)
+            transaction = Transaction([tx_input], [TransactionOutput(address, REWARD)])
+            transaction.sign([private_key])
+            # set by the verification in the node
+            await transaction.get_fees()
+            transactions.append(transaction)
+        previous_coinbase = CoinbaseTransaction(block_hash, address, REWARD)
+        blocks.append({
+            'id': block_id,
+            'hash': block_hash,
+            'content': block_hash,
+            'address': address,
+            'random': 0,
+            'difficulty': Decimal('6.0'),
+            'reward': REWARD,
+            'timestamp': 1_700_000_000 + block_id * 180,
+            'transactions': transactions,
+            'coinbase_transaction': previous_coinbase
+        })
+    return blocks
+
+
+async def connect() -> Database:
+    database = await Database.create(
+        user=environ.get('DENARO_DATABASE_USER', 'postgres'),
+        password=environ.get('DENARO_DATABASE_PASSWORD', 'root'),
+        database=environ.get('DENARO_DATABASE_NAME', 'denaro'),
+        host=environ.get('DENARO_DATABASE_HOST', None)
+    )
+    if await database.get_next_block_id() != 1:
+        sys.exit('the database is not empty')
+    return database
+
+
+async def main(count: int):
+    database = await connect()
+    blocks = await make_blocks(count)
+
+    start = perf_counter()
+    for block in blocks:
+        await database.add_blocks([block])
+    single_time = perf_counter() - start
+    print(f'{count} blocks one at a time: {single_time:.3f}s')
+    await database.delete_blocks(0)
+
+    start = perf_counter()
+    for i in range(0, count, BULK_INGEST_MAX_BLOCKS):
+        await database.add_blocks(blocks[i:i + BULK_INGEST_MAX_BLOCKS])
+    bulk_time = perf_counter() - start
+    print(f'{count} blocks in batches of {BULK_INGEST_MAX_BLOCKS}: {bulk_time:.3f}s ({single_time / bulk_time:.2f}x)')
+    await database.delete_blocks(0)
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000))
@@ -0,0 +1,35 @@
+"""Address and point conversions with and without the conversion caches.
+
+usage: python -m benchmarks.conversion_cache [conversions] [distinct addresses]
+"""
+import sys
+from time import perf_counter
+
+from fastecdsa import keys
+
+from denaro.constants import CURVE
+from denaro.helpers import CONVERSION_CACHE_SIZE, point_to_string, set_conversion_cache_size, string_to_bytes, string_to_point
+
+
+def run(addresses, count: int) -> float:
+    start = perf_counter()
+    for i in range(count):
+        address = addresses[i % len(addresses)]
+        string_to_point(address)
+        string_to_bytes(address)
+    return perf_counter() - start
+
+
+def main(count: int, distinct: int):
+    addresses = [point_to_string(keys.get_public_key(i + 1, CURVE)) for i in range(distinct)]
+    print(f'{count} conversions of {distinct} addresses')
+    set_conversion_cache_size(0)
+    uncached = run(addresses, count)
+    print(f'uncached: {uncached:.3f}s')
+    set_conversion_cache_size(CONVERSION_CACHE_SIZE)
+    cached = run(addresses, count)
+    print(f'cached:   {cached:.3f}s ({uncached / cached:.1f}x)')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50000, int(sys.argv[2]) if len(sys.argv) > 2 else 1000)
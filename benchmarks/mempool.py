@@ -0,0 +1,69 @@
+"""Mempool index lookups against scanning the pending transactions hex as the LIKE queries did,
+and the fee ordered block template against sorting every pending transaction on each request.
+
+usage: python -m benchmarks.mempool [pending transactions] [lookups]
+"""
+import random
+import sys
+from decimal import Decimal
+from time import perf_counter
+
+from fastecdsa import keys
+
+from denaro.constants import CURVE, MAX_BLOCK_SIZE_HEX
+from denaro.helpers import point_to_string, sha256
+from denaro.mempool import Mempool
+from denaro.transactions import Transaction, TransactionInput, TransactionOutput
+
+
+def make_mempool(count: int) -> Mempool:
+    private_key = keys.gen_private_key(CURVE)
+    public_key = keys.get_public_key(private_key, CURVE)
+    address = point_to_string(public_key)
+    mempool = Mempool()
+    for i in range(count):
+        inputs = [TransactionInput(sha256(f'{i}-{j}'.encode()), j, public_key=public_key) for j in range(2)]
+        transaction = Transaction(inputs, [TransactionOutput(address, units=i + 1)]).sign([private_key])
+        tx_hex = transaction.hex()
+        mempool.add(transaction, tx_hex, [address], Decimal(random.randint(1, 10_000)) / 1000)
+    return mempool
+
+
+def timed(name: str, function, baseline: float = None) -> float:
+    start = perf_counter()
+    function()
+    elapsed = perf_counter() - start
+    print(f'{name}: {elapsed * 1000:.2f}ms' + (f' ({baseline / elapsed:.0f}x)' if baseline else ''))
+    return elapsed
+
+
+def main(count: int, lookups: int):
+    random.seed(0)
+    mempool = make_mempool(count)
+    print(f'{count} pending transactions, {lookups} spent outputs looked up')
+    outputs = [(sha256(f'{random.randrange(count * 2)}-{j}'.encode()), j) for j in (0, 1) for _ in range(lookups // 2)]
+    hexes = [entry.tx_hex for entry in mempool.transactions.values()]
+
+    def scan():
+        searches = [tx_hash + bytes([index]).hex() for tx_hash, index in outputs]
+        return [tx_hex for tx_hex in hexes if any(search in tx_hex for search in searches)]
+
+    scan_time = timed('conflicts by scanning', scan)
+    timed('conflicts by index', lambda: mempool.get_conflicts(outputs), scan_time)
+
+    def sort(limit: int):
+        entries, size = [], 0
+        for entry in sorted(mempool.transactions.values(), key=lambda entry: (-entry.fees / len(entry.tx_hex), len(entry.tx_hex), entry.tx_hex)):
+            if size + len(entry.tx_hex) > limit:
+                break
+            size += len(entry.tx_hex)
+            entries.append(entry)
+        return entries
+
+    assert sort(MAX_BLOCK_SIZE_HEX) == mempool.get_ordered(MAX_BLOCK_SIZE_HEX)
+    sort_time = timed('block template by sorting', lambda: sort(MAX_BLOCK_SIZE_HEX))
+    timed('block template from the fee order', lambda: mempool.get_ordered(MAX_BLOCK_SIZE_HEX), sort_time)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000, int(sys.argv[2]) if len(sys.argv) > 2 else 100)
@@ -0,0 +1,65 @@
+"""Serial against batched signature verification of a block worth of transactions.
+
+usage: python -m benchmarks.signature_verification [transactions] [inputs per transaction]
+"""
+import asyncio
+import sys
+from time import perf_counter
+
+from fastecdsa import keys
+
+from denaro.constants import CURVE
+from denaro.helpers import point_to_string, sha256
+from denaro.transactions import Transaction, TransactionInput, TransactionOutput
+from denaro.verification import SignatureVerifier, verify_signatures
+
+
+def make_transactions(count: int, inputs: int):
+    transactions = []
+    for i in range(count):
+        # a key per input, so that no signature is shared inside a transaction
+        private_keys = [keys.gen_private_key(CURVE) for _ in range(inputs)]
+        transaction_inputs = [
+            TransactionInput(sha256(f'{i}-{j}'.encode()), j, private_key=private_key, public_key=keys.get_public_key(private_key, CURVE))
+            for j, private_key in enumerate(private_keys)
+        ]
+        address = point_to_string(transaction_inputs[0].public_key)
+        transaction = Transaction(transaction_inputs, [TransactionOutput(address, units=1)])
+        transaction.sign(private_keys)
+        transactions.append(transaction)
+    return transactions
+
+
+async def serial(transactions):
+    results = []
+    for transaction in transactions:
+        results.append(all(verify_signatures(await transaction.get_signature_checks())))
+    return results
+
+
+async def main(count: int, inputs: int):
+    transactions = make_transactions(count, inputs)
+    print(f'{count} transactions, {count * inputs} signatures, {SignatureVerifier.workers} workers')
+
+    start = perf_counter()
+    expected = await serial(transactions)
+    serial_time = perf_counter() - start
+    print(f'serial:  {serial_time:.3f}s')
+
+    # the first batch pays for starting the pool, as the node does once
+    start = perf_counter()
+    await SignatureVerifier.verify_transactions(transactions[:1])
+    await SignatureVerifier.verify(await transactions[0].get_signature_checks() * SignatureVerifier.workers * 32)
+    print(f'pool startup: {perf_counter() - start:.3f}s')
+
+    start = perf_counter()
+    results = await SignatureVerifier.verify_transactions(transactions)
+    batch_time = perf_counter() - start
+    print(f'batched: {batch_time:.3f}s ({serial_time / batch_time:.2f}x)')
+    assert results == expected
+    if SignatureVerifier.executor is not None:
+        SignatureVerifier.executor.shutdown()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 500, int(sys.argv[2]) if len(sys.argv) > 2 else 2))
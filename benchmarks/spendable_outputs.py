@@ -0,0 +1,55 @@
+"""Pending spent outputs exclusion: the old CONCAT != ALL filter against the NOT EXISTS anti-join.
+
+Synthetic data is written to temporary tables, so any database configured by the DENARO_DATABASE_* variables can be used.
+
+usage: python -m benchmarks.spendable_outputs [unspent outputs] [pending spent outputs] [addresses]
+"""
+import asyncio
+import sys
+from os import environ
+from time import perf_counter
+
+import asyncpg
+
+OLD_QUERY = 'SELECT tx_hash, index, amount FROM bench_unspent_outputs WHERE address = ANY($1) AND CONCAT(tx_hash, index) != ALL(SELECT CONCAT(tx_hash, index) FROM bench_pending_spent_outputs)'
+NEW_QUERY = 'SELECT tx_hash, index, amount FROM bench_unspent_outputs WHERE address = ANY($1) AND NOT EXISTS (SELECT 1 FROM bench_pending_spent_outputs WHERE bench_pending_spent_outputs.tx_hash = bench_unspent_outputs.tx_hash AND bench_pending_spent_outputs.index = bench_unspent_outputs.index)'
+
+
+async def timed(connection, name: str, query: str, addresses, repeat: int = 20, baseline: float = None):
+    start = perf_counter()
+    for address in addresses[:repeat]:
+        rows = await connection.fetch(query, [address])
+    elapsed = (perf_counter() - start) / repeat
+    print(f'{name}: {elapsed * 1000:.2f}ms per address' + (f' ({baseline / elapsed:.0f}x)' if baseline else ''))
+    return elapsed, rows
+
+
+async def main(outputs: int, pending: int, addresses_count: int):
+    connection = await asyncpg.connect(
+        user=environ.get('DENARO_DATABASE_USER', 'postgres'),
+        password=environ.get('DENARO_DATABASE_PASSWORD', 'root'),
+        database=environ.get('DENARO_DATABASE_NAME', 'denaro'),
+        host=environ.get('DENARO_DATABASE_HOST', None)
+    )
+    await connection.execute(f"""
+        CREATE TEMP TABLE bench_unspent_outputs AS
+            SELECT encode(sha256(i::TEXT::BYTEA), 'hex') AS tx_hash, (i % 3)::SMALLINT AS index, i::BIGINT AS amount, 'address' || (i % {addresses_count}) AS address
+            FROM generate_series(1, {outputs}) AS i;
+        CREATE TEMP TABLE bench_pending_spent_outputs AS
+            SELECT tx_hash, index FROM bench_unspent_outputs ORDER BY random() LIMIT {pending};
+        CREATE INDEX ON bench_unspent_outputs (address) INCLUDE (tx_hash, index);
+        CREATE INDEX ON bench_pending_spent_outputs (tx_hash, index);
+        ANALYZE bench_unspent_outputs;
+        ANALYZE bench_pending_spent_outputs;
+    """)
+    print(f'{outputs} unspent outputs, {pending} pending spent outputs, {outputs // addresses_count} outputs per address')
+    addresses = [f'address{i}' for i in range(addresses_count)]
+    old_time, old_rows = await timed(connection, 'CONCAT != ALL', OLD_QUERY, addresses)
+    _, new_rows = await timed(connection, 'NOT EXISTS', NEW_QUERY, addresses, baseline=old_time)
+    assert sorted(old_rows) == sorted(new_rows)
+    await connection.close()
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:]]
+    asyncio.run(main(*args + [500_000, 20_000, 1000][len(args):]))
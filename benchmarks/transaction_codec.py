@@ -0,0 +1,54 @@
+"""Parsing, serialization and hashing throughput of transactions.
+
+Only hex() and from_hex() are used, so the script also runs on trees older than the bytes codec to compare.
+
+usage: python -m benchmarks.transaction_codec [transactions] [inputs per transaction]
+"""
+import asyncio
+import sys
+from decimal import Decimal
+from time import perf_counter
+
+from fastecdsa import keys
+
+from denaro.constants import CURVE
+from denaro.helpers import point_to_string, sha256
+from denaro.transactions import Transaction, TransactionInput, TransactionOutput
+
+
+def make_transactions(count: int, inputs: int):
+    private_key = keys.gen_private_key(CURVE)
+    public_key = keys.get_public_key(private_key, CURVE)
+    address = point_to_string(public_key)
+    transactions = []
+    for i in range(count):
+        transaction_inputs = [TransactionInput(sha256(f'{i}-{j}'.encode()), j, public_key=public_key) for j in range(inputs)]
+        transaction = Transaction(transaction_inputs, [TransactionOutput(address, Decimal(j + 1)) for j in range(2)])
+        transaction.sign([private_key])
+        transactions.append(transaction.hex())
+    return transactions
+
+
+def timed(name: str, count: int, function):
+    start = perf_counter()
+    result = function()
+    elapsed = perf_counter() - start
+    print(f'{name}: {elapsed:.3f}s ({count / elapsed:,.0f}/s)')
+    return result
+
+
+async def parse(transactions):
+    return [await Transaction.from_hex(tx_hex, False) for tx_hex in transactions]
+
+
+def main(count: int, inputs: int):
+    transactions = make_transactions(count, inputs)
+    print(f'{count} transactions with {inputs} inputs')
+    parsed = timed('from_hex', count, lambda: asyncio.run(parse(transactions)))
+    assert timed('hex', count, lambda: [transaction.hex() for transaction in parsed]) == transactions
+    timed('hash', count, lambda: [transaction.hash() for transaction in parsed])
+    timed('hex again', count, lambda: [transaction.hex() for transaction in parsed])
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000, int(sys.argv[2]) if len(sys.argv) > 2 else 3)
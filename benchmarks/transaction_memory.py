@@ -0,0 +1,39 @@
+"""Memory and construction time of transaction inputs and outputs.
+
+Only the constructors existing before __slots__ are used, so the script also runs on older trees to compare.
+
+usage: python -m benchmarks.transaction_memory [count]
+"""
+import sys
+import tracemalloc
+from decimal import Decimal
+from time import perf_counter
+
+from fastecdsa import keys
+
+from denaro.constants import CURVE
+from denaro.helpers import point_to_string, sha256
+from denaro.transactions import TransactionInput, TransactionOutput
+
+
+def measure(name: str, count: int, factory):
+    tracemalloc.start()
+    start = perf_counter()
+    objects = [factory(i) for i in range(count)]
+    elapsed = perf_counter() - start
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f'{name}: {elapsed:.3f}s, {size / count:.0f} bytes each')
+    return objects
+
+
+def main(count: int):
+    address = point_to_string(keys.get_public_key(keys.gen_private_key(CURVE), CURVE))
+    tx_hashes = [sha256(str(i).encode()) for i in range(count)]
+    print(f'{count} objects')
+    measure('TransactionInput', count, lambda i: TransactionInput(tx_hashes[i], i % 256))
+    measure('TransactionOutput', count, lambda i: TransactionOutput(address, Decimal(i % 1000 + 1)))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,48 @@
+"""Reading the unspent outputs commitment against hashing the whole set as the root endpoint used to.
+
+Synthetic blocks are written to an empty scratch database, see benchmarks/block_ingest.py.
+
+usage: python -m benchmarks.utxo_commitment [blocks]
+"""
+import asyncio
+import sys
+from time import perf_counter
+
+from denaro.helpers import sha256
+from denaro.manager import BULK_INGEST_MAX_BLOCKS
+
+from benchmarks.block_ingest import connect, make_blocks
+
+
+async def hash_unspent_outputs(database) -> str:
+    async with database.pool.acquire() as connection:
+        rows = await connection.fetch('SELECT tx_hash, index FROM unspent_outputs ORDER BY tx_hash, index')
+    return sha256(''.join(row['tx_hash'] + bytes([row['index']]).hex() for row in rows))
+
+
+async def timed(name: str, function, repeat: int = 10):
+    start = perf_counter()
+    for _ in range(repeat):
+        result = await function()
+    print(f'{name}: {(perf_counter() - start) / repeat * 1000:.2f}ms')
+    return result
+
+
+async def main(count: int):
+    database = await connect()
+    blocks = await make_blocks(count)
+    for i in range(0, count, BULK_INGEST_MAX_BLOCKS):
+        await database.add_blocks(blocks[i:i + BULK_INGEST_MAX_BLOCKS])
+    async with database.pool.acquire() as connection:
+        print(f'{await connection.fetchval("SELECT COUNT(*) FROM unspent_outputs")} unspent outputs')
+    try:
+        await timed('sorted hash of the set', lambda: hash_unspent_outputs(database))
+        recomputed = await timed('commitment recomputed', database.compute_utxo_commitment)
+        stored = await timed('commitment read', database.get_utxo_commitment)
+        assert recomputed == stored
+    finally:
+        await database.delete_blocks(0)
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000))
@@ -0,0 +1,54 @@
+from collections import OrderedDict
+from typing import Dict, List
+
+
+class BalanceCache:
+    def __init__(self, max_size: int):
+        # address -> confirmed balance in SMALLEST units, least recently used first
+        self.balances: OrderedDict = OrderedDict()
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.balances)
+
+    def get(self, address: str) -> int:
+        balance = self.balances.get(address)
+        if balance is None:
+            self.misses += 1
+            return None
+        self.balances.move_to_end(address)
+        self.hits += 1
+        return balance
+
+    def add(self, address: str, balance: int) -> None:
+        if not self.max_size:
+            return
+        self.balances[address] = balance
+        self.balances.move_to_end(address)
+        while len(self.balances) > self.max_size:
+            self.balances.popitem(last=False)
+
+    def update(self, deltas: Dict[str, int]) -> None:
+        # only the cached balances are changed, the others are read again when needed
+        for address, delta in deltas.items():
+            if address in self.balances:
+                self.balances[address] += delta
+
+    def remove(self, addresses: List[str]) -> None:
+        for address in addresses:
+            self.balances.pop(address, None)
+
+    def clear(self) -> None:
+        self.balances.clear()
+
+    def stats(self) -> dict:
+        requests = self.hits + self.misses
+        return {
+            'size': len(self.balances),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / requests if requests else 0
+        }
@@ -1,5 +1,5 @@
 import os
-from datetime import datetime
+from datetime import datetime, timezone
 from decimal import Decimal
 from statistics import mean
 from typing import List, Union, Tuple, Dict
@@ -9,11 +9,36 @@ import pickledb
 from asyncpg import Connection, Pool, UndefinedColumnError, UndefinedTableError
 
 from .constants import MAX_BLOCK_SIZE_HEX, SMALLEST
-from .helpers import sha256, point_to_string, string_to_point, point_to_bytes, AddressFormat, normalize_block
+from .helpers import sha256, point_to_string, string_to_point, point_to_bytes, AddressFormat, normalize_block, \
+    get_utxo_commitment, UTXO_COMMITMENT_MODULUS
 from .transactions import Transaction, CoinbaseTransaction, TransactionInput
+from .mempool import Mempool, get_address_key
+from .utxo_cache import UTXOCache
+from .balance_cache import BalanceCache
 
 dir_path = os.path.dirname(os.path.realpath(__file__))
 OLD_BLOCKS_TRANSACTIONS_ORDER = pickledb.load(dir_path + '/old_block_transactions_order.json', True)
+UTXO_CACHE_SIZE = int(os.environ.get('DENARO_UTXO_CACHE_SIZE', 250_000))
+BALANCE_CACHE_SIZE = int(os.environ.get('DENARO_BALANCE_CACHE_SIZE', 50_000))
+# hex columns stored as bytea by migrate_binary_schema
+BINARY_COLUMNS = {
+    'blocks': ['hash', 'content'],
+    'transactions': ['block_hash', 'tx_hash', 'tx_hex'],
+    'unspent_outputs': ['tx_hash'],
+    'pending_transactions': ['tx_hash', 'tx_hex'],
+    'pending_spent_outputs': ['tx_hash'],
+    'address_transactions': ['tx_hash']
+}
+
+
+def encode_hex(value: Union[str, bytes]) -> bytes:
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value)
+    try:
+        return bytes.fromhex(value)
+    except ValueError:
+        # not an hash, it cannot match any row
+        return value.encode()
 
 
 class Database:
@@ -22,20 +47,37 @@ class Database:
     instance = None
     pool: Pool = None
     is_indexed = False
+    unspent_outputs_addresses = False
+    utxo_cache: UTXOCache = None
+    mempool: Mempool = None
+    address_transactions_indexed = False
+    address_balances_indexed = False
+    binary_schema = False
+    hash_type = 'CHAR(64)'
+    tx_hex_text = 'tx_hex'
+    balance_cache: BalanceCache = None
 
     @staticmethod
     async def create(user='denaro', password='', database='denaro', host='127.0.0.1', ignore: bool = False):
         self = Database()
+        self.utxo_cache = UTXOCache(UTXO_CACHE_SIZE)
+        self.balance_cache = BalanceCache(BALANCE_CACHE_SIZE)
+        self.mempool = Mempool()
         self.pool = await asyncpg.create_pool(
             user=user,
             password=password,
             database=database,
             host=host,
             command_timeout=30,
-            min_size=3
+            min_size=3,
+            init=Database.init_connection
         )
         if not ignore:
             async with self.pool.acquire() as connection:
+                try:
+                    self.set_binary_schema(await connection.fetchval("SELECT value FROM node_state WHERE key = 'binary_schema'") is not None)
+                except UndefinedTableError:
+                    pass
                 try:
                     await connection.fetchrow('SELECT outputs_addresses FROM transactions LIMIT 1')
                 except UndefinedColumnError:
@@ -49,8 +91,8 @@ class Database:
                     await connection.fetchrow('SELECT * FROM pending_spent_outputs LIMIT 1')
                 except UndefinedTableError:
                     print('Creating pending_spent_outputs table')
-                    await connection.execute("""CREATE TABLE IF NOT EXISTS pending_spent_outputs (
-                        tx_hash CHAR(64) REFERENCES transactions(tx_hash) ON DELETE CASCADE,
+                    await connection.execute(f"""CREATE TABLE IF NOT EXISTS pending_spent_outputs (
+                        tx_hash {self.hash_type} REFERENCES transactions(tx_hash) ON DELETE CASCADE,
                         index SMALLINT NOT NULL
                     )""")
                     print('Retrieving pending transactions')
@@ -71,9 +113,62 @@ class Database:
                 except UndefinedColumnError:
                     await connection.execute('ALTER TABLE pending_transactions ADD COLUMN propagation_time TIMESTAMP(0) NOT NULL DEFAULT NOW()')
 
+                await connection.execute('CREATE TABLE IF NOT EXISTS node_state (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+                if await connection.fetchval("SELECT value FROM node_state WHERE key = 'utxo_commitment'") is None:
+                    print('Computing unspent outputs commitment')
+                    await self.set_utxo_commitment(await self.compute_utxo_commitment())
+
+                self.unspent_outputs_addresses = await self.get_node_state('unspent_outputs_addresses', connection) is not None
+                await self.check_unspent_outputs_addresses(connection)
+                await connection.execute('ALTER TABLE unspent_outputs ADD COLUMN IF NOT EXISTS amount BIGINT NULL, ADD COLUMN IF NOT EXISTS block_id INTEGER NULL')
+                if await self.get_node_state('unspent_outputs_amounts', connection) is None and self.is_indexed:
+                    print('Setting unspent outputs amounts')
+                    await self.set_unspent_outputs_amounts()
+                    await self.set_node_state('unspent_outputs_amounts', '1', connection)
+                if await self.get_node_state('unspent_outputs_amounts', connection) is not None and await self.get_node_state('unspent_outputs_not_null', connection) is None:
+                    # locks and scans the whole table, so it is done once
+                    await connection.execute('ALTER TABLE unspent_outputs ALTER COLUMN amount SET NOT NULL, ALTER COLUMN block_id SET NOT NULL', timeout=3600)
+                    await self.set_node_state('unspent_outputs_not_null', '1', connection)
+                # spendable outputs are read from the address index alone, pending ones are excluded by their key
+                await connection.execute('DROP INDEX IF EXISTS unspent_outputs_address_idx')
+                await connection.execute('CREATE INDEX IF NOT EXISTS unspent_outputs_address_amount_idx ON unspent_outputs (address) INCLUDE (tx_hash, index, amount, block_id)')
+                await connection.execute('CREATE INDEX IF NOT EXISTS pending_spent_outputs_output_idx ON pending_spent_outputs (tx_hash, index)')
+
+                await connection.execute(f"""CREATE TABLE IF NOT EXISTS address_transactions (
+                    address TEXT NOT NULL,
+                    block_id INTEGER NOT NULL,
+                    tx_hash {self.hash_type} NOT NULL REFERENCES transactions(tx_hash) ON DELETE CASCADE,
+                    delta BIGINT NOT NULL,
+                    PRIMARY KEY (address, block_id, tx_hash)
+                )""")
+                await connection.execute('CREATE INDEX IF NOT EXISTS address_transactions_tx_hash_idx ON address_transactions (tx_hash)')
+                await connection.execute('CREATE TABLE IF NOT EXISTS address_balances (address TEXT PRIMARY KEY, balance BIGINT NOT NULL)')
+                if await connection.fetchval('SELECT id FROM blocks LIMIT 1') is None:
+                    # nothing to backfill
+                    await self.set_node_state('address_transactions_indexed', '1', connection)
+                    await self.set_node_state('address_balances_indexed', '1', connection)
+                self.address_transactions_indexed = await self.get_node_state('address_transactions_indexed', connection) is not None
+                self.address_balances_indexed = await self.get_node_state('address_balances_indexed', connection) is not None
+                if self.address_transactions_indexed and not self.address_balances_indexed:
+                    print('Computing address balances')
+                    await self.build_address_balances()
+
+            await self.load_utxo_cache()
+            await self.load_mempool()
+
         Database.instance = self
         return self
 
+    @staticmethod
+    async def init_connection(connection: Connection):
+        # with the binary schema, hashes and transactions are still exchanged as hex strings
+        await connection.set_type_codec('bytea', schema='pg_catalog', encoder=encode_hex, decoder=bytes.hex, format='binary')
+
+    def set_binary_schema(self, binary_schema: bool):
+        self.binary_schema = binary_schema
+        self.hash_type = 'BYTEA' if binary_schema else 'CHAR(64)'
+        self.tx_hex_text = "encode(tx_hex, 'hex')" if binary_schema else 'tx_hex'
+
     @staticmethod
     async def get():
         if Database.instance is None:
@@ -86,58 +181,158 @@ class Database:
         tx_hex = transaction.hex()
         if verify and not await transaction.verify_pending():
             return False
-        async with self.pool.acquire() as connection:
-            await connection.execute(
-                'INSERT INTO pending_transactions (tx_hash, tx_hex, inputs_addresses, fees) VALUES ($1, $2, $3, $4)',
-                sha256(tx_hex),
-                tx_hex,
-                [point_to_string(await tx_input.get_public_key()) for tx_input in transaction.inputs],
-                transaction.fees
-            )
-        await self.add_transactions_pending_spent_outputs([transaction])
+        if self.mempool.get_conflicts([(tx_input.tx_hash, tx_input.index) for tx_input in transaction.inputs]):
+            return False
+        inputs_addresses = [point_to_string(await tx_input.get_public_key()) for tx_input in transaction.inputs]
+        fees = transaction.fees if transaction.fees is not None else await transaction.get_fees()
+        async with self.pool.acquire() as connection:
+            async with connection.transaction():
+                await connection.execute(
+                    'INSERT INTO pending_transactions (tx_hash, tx_hex, inputs_addresses, fees) VALUES ($1, $2, $3, $4)',
+                    sha256(tx_hex),
+                    tx_hex,
+                    inputs_addresses,
+                    fees
+                )
+                await connection.executemany('INSERT INTO pending_spent_outputs (tx_hash, index) VALUES ($1, $2)', [(tx_input.tx_hash, tx_input.index) for tx_input in transaction.inputs])
+        self.mempool.add(transaction, tx_hex, inputs_addresses, fees)
         return True
 
-    async def remove_pending_transaction(self, tx_hash: str):
+    async def add_pending_transactions(self, transactions: List[Transaction]) -> List[str]:
+        # transactions must already be verified, see check_pending_transactions
+        added = []
+        spent_outputs = set()
+        for transaction in transactions:
+            inputs = [(tx_input.tx_hash, tx_input.index) for tx_input in transaction.inputs]
+            if isinstance(transaction, CoinbaseTransaction) or transaction.hash() in self.mempool or self.mempool.get_conflicts(inputs) or spent_outputs.intersection(inputs):
+                continue
+            spent_outputs.update(inputs)
+            added.append(transaction)
+        if not added:
+            return []
+        rows = []
+        for transaction in added:
+            inputs_addresses = [point_to_string(await tx_input.get_public_key()) for tx_input in transaction.inputs]
+            fees = transaction.fees if transaction.fees is not None else await transaction.get_fees()
+            rows.append((transaction.hash(), transaction.hex(), inputs_addresses, fees))
+        async with self.pool.acquire() as connection:
+            async with connection.transaction():
+                await connection.executemany('INSERT INTO pending_transactions (tx_hash, tx_hex, inputs_addresses, fees) VALUES ($1, $2, $3, $4)', rows)
+                await connection.executemany('INSERT INTO pending_spent_outputs (tx_hash, index) VALUES ($1, $2)', list(spent_outputs))
+        for transaction, (_, tx_hex, inputs_addresses, fees) in zip(added, rows):
+            self.mempool.add(transaction, tx_hex, inputs_addresses, fees)
+        return [transaction.hash() for transaction in added]
+
+    async def get_known_transactions_hashes(self, tx_hashes: List[str]) -> List[str]:
+        known = [tx_hash for tx_hash in tx_hashes if tx_hash in self.mempool]
+        async with self.pool.acquire() as connection:
+            rows = await connection.fetch('SELECT tx_hash FROM transactions WHERE tx_hash = ANY($1)', [tx_hash for tx_hash in tx_hashes if tx_hash not in self.mempool])
+        return known + [row['tx_hash'] for row in rows]
+
+    async def load_mempool(self, tx_hashes: List[str] = None) -> None:
+        async with self.pool.acquire() as connection:
+            if tx_hashes is None:
+                self.mempool.clear()
+                txs = await connection.fetch('SELECT tx_hex, inputs_addresses, fees FROM pending_transactions')
+            else:
+                txs = await connection.fetch('SELECT tx_hex, inputs_addresses, fees FROM pending_transactions WHERE tx_hash = ANY($1)', tx_hashes)
+        conflicts = []
+        for tx in txs:
+            transaction = await Transaction.from_hex(tx['tx_hex'], check_signatures=False)
+            if not self.mempool.add(transaction, tx['tx_hex'], tx['inputs_addresses'] or [], tx['fees'] or Decimal(0)):
+                conflicts.append(transaction.hash())
+        if conflicts:
+            async with self.pool.acquire() as connection:
+                await connection.execute('DELETE FROM pending_transactions WHERE tx_hash = ANY($1)', conflicts)
+
+    async def sync_mempool(self) -> None:
+        # pending transactions can also be written by other processes, like the wallet
         async with self.pool.acquire() as connection:
-            await connection.execute('DELETE FROM pending_transactions WHERE tx_hash = $1', tx_hash)
+            rows = await connection.fetch('SELECT tx_hash FROM pending_transactions')
+        tx_hashes = {row['tx_hash'] for row in rows}
+        self.mempool.remove([tx_hash for tx_hash in list(self.mempool.transactions) if tx_hash not in tx_hashes])
+        missing = [tx_hash for tx_hash in tx_hashes if tx_hash not in self.mempool]
+        if missing:
+            await self.load_mempool(missing)
+
+    async def delete_pending_transactions(self, connection: Connection, tx_hashes: List[str]) -> None:
+        # the outputs spent by the removed transactions are not pending spent anymore
+        outputs = self.mempool.get_inputs(tx_hashes)
+        await connection.execute('DELETE FROM pending_transactions WHERE tx_hash = ANY($1)', tx_hashes)
+        if outputs:
+            await connection.execute('DELETE FROM pending_spent_outputs WHERE (tx_hash, index) = ANY($1::tx_output[])', outputs)
+
+    async def remove_pending_transaction(self, tx_hash: str):
+        await self.remove_pending_transactions_by_hash([tx_hash])
 
     async def remove_pending_transactions_by_hash(self, tx_hashes: List[str]):
         async with self.pool.acquire() as connection:
-            await connection.execute('DELETE FROM pending_transactions WHERE tx_hash = ANY($1)', tx_hashes)
+            async with connection.transaction():
+                await self.delete_pending_transactions(connection, tx_hashes)
+        self.mempool.remove(tx_hashes)
 
     async def remove_pending_transactions(self):
         async with self.pool.acquire() as connection:
-            await connection.execute('DELETE FROM pending_transactions')
+            async with connection.transaction():
+                await connection.execute('DELETE FROM pending_transactions')
+                await connection.execute('DELETE FROM pending_spent_outputs')
+        self.mempool.clear()
 
     async def delete_blockchain(self):
         async with self.pool.acquire() as connection:
-            await connection.execute('TRUNCATE transactions, blocks RESTART IDENTITY')
+            await connection.execute('TRUNCATE transactions, blocks, address_transactions, address_balances RESTART IDENTITY')
+        self.utxo_cache.clear()
+        self.balance_cache.clear()
+        await self.set_utxo_commitment(await self.compute_utxo_commitment())
+        from .manager import ChainState
+        ChainState.invalidate()
+
+    async def delete_blocks_where(self, condition: str, *args) -> None:
+        async with self.pool.acquire() as connection:
+            async with connection.transaction():
+                # outputs removed by the cascade are read first to keep the commitment incremental
+                removed = await connection.fetch(f'SELECT unspent_outputs.tx_hash, unspent_outputs.index FROM unspent_outputs INNER JOIN transactions ON (transactions.tx_hash = unspent_outputs.tx_hash) INNER JOIN blocks ON (blocks.hash = transactions.block_hash) WHERE {condition}', *args, timeout=600)
+                # and so are the balance changes of the removed transactions
+                deltas = await connection.fetch(f'SELECT address_transactions.address, SUM(address_transactions.delta) AS delta FROM address_transactions INNER JOIN blocks ON (blocks.id = address_transactions.block_id) WHERE {condition} GROUP BY address_transactions.address', *args, timeout=600)
+                await connection.execute(f'DELETE FROM blocks WHERE {condition}', *args, timeout=600)
+                await self.update_utxo_commitment(connection, removed=[(row['tx_hash'], row['index']) for row in removed])
+                deltas = {row['address']: -int(row['delta']) for row in deltas}
+                await self.update_address_balances(connection, deltas)
+        self.balance_cache.update(deltas)
+        from .manager import ChainState
+        ChainState.invalidate()
 
     async def delete_block(self, id: int):
-        async with self.pool.acquire() as connection:
-            await connection.execute('DELETE FROM blocks WHERE id = $1', id)
+        await self.delete_blocks_where('blocks.id = $1', id)
+        self.utxo_cache.clear()
 
     async def delete_blocks(self, offset: int):
-        async with self.pool.acquire() as connection:
-            await connection.execute('DELETE FROM blocks WHERE id > $1', offset, timeout=600)
+        await self.delete_blocks_where('blocks.id > $1', offset)
+        self.utxo_cache.clear()
 
     async def remove_blocks(self, block_no: int):
-        blocks_to_remove = await self.get_blocks(block_no, 500)
-        transactions_to_remove = []
-        # cache overwritten tx hashes
-        transactions_hashes = []
-        for block_to_remove in blocks_to_remove:
+        # a window at a time from the tip down, so that the outputs spent by every removed block are restored
+        next_block_id = await self.get_next_block_id()
+        for offset in range(next_block_id - 500, block_no - 500, -500):
+            await self.remove_last_blocks(max(offset, block_no))
+
+    async def remove_last_blocks(self, block_no: int):
+        async with self.pool.acquire() as connection:
             # load transactions of overwritten blocks
-            transactions_to_remove.extend([await Transaction.from_hex(tx, False) for tx in block_to_remove['transactions']])
-            transactions_hashes.extend([sha256(tx) for tx in block_to_remove['transactions']])
+            txs_hex = [row['tx_hex'] for row in await connection.fetch('SELECT tx_hex FROM transactions INNER JOIN blocks ON (blocks.hash = transactions.block_hash) WHERE blocks.id >= $1', block_no, timeout=600)]
+        transactions_to_remove = [await Transaction.from_hex(tx, False) for tx in txs_hex]
+        # cache overwritten tx hashes
+        transactions_hashes = {sha256(tx) for tx in txs_hex}
         outputs_to_be_restored = []
         for transaction in transactions_to_remove:
             if isinstance(transaction, Transaction):
                 # load outputs that has been spent in the overwritten transactions that has not been generated in the overwritten transactions
                 outputs_to_be_restored.extend([(tx_input.tx_hash, tx_input.index) for tx_input in transaction.inputs if tx_input.tx_hash not in transactions_hashes])
-        async with self.pool.acquire() as connection:
-            # delete the blocks, it will also delete transactions and outputs thanks to references
-            await connection.execute('DELETE FROM blocks WHERE id >= $1', block_no, timeout=600)
+        outputs_to_be_restored = await self.get_outputs_records(outputs_to_be_restored)
+        # delete the blocks, it will also delete transactions and outputs thanks to references
+        await self.delete_blocks_where('blocks.id >= $1', block_no)
+        # restored outputs of a previous window can have been deleted by this one
+        self.utxo_cache.clear()
         # add back the outputs to revert the whole chain to the previous state
         await self.add_unspent_outputs(outputs_to_be_restored)
         # add removed transactions to pending transactions, this could be improved by adding only the ones who spend only old inputs
@@ -145,16 +340,7 @@ class Database:
         #    await self.add_pending_transaction(tx, verify=False)
 
     async def get_pending_transactions_limit(self, limit: int = MAX_BLOCK_SIZE_HEX, hex_only: bool = False, check_signatures: bool = True) -> List[Union[Transaction, str]]:
-        async with self.pool.acquire() as connection:
-            txs = await connection.fetch(f'SELECT tx_hex FROM pending_transactions ORDER BY fees / LENGTH(tx_hex) DESC, LENGTH(tx_hex), tx_hex')
-        txs_hex = [tx['tx_hex'] for tx in txs]
-        return_txs = []
-        size = 0
-        for tx in txs_hex:
-            if size + len(tx) > limit:
-                break
-            return_txs.append(tx)
-            size += len(tx)
+        return_txs = [entry.tx_hex for entry in self.mempool.get_ordered(limit)]
         if hex_only:
             return return_txs
         return [await Transaction.from_hex(tx_hex, check_signatures) for tx_hex in return_txs]
@@ -178,45 +364,145 @@ class Database:
             await connection.execute("UPDATE pending_transactions SET propagation_time = NOW() WHERE tx_hash = ANY($1)", txs_hash)
 
     async def get_next_block_average_fee(self):
-        limit = MAX_BLOCK_SIZE_HEX
-        async with self.pool.acquire() as connection:
-            txs = await connection.fetch(f'SELECT LENGTH(tx_hex) as size, fees FROM pending_transactions ORDER BY fees / LENGTH(tx_hex) DESC, LENGTH(tx_hex) ASC')
-        fees = []
-        size = 0
-        for tx in txs:
-            if size + tx['size'] > limit:
-                break
-            fees.append(tx['fees'])
-            size += tx['size']
+        fees = [entry.fees for entry in self.mempool.get_ordered(MAX_BLOCK_SIZE_HEX)]
         return int(mean(fees) * SMALLEST) // Decimal(SMALLEST)
 
     async def get_pending_blocks_count(self):
-        async with self.pool.acquire() as connection:
-            txs = await connection.fetch(f'SELECT LENGTH(tx_hex) as size FROM pending_transactions')
-        return int(sum([tx['size'] for tx in txs]) / MAX_BLOCK_SIZE_HEX + 1)
+        return self.mempool.get_blocks_count()
 
     async def clear_duplicate_pending_transactions(self):
         async with self.pool.acquire() as connection:
-            await connection.execute('DELETE FROM pending_transactions WHERE tx_hash = ANY(SELECT tx_hash FROM transactions)')
+            rows = await connection.fetch('SELECT tx_hash FROM pending_transactions WHERE tx_hash = ANY(SELECT tx_hash FROM transactions)')
+        if rows:
+            await self.remove_pending_transactions_by_hash([row['tx_hash'] for row in rows])
 
     async def add_transaction(self, transaction: Union[Transaction, CoinbaseTransaction], block_hash: str):
         await self.add_transactions([transaction], block_hash)
 
+    async def get_transaction_record(self, transaction: Union[Transaction, CoinbaseTransaction], block_hash: str) -> tuple:
+        return (
+            block_hash,
+            transaction.hash(),
+            transaction.hex(),
+            [point_to_string(await tx_input.get_public_key()) for tx_input in transaction.inputs] if isinstance(transaction, Transaction) else [],
+            [tx_output.address for tx_output in transaction.outputs],
+            [tx_output.units for tx_output in transaction.outputs],
+            transaction.fees if isinstance(transaction, Transaction) else Decimal(0)
+        )
+
+    async def get_address_transactions_records(self, transaction: Union[Transaction, CoinbaseTransaction], block_id: int) -> List[tuple]:
+        # net change of the balance of every address involved in the transaction
+        deltas = {}
+        if isinstance(transaction, Transaction):
+            for tx_input in transaction.inputs:
+                address = point_to_string(await tx_input.get_public_key())
+                deltas[address] = deltas.get(address, 0) - await tx_input.get_units()
+        for tx_output in transaction.outputs:
+            address = get_address_key(tx_output.address)
+            deltas[address] = deltas.get(address, 0) + tx_output.units
+        tx_hash = transaction.hash()
+        return [(address, block_id, tx_hash, delta) for address, delta in deltas.items()]
+
+    @staticmethod
+    def get_address_deltas(address_records: List[tuple]) -> Dict[str, int]:
+        deltas = {}
+        for address, _, _, delta in address_records:
+            deltas[address] = deltas.get(address, 0) + delta
+        return deltas
+
+    async def update_address_balances(self, connection: Connection, deltas: Dict[str, int]) -> None:
+        if deltas:
+            await connection.execute(
+                'INSERT INTO address_balances (address, balance) SELECT * FROM unnest($1::TEXT[], $2::BIGINT[]) ON CONFLICT (address) DO UPDATE SET balance = address_balances.balance + EXCLUDED.balance',
+                list(deltas.keys()), list(deltas.values())
+            )
+
+    async def build_address_balances(self) -> None:
+        async with self.pool.acquire() as connection:
+            async with connection.transaction():
+                # blocks added meanwhile wait for the lock and are applied after the sums
+                await connection.execute('LOCK TABLE address_balances IN EXCLUSIVE MODE')
+                await connection.execute('TRUNCATE address_balances')
+                await connection.execute('INSERT INTO address_balances (address, balance) SELECT address, SUM(delta) FROM address_transactions GROUP BY address', timeout=3600)
+                await self.set_node_state('address_balances_indexed', '1', connection)
+        self.balance_cache.clear()
+        self.address_balances_indexed = True
+
+    async def compute_address_balances(self) -> Dict[str, int]:
+        # balances from the unspent outputs, the same address can be stored in different formats
+        balances = {}
+        async with self.pool.acquire() as connection:
+            async with connection.transaction():
+                async for row in connection.cursor('SELECT address, amount FROM unspent_outputs', prefetch=10_000):
+                    address = get_address_key(row['address'])
+                    balances[address] = balances.get(address, 0) + row['amount']
+        return balances
+
+    async def get_stored_address_balances(self) -> Dict[str, int]:
+        async with self.pool.acquire() as connection:
+            rows = await connection.fetch('SELECT address, balance FROM address_balances WHERE balance != 0', timeout=600)
+        return {row['address']: row['balance'] for row in rows}
+
     async def add_transactions(self, transactions: List[Union[Transaction, CoinbaseTransaction]], block_hash: str):
-        data = []
-        for transaction in transactions:
-            data.append((
-                block_hash,
-                transaction.hash(),
-                transaction.hex(),
-                [point_to_string(await tx_input.get_public_key()) for tx_input in transaction.inputs] if isinstance(transaction, Transaction) else [],
-                [tx_output.address for tx_output in transaction.outputs],
-                [tx_output.amount * SMALLEST for tx_output in transaction.outputs],
-                transaction.fees if isinstance(transaction, Transaction) else 0
+        data = [await self.get_transaction_record(transaction, block_hash) for transaction in transactions]
+        async with self.pool.acquire() as connection:
+            block_id = await connection.fetchval('SELECT id FROM blocks WHERE hash = $1', block_hash)
+            address_records = [record for transaction in transactions for record in await self.get_address_transactions_records(transaction, block_id)]
+            async with connection.transaction():
+                stmt = await connection.prepare('INSERT INTO transactions (block_hash, tx_hash, tx_hex, inputs_addresses, outputs_addresses, outputs_amounts, fees) VALUES ($1, $2, $3, $4, $5, $6, $7)')
+                await stmt.executemany(data)
+                await connection.copy_records_to_table('address_transactions', records=address_records, columns=['address', 'block_id', 'tx_hash', 'delta'])
+                deltas = self.get_address_deltas(address_records)
+                await self.update_address_balances(connection, deltas)
+        self.balance_cache.update(deltas)
+
+    async def add_blocks(self, blocks: List[dict]) -> None:
+        blocks_records, transactions_records, address_records, outputs, spent_outputs, tx_hashes = [], [], [], [], [], []
+        for block in blocks:
+            blocks_records.append((
+                block['id'],
+                block['hash'],
+                block['content'],
+                block['address'],
+                block['random'],
+                block['difficulty'],
+                block['reward'],
+                block['timestamp'] if isinstance(block['timestamp'], datetime) else datetime.utcfromtimestamp(block['timestamp'])
             ))
-        async with self.pool.acquire() as connection:
-            stmt = await connection.prepare('INSERT INTO transactions (block_hash, tx_hash, tx_hex, inputs_addresses, outputs_addresses, outputs_amounts, fees) VALUES ($1, $2, $3, $4, $5, $6, $7)')
-            await stmt.executemany(data)
+            for transaction in [block['coinbase_transaction']] + block['transactions']:
+                transactions_records.append(await self.get_transaction_record(transaction, block['hash']))
+                address_records.extend(await self.get_address_transactions_records(transaction, block['id']))
+                outputs.extend((transaction.hash(), index, output.units, output.address, block['id']) for index, output in enumerate(transaction.outputs))
+            for transaction in block['transactions']:
+                spent_outputs.extend((tx_input.tx_hash, tx_input.index) for tx_input in transaction.inputs)
+                tx_hashes.append(transaction.hash())
+        # pending transactions spending the same outputs as the added ones are double spends now
+        pending_hashes = list(dict.fromkeys(tx_hashes + self.mempool.get_conflicts(spent_outputs)))
+        async with self.pool.acquire() as connection:
+            async with connection.transaction():
+                # new rows are copied straight into the tables: one which already exists breaks a unique key and
+                # rolls back the whole batch, like the single inserts did. the spent outputs are staged to be deleted with a join
+                await connection.copy_records_to_table('blocks', records=blocks_records, columns=['id', 'hash', 'content', 'address', 'random', 'difficulty', 'reward', 'timestamp'])
+                await connection.copy_records_to_table('transactions', records=transactions_records, columns=['block_hash', 'tx_hash', 'tx_hex', 'inputs_addresses', 'outputs_addresses', 'outputs_amounts', 'fees'])
+                await connection.copy_records_to_table('address_transactions', records=address_records, columns=['address', 'block_id', 'tx_hash', 'delta'])
+                deltas = self.get_address_deltas(address_records)
+                await self.update_address_balances(connection, deltas)
+                await connection.copy_records_to_table('unspent_outputs', records=outputs, columns=['tx_hash', 'index', 'amount', 'address', 'block_id'])
+                if spent_outputs:
+                    await connection.execute(f'CREATE TEMP TABLE IF NOT EXISTS spent_outputs_staging (tx_hash {self.hash_type}, index SMALLINT) ON COMMIT DELETE ROWS')
+                    await connection.copy_records_to_table('spent_outputs_staging', records=spent_outputs, columns=['tx_hash', 'index'])
+                    removed = await connection.fetch('DELETE FROM unspent_outputs USING spent_outputs_staging WHERE unspent_outputs.tx_hash = spent_outputs_staging.tx_hash AND unspent_outputs.index = spent_outputs_staging.index RETURNING unspent_outputs.tx_hash, unspent_outputs.index')
+                    await connection.execute('DELETE FROM pending_spent_outputs USING spent_outputs_staging WHERE pending_spent_outputs.tx_hash = spent_outputs_staging.tx_hash AND pending_spent_outputs.index = spent_outputs_staging.index')
+                    await self.delete_pending_transactions(connection, pending_hashes)
+                else:
+                    removed = []
+                await self.update_utxo_commitment(connection, [output[:2] for output in outputs], [(row['tx_hash'], row['index']) for row in removed])
+        self.utxo_cache.add([output[:4] for output in outputs])
+        self.utxo_cache.remove(spent_outputs)
+        self.balance_cache.update(deltas)
+        self.mempool.remove(pending_hashes)
+        from .manager import ChainState
+        ChainState.blocks_added(blocks)
 
     async def add_block(self, id: int, block_hash: str, block_content: str, address: str, random: int, difficulty: Decimal, reward: Decimal, timestamp: Union[datetime, int]):
         async with self.pool.acquire() as connection:
@@ -231,8 +517,8 @@ class Database:
                 reward,
                 timestamp if isinstance(timestamp, datetime) else datetime.utcfromtimestamp(timestamp)
             )
-        from .manager import Manager
-        Manager.difficulty = None
+        from .manager import ChainState
+        ChainState.invalidate()
 
     async def get_transaction(self, tx_hash: str, check_signatures: bool = True) -> Union[Transaction, CoinbaseTransaction]:
         async with self.pool.acquire() as connection:
@@ -254,14 +540,12 @@ class Database:
 
 
     async def get_pending_transaction(self, tx_hash: str, check_signatures: bool = True) -> Transaction:
-        async with self.pool.acquire() as connection:
-            res = await connection.fetchrow('SELECT tx_hex FROM pending_transactions WHERE tx_hash = $1', tx_hash)
-        return await Transaction.from_hex(res['tx_hex'], check_signatures) if res is not None else None
+        entry = self.mempool.get(tx_hash)
+        return await Transaction.from_hex(entry.tx_hex, check_signatures) if entry is not None else None
 
     async def get_pending_transactions_by_hash(self, hashes: List[str], check_signatures: bool = True) -> List[Transaction]:
-        async with self.pool.acquire() as connection:
-            res = await connection.fetch('SELECT tx_hex FROM pending_transactions WHERE tx_hash = ANY($1)', hashes)
-        return [await Transaction.from_hex(tx['tx_hex'], check_signatures) for tx in res]
+        entries = [self.mempool.get(tx_hash) for tx_hash in dict.fromkeys(hashes)]
+        return [await Transaction.from_hex(entry.tx_hex, check_signatures) for entry in entries if entry is not None]
 
     async def get_transactions(self, tx_hashes: List[str]):
         async with self.pool.acquire() as connection:
@@ -272,40 +556,19 @@ class Database:
         async with self.pool.acquire() as connection:
             if ignore is not None:
                 res = await connection.fetchrow(
-                    'SELECT tx_hash FROM transactions WHERE tx_hex LIKE ANY($1) AND tx_hash != $2 LIMIT 1',
+                    f'SELECT tx_hash FROM transactions WHERE {self.tx_hex_text} LIKE ANY($1) AND tx_hash != $2 LIMIT 1',
                     [f"%{contains}%" for contains in contains],
                     ignore
                 )
             else:
                 res = await connection.fetchrow(
-                    'SELECT tx_hash FROM transactions WHERE tx_hex LIKE ANY($1) LIMIT 1',
+                    f'SELECT tx_hash FROM transactions WHERE {self.tx_hex_text} LIKE ANY($1) LIMIT 1',
                     [f"%{contains}%" for contains in contains],
                 )
         return res['tx_hash'] if res is not None else None
 
-    async def get_pending_transactions_by_contains(self, contains: str):
-        async with self.pool.acquire() as connection:
-            res = await connection.fetch('SELECT tx_hex FROM pending_transactions WHERE tx_hex LIKE $1 AND tx_hash != $2', f"%{contains}%", contains)
-        return [await Transaction.from_hex(res['tx_hex']) for res in res] if res is not None else None
-
-    async def remove_pending_transactions_by_contains(self, search: List[str]) -> None:
-        async with self.pool.acquire() as connection:
-            await connection.execute('DELETE FROM pending_transactions WHERE tx_hex LIKE ANY($1)', [f"%{c}%" for c in search])
-
-    async def get_pending_transaction_by_contains_multi(self, contains: List[str], ignore: str = None):
-        async with self.pool.acquire() as connection:
-            if ignore is not None:
-                res = await connection.fetchrow(
-                    'SELECT tx_hex FROM pending_transactions WHERE tx_hex LIKE ANY($1) AND tx_hash != $2 LIMIT 1',
-                    [f"%{contains}%" for contains in contains],
-                    ignore
-                )
-            else:
-                res = await connection.fetchrow(
-                    'SELECT tx_hex FROM pending_transactions WHERE tx_hex LIKE ANY($1) LIMIT 1',
-                    [f"%{contains}%" for contains in contains],
-                )
-        return await Transaction.from_hex(res['tx_hex']) if res is not None else None
+    async def get_pending_transactions_spending(self, outputs: List[Tuple[str, int]], check_signatures: bool = True) -> List[Transaction]:
+        return await self.get_pending_transactions_by_hash(self.mempool.get_conflicts(outputs), check_signatures)
 
     async def get_last_block(self) -> dict:
         async with self.pool.acquire() as connection:
@@ -313,10 +576,8 @@ class Database:
         return normalize_block(last_block) if last_block is not None else None
 
     async def get_next_block_id(self) -> int:
-        async with self.pool.acquire() as connection:
-            last_id = await connection.fetchval('SELECT id FROM blocks ORDER BY id DESC LIMIT 1', column=0)
-        last_id = last_id if last_id is not None else 0
-        return last_id + 1
+        from .manager import ChainState
+        return await ChainState.get_next_block_id()
 
     async def get_block(self, block_hash: str) -> dict:
         async with self.pool.acquire() as connection:
@@ -347,6 +608,31 @@ class Database:
             })
         return result
 
+    async def get_block_headers(self, offset: int, limit: int) -> List[dict]:
+        async with self.pool.acquire() as connection:
+            blocks = await connection.fetch('SELECT id, hash, content, difficulty, timestamp FROM blocks WHERE id >= $1 ORDER BY id LIMIT $2', offset, limit)
+        return [{
+            'id': block['id'],
+            'hash': block['hash'],
+            'content': block['content'],
+            'difficulty': block['difficulty'],
+            'timestamp': int(block['timestamp'].replace(tzinfo=timezone.utc).timestamp())
+        } for block in blocks]
+
+    async def stream_blocks(self, offset: int, limit: int):
+        # blocks are read through a server side cursor, only a few of them are in memory at once
+        async with self.pool.acquire() as connection:
+            async with connection.transaction():
+                cursor = connection.cursor('SELECT blocks.*, ARRAY(SELECT tx_hex FROM transactions WHERE transactions.block_hash = blocks.hash) AS transactions_hex FROM blocks WHERE id >= $1 ORDER BY id LIMIT $2', offset, limit, prefetch=10)
+                async for row in cursor:
+                    block = dict(row)
+                    txs = block.pop('transactions_hex')
+                    block = normalize_block(block)
+                    yield {
+                        'block': block,
+                        'transactions': OLD_BLOCKS_TRANSACTIONS_ORDER.get(block['hash']) or txs
+                    }
+
     async def get_block_by_id(self, block_id: int) -> dict:
         async with self.pool.acquire() as connection:
             block = await connection.fetchrow('SELECT * FROM blocks WHERE id = $1', block_id)
@@ -359,7 +645,7 @@ class Database:
 
     async def get_block_transaction_hashes(self, block_hash: str) -> List[str]:
         async with self.pool.acquire() as connection:
-            txs = await connection.fetch("SELECT tx_hash FROM transactions WHERE block_hash = $1 AND tx_hex NOT LIKE '%' || block_hash || '%'", block_hash)
+            txs = await connection.fetch('SELECT tx_hash FROM transactions WHERE block_hash = $1 AND POSITION(block_hash IN tx_hex) = 0', block_hash)
         return [tx['tx_hash'] for tx in txs]
 
     async def get_block_nice_transactions(self, block_hash: str) -> List[dict]:
@@ -367,14 +653,32 @@ class Database:
             txs = await connection.fetch('SELECT tx_hash, inputs_addresses FROM transactions WHERE block_hash = $1', block_hash)
         return [{'hash': tx['tx_hash'], 'is_coinbase': not tx['inputs_addresses']} for tx in txs]
 
-    async def add_unspent_outputs(self, outputs: List[Tuple[str, int]]) -> None:
+    async def add_unspent_outputs(self, outputs: List[Tuple[str, int, int, str, int]]) -> None:
+        # (tx_hash, index, amount, address, block_id), as add_blocks writes them
         if not outputs:
             return
         async with self.pool.acquire() as connection:
-            if len(outputs[0]) == 2:
-                await connection.executemany('INSERT INTO unspent_outputs (tx_hash, index) VALUES ($1, $2)', outputs)
-            elif len(outputs[0]) == 3:
-                await connection.executemany('INSERT INTO unspent_outputs (tx_hash, index, address) VALUES ($1, $2, $3)', outputs)
+            async with connection.transaction():
+                await connection.copy_records_to_table('unspent_outputs', records=outputs, columns=['tx_hash', 'index', 'amount', 'address', 'block_id'])
+                await self.update_utxo_commitment(connection, [output[:2] for output in outputs])
+        self.utxo_cache.add([output[:4] for output in outputs])
+
+    async def get_outputs_records(self, outputs: List[Tuple[str, int]]) -> List[Tuple[str, int, int, str, int]]:
+        async with self.pool.acquire() as connection:
+            rows = await connection.fetch('SELECT transactions.tx_hash, tx_hex, outputs_addresses, outputs_amounts, blocks.id AS block_id FROM transactions INNER JOIN blocks ON (blocks.hash = transactions.block_hash) WHERE transactions.tx_hash = ANY($1)', list({tx_hash for tx_hash, _ in outputs}))
+        txs = {row['tx_hash']: row for row in rows}
+        records = []
+        for tx_hash, index in outputs:
+            tx = txs.get(tx_hash)
+            if tx is None:
+                raise Exception(f'transaction {tx_hash} of output {index} not found')
+            if tx['outputs_amounts'] is None:
+                # not indexed yet
+                tx_output = (await Transaction.from_hex(tx['tx_hex'], False)).outputs[index]
+                records.append((tx_hash, index, tx_output.units, tx_output.address, tx['block_id']))
+            else:
+                records.append((tx_hash, index, tx['outputs_amounts'][index], tx['outputs_addresses'][index], tx['block_id']))
+        return records
 
     async def add_pending_spent_outputs(self, outputs: List[Tuple[str, int]]) -> None:
         async with self.pool.acquire() as connection:
@@ -385,17 +689,20 @@ class Database:
         async with self.pool.acquire() as connection:
             await connection.executemany('INSERT INTO pending_spent_outputs (tx_hash, index) VALUES ($1, $2)', outputs)
 
-    async def add_unspent_transactions_outputs(self, transactions: List[Transaction]) -> None:
-        outputs = sum([[(transaction.hash(), index, output.address) for index, output in enumerate(transaction.outputs)] for transaction in transactions], [])
-        await self.add_unspent_outputs(outputs)
+    async def add_unspent_transactions_outputs(self, transactions: List[Transaction], block_id: int) -> None:
+        await self.add_unspent_outputs([(transaction.hash(), index, output.units, output.address, block_id) for transaction in transactions for index, output in enumerate(transaction.outputs)])
 
     async def remove_unspent_outputs(self, transactions: List[Transaction]) -> None:
         inputs = sum([[(tx_input.tx_hash, tx_input.index) for tx_input in transaction.inputs] for transaction in transactions], [])
         try:
             async with self.pool.acquire() as connection:
-                await connection.execute('DELETE FROM unspent_outputs WHERE (tx_hash, index) = ANY($1::tx_output[])', inputs)
+                async with connection.transaction():
+                    removed = await connection.fetch('DELETE FROM unspent_outputs WHERE (tx_hash, index) = ANY($1::tx_output[]) RETURNING tx_hash, index', inputs)
+                    await self.update_utxo_commitment(connection, removed=[(row['tx_hash'], row['index']) for row in removed])
         except:
             await self.remove_unspent_outputs(transactions)
+            return
+        self.utxo_cache.remove(inputs)
 
     async def remove_pending_spent_outputs(self, transactions: List[Transaction]) -> None:
         inputs = sum([[(tx_input.tx_hash, tx_input.index) for tx_input in transaction.inputs] for transaction in transactions], [])
@@ -403,19 +710,110 @@ class Database:
             await connection.execute('DELETE FROM pending_spent_outputs WHERE (tx_hash, index) = ANY($1::tx_output[])', inputs)
 
     async def get_unspent_outputs(self, outputs: List[Tuple[str, int]]) -> List[Tuple[str, int]]:
+        found, missing = self.utxo_cache.get(outputs)
+        if not missing:
+            return found
         async with self.pool.acquire() as connection:
-            results = await connection.fetch('SELECT tx_hash, index FROM unspent_outputs WHERE (tx_hash, index) = ANY($1::tx_output[])', outputs)
-            return [(row['tx_hash'], row['index']) for row in results]
+            results = await connection.fetch('SELECT tx_hash, index, address, amount FROM unspent_outputs WHERE (tx_hash, index) = ANY($1::tx_output[])', missing)
+        self.utxo_cache.add([(row['tx_hash'], row['index'], row['amount'], row['address']) for row in results])
+        return found + [(row['tx_hash'], row['index']) for row in results]
+
+    async def load_utxo_cache(self) -> None:
+        if not self.utxo_cache.max_size:
+            return
+        async with self.pool.acquire() as connection:
+            results = await connection.fetch('SELECT tx_hash, index, address, amount FROM unspent_outputs LIMIT $1', self.utxo_cache.max_size, timeout=600)
+        self.utxo_cache.add([(row['tx_hash'], row['index'], row['amount'], row['address']) for row in results])
 
     async def get_unspent_outputs_hash(self) -> str:
+        return '%064x' % await self.get_utxo_commitment()
+
+    async def get_utxo_commitment(self) -> int:
+        async with self.pool.acquire() as connection:
+            return int(await connection.fetchval("SELECT value FROM node_state WHERE key = 'utxo_commitment'"))
+
+    async def get_node_state(self, key: str, connection: Connection = None) -> str:
+        if connection is None:
+            async with self.pool.acquire() as connection:
+                return await connection.fetchval('SELECT value FROM node_state WHERE key = $1', key)
+        return await connection.fetchval('SELECT value FROM node_state WHERE key = $1', key)
+
+    async def set_node_state(self, key: str, value: str, connection: Connection = None) -> None:
+        query = 'INSERT INTO node_state (key, value) VALUES ($1, $2) ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value'
+        if connection is None:
+            async with self.pool.acquire() as connection:
+                await connection.execute(query, key, value)
+        else:
+            await connection.execute(query, key, value)
+
+    async def set_utxo_commitment(self, commitment: int) -> None:
         async with self.pool.acquire() as connection:
-            rows = await connection.fetch('SELECT tx_hash, index FROM unspent_outputs ORDER BY tx_hash, index')
-            return sha256(''.join(row['tx_hash'] + bytes([row['index']]).hex() for row in rows))
+            await connection.execute("INSERT INTO node_state (key, value) VALUES ('utxo_commitment', $1) ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value", str(commitment))
+
+    async def update_utxo_commitment(self, connection: Connection, added: List[Tuple[str, int]] = (), removed: List[Tuple[str, int]] = ()) -> None:
+        delta = (get_utxo_commitment(added) - get_utxo_commitment(removed)) % UTXO_COMMITMENT_MODULUS
+        if delta:
+            # the sum is done by postgres so concurrent updates cannot overwrite each other
+            await connection.execute(
+                "UPDATE node_state SET value = MOD(value::NUMERIC + $1, $2)::TEXT WHERE key = 'utxo_commitment'",
+                Decimal(delta), Decimal(UTXO_COMMITMENT_MODULUS)
+            )
+
+    async def compute_utxo_commitment(self) -> int:
+        commitment = 0
+        async with self.pool.acquire() as connection:
+            async with connection.transaction():
+                outputs = []
+                async for row in connection.cursor('SELECT tx_hash, index FROM unspent_outputs', prefetch=10_000):
+                    outputs.append((row['tx_hash'], row['index']))
+                    if len(outputs) == 10_000:
+                        commitment += get_utxo_commitment(outputs)
+                        outputs = []
+                commitment += get_utxo_commitment(outputs)
+        return commitment % UTXO_COMMITMENT_MODULUS
+
+    async def get_tables_sizes(self) -> Dict[str, Tuple[int, int]]:
+        async with self.pool.acquire() as connection:
+            rows = await connection.fetch("SELECT relname, pg_table_size(oid) AS table_size, pg_indexes_size(oid) AS indexes_size FROM pg_class WHERE relname = ANY($1) AND relkind = 'r'", list(BINARY_COLUMNS))
+        return {row['relname']: (row['table_size'], row['indexes_size']) for row in rows}
+
+    async def migrate_binary_schema(self) -> None:
+        tables = list(BINARY_COLUMNS)
+        async with self.pool.acquire() as connection:
+            async with connection.transaction():
+                # foreign keys cannot stay across the type change, they are added back after it
+                foreign_keys = await connection.fetch("SELECT conrelid::regclass::TEXT AS table_name, conname, pg_get_constraintdef(oid) AS definition FROM pg_constraint WHERE contype = 'f' AND conrelid = ANY($1::regclass[])", tables)
+                for foreign_key in foreign_keys:
+                    await connection.execute(f'ALTER TABLE {foreign_key["table_name"]} DROP CONSTRAINT "{foreign_key["conname"]}"')
+                for table, columns in BINARY_COLUMNS.items():
+                    print(f'Converting {table}')
+                    alter = ', '.join(f"ALTER COLUMN {column} TYPE BYTEA USING decode({column}, 'hex')" for column in columns)
+                    await connection.execute(f'ALTER TABLE {table} {alter}', timeout=3600)
+                for foreign_key in foreign_keys:
+                    await connection.execute(f'ALTER TABLE {foreign_key["table_name"]} ADD CONSTRAINT "{foreign_key["conname"]}" {foreign_key["definition"]}', timeout=3600)
+                await connection.execute('DROP TYPE IF EXISTS tx_output')
+                await connection.execute('CREATE TYPE tx_output AS (tx_hash BYTEA, index SMALLINT)')
+                await self.set_node_state('binary_schema', '1', connection)
+        # connections opened before the migration keep the old tx_output type
+        await self.pool.expire_connections()
+        self.set_binary_schema(True)
 
     async def get_pending_spent_outputs(self, outputs: List[Tuple[str, int]]) -> List[Tuple[str, int]]:
+        return self.mempool.get_spent_outputs(outputs)
+
+    async def set_unspent_outputs_amounts(self):
         async with self.pool.acquire() as connection:
-            results = await connection.fetch('SELECT tx_hash, index FROM pending_spent_outputs WHERE (tx_hash, index) = ANY($1::tx_output[])', outputs)
-            return [(row['tx_hash'], row['index']) for row in results]
+            await connection.execute('UPDATE unspent_outputs SET amount = transactions.outputs_amounts[unspent_outputs.index + 1], block_id = blocks.id FROM transactions INNER JOIN blocks ON (blocks.hash = transactions.block_hash) WHERE transactions.tx_hash = unspent_outputs.tx_hash AND (unspent_outputs.amount IS NULL OR unspent_outputs.block_id IS NULL)', timeout=3600)
+
+    async def check_unspent_outputs_addresses(self, connection: Connection) -> None:
+        # every output added after this has its address, so the check runs only once
+        if self.unspent_outputs_addresses or not self.is_indexed:
+            return
+        if await connection.fetchval('SELECT 1 FROM unspent_outputs WHERE address IS NULL LIMIT 1') is not None:
+            print('Setting unspent outputs addresses')
+            await self.set_unspent_outputs_addresses()
+        await self.set_node_state('unspent_outputs_addresses', '1', connection)
+        self.unspent_outputs_addresses = True
 
     async def set_unspent_outputs_addresses(self):
         assert self.is_indexed, 'cannot set unspent outputs addresses if addresses are not indexed'
@@ -439,30 +837,63 @@ class Database:
         return list(outputs)
 
     async def get_address_transactions(self, address: str, check_pending_txs: bool = False, check_signatures: bool = False, limit: int = 50) -> List[Union[Transaction, CoinbaseTransaction]]:
-        point = string_to_point(address)
-        search = ['%' + point_to_bytes(string_to_point(address), address_format).hex() + '%' for address_format in list(AddressFormat)]
-        addresses = [point_to_string(point, address_format) for address_format in list(AddressFormat)]
-        async with self.pool.acquire() as connection:
-            txs = await connection.fetch('SELECT tx_hex, blocks.id AS block_no FROM transactions INNER JOIN blocks ON (transactions.block_hash = blocks.hash) WHERE $1 && inputs_addresses OR $1 && outputs_addresses ORDER BY block_no DESC LIMIT $2', addresses, limit)
-            if check_pending_txs:
-                txs = await connection.fetch("SELECT tx_hex FROM pending_transactions WHERE tx_hex LIKE ANY($1) OR $2 && inputs_addresses", search, addresses) + txs
-        return [await Transaction.from_hex(tx['tx_hex'], check_signatures) for tx in txs]
+        txs, _ = await self.get_address_transactions_page(address, limit, check_signatures=check_signatures)
+        if check_pending_txs:
+            txs = [await Transaction.from_hex(entry.tx_hex, check_signatures) for entry in self.mempool.get_address_transactions(address)] + txs
+        return txs
+
+    async def get_address_transactions_page(self, address: str, limit: int = 50, cursor: str = None, check_signatures: bool = False) -> Tuple[List[Union[Transaction, CoinbaseTransaction]], str]:
+        # newest first, cursor is '<block id>:<tx hash>' of the last transaction of the previous page
+        block_id, tx_hash = cursor.split(':') if cursor else (2 ** 31 - 1, 'f' * 64)
+        async with self.pool.acquire() as connection:
+            if not self.address_transactions_indexed:
+                # the backfill runs in another process
+                self.address_transactions_indexed = await self.get_node_state('address_transactions_indexed', connection) is not None
+            if self.address_transactions_indexed:
+                txs = await connection.fetch('SELECT tx_hex, address_transactions.block_id, address_transactions.tx_hash FROM address_transactions INNER JOIN transactions ON (transactions.tx_hash = address_transactions.tx_hash) WHERE address = $1 AND (address_transactions.block_id, address_transactions.tx_hash) < ($2, $3) ORDER BY address_transactions.block_id DESC, address_transactions.tx_hash DESC LIMIT $4', get_address_key(address), int(block_id), tx_hash, limit)
+            else:
+                point = string_to_point(address)
+                addresses = [point_to_string(point, address_format) for address_format in list(AddressFormat)]
+                txs = await connection.fetch('SELECT tx_hex, blocks.id AS block_id, transactions.tx_hash FROM transactions INNER JOIN blocks ON (transactions.block_hash = blocks.hash) WHERE ($1 && inputs_addresses OR $1 && outputs_addresses) AND (blocks.id, transactions.tx_hash) < ($2, $3) ORDER BY blocks.id DESC, transactions.tx_hash DESC LIMIT $4', addresses, int(block_id), tx_hash, limit)
+        next_cursor = f'{txs[-1]["block_id"]}:{txs[-1]["tx_hash"]}' if len(txs) == limit else None
+        return [await Transaction.from_hex(tx['tx_hex'], check_signatures) for tx in txs], next_cursor
+
+    async def backfill_address_transactions(self, batch_size: int = 1000) -> None:
+        async with self.pool.acquire() as connection:
+            last_id = await connection.fetchval('SELECT MAX(id) FROM blocks') or 0
+            # resumes where a previous run stopped
+            start = int(await self.get_node_state('address_transactions_backfill', connection) or 0)
+        for offset in range(start, last_id + 1, batch_size):
+            async with self.pool.acquire() as connection:
+                rows = await connection.fetch('SELECT tx_hex, blocks.id AS block_id FROM transactions INNER JOIN blocks ON (transactions.block_hash = blocks.hash) WHERE blocks.id >= $1 AND blocks.id < $2', offset, offset + batch_size, timeout=600)
+            transactions = [(await Transaction.from_hex(row['tx_hex'], False), row['block_id']) for row in rows]
+            input_txs = await self.get_transactions_info(list({tx_input.tx_hash for transaction, _ in transactions if isinstance(transaction, Transaction) for tx_input in transaction.inputs}))
+            records = []
+            for transaction, block_id in transactions:
+                if isinstance(transaction, Transaction):
+                    for tx_input in transaction.inputs:
+                        info = input_txs.get(tx_input.tx_hash)
+                        if info is not None and info['outputs_amounts'] is None:
+                            tx_input.transaction = await Transaction.from_hex(info['tx_hex'], False)
+                        else:
+                            tx_input.transaction_info = info
+                records.extend(await self.get_address_transactions_records(transaction, block_id))
+            async with self.pool.acquire() as connection:
+                async with connection.transaction():
+                    await connection.executemany('INSERT INTO address_transactions (address, block_id, tx_hash, delta) VALUES ($1, $2, $3, $4) ON CONFLICT DO NOTHING', records)
+                    await self.set_node_state('address_transactions_backfill', str(offset + batch_size), connection)
+            print(f'Indexed addresses of blocks up to {min(offset + batch_size, last_id + 1) - 1}')
+        await self.set_node_state('address_transactions_indexed', '1')
+        self.address_transactions_indexed = True
+        await self.build_address_balances()
 
     async def get_address_pending_transactions(self, address: str, check_signatures: bool = False) -> List[Union[Transaction, CoinbaseTransaction]]:
-        point = string_to_point(address)
-        search = ['%' + point_to_bytes(string_to_point(address), address_format).hex() + '%' for address_format in list(AddressFormat)]
-        addresses = [point_to_string(point, address_format) for address_format in list(AddressFormat)]
-        async with self.pool.acquire() as connection:
-            txs = await connection.fetch("SELECT tx_hex FROM pending_transactions WHERE tx_hex LIKE ANY($1) OR $2 && inputs_addresses", search, addresses)
-        return [await Transaction.from_hex(tx['tx_hex'], check_signatures) for tx in txs]
+        return [await Transaction.from_hex(entry.tx_hex, check_signatures) for entry in self.mempool.get_address_transactions(address)]
 
     async def get_address_pending_spent_outputs(self, address: str, check_signatures: bool = False) -> List[Union[Transaction, CoinbaseTransaction]]:
-        point = string_to_point(address)
-        addresses = [point_to_string(point, address_format) for address_format in list(AddressFormat)]
-        async with self.pool.acquire() as connection:
-            txs = await connection.fetch("SELECT tx_hex FROM pending_transactions WHERE $1 && inputs_addresses", addresses)
-            txs = [await Transaction.from_hex(tx['tx_hex'], check_signatures) for tx in txs]
-        return sum([[{'tx_hash': tx_input.tx_hash, 'index': tx_input.index} for tx_input in tx.inputs] for tx in txs], [])
+        address_key = point_to_string(string_to_point(address))
+        entries = [entry for entry in self.mempool.get_address_transactions(address) if address_key in entry.inputs_addresses]
+        return [{'tx_hash': tx_hash, 'index': index} for entry in entries for tx_hash, index in entry.inputs]
 
     async def get_spendable_outputs(self, address: str, check_pending_txs: bool = False) -> List[TransactionInput]:
         point = string_to_point(address)
@@ -471,25 +902,46 @@ class Database:
         addresses.reverse()
         search.reverse()
         async with self.pool.acquire() as connection:
-            if await connection.fetchrow('SELECT tx_hash, index FROM unspent_outputs WHERE address IS NULL') is not None:
-                await self.set_unspent_outputs_addresses()
+            await self.check_unspent_outputs_addresses(connection)
             if not check_pending_txs:
-                unspent_outputs = await connection.fetch('SELECT unspent_outputs.tx_hash, index, transactions.outputs_amounts[index + 1] AS amount FROM unspent_outputs INNER JOIN transactions ON (transactions.tx_hash = unspent_outputs.tx_hash) WHERE address = ANY($1)', addresses)
+                unspent_outputs = await connection.fetch('SELECT tx_hash, index, amount FROM unspent_outputs WHERE address = ANY($1)', addresses)
             else:
-                unspent_outputs = await connection.fetch('SELECT unspent_outputs.tx_hash, index, transactions.outputs_amounts[index + 1] AS amount FROM unspent_outputs INNER JOIN transactions ON (transactions.tx_hash = unspent_outputs.tx_hash) WHERE address = ANY($1) AND CONCAT(unspent_outputs.tx_hash, unspent_outputs.index) != ALL(SELECT CONCAT(pending_spent_outputs.tx_hash, pending_spent_outputs.index) FROM pending_spent_outputs)', addresses, timeout=60)
-        return [TransactionInput(tx_hash, index, amount=Decimal(amount) / SMALLEST, public_key=point) for tx_hash, index, amount in unspent_outputs]
+                unspent_outputs = await connection.fetch('SELECT tx_hash, index, amount FROM unspent_outputs WHERE address = ANY($1) AND NOT EXISTS (SELECT 1 FROM pending_spent_outputs WHERE pending_spent_outputs.tx_hash = unspent_outputs.tx_hash AND pending_spent_outputs.index = unspent_outputs.index)', addresses)
+        return [TransactionInput(tx_hash, index, units=amount, public_key=point) for tx_hash, index, amount in unspent_outputs]
 
     async def get_address_balance(self, address: str, check_pending_txs: bool = False) -> Decimal:
+        if not self.address_balances_indexed:
+            self.address_balances_indexed = await self.get_node_state('address_balances_indexed') is not None
+        if not self.address_balances_indexed:
+            return await self.get_address_balance_from_outputs(address, check_pending_txs)
+        address_key = get_address_key(address)
+        units = self.balance_cache.get(address_key)
+        if units is None:
+            async with self.pool.acquire() as connection:
+                units = await connection.fetchval('SELECT balance FROM address_balances WHERE address = $1', address_key) or 0
+            self.balance_cache.add(address_key, units)
+        if check_pending_txs:
+            entries = self.mempool.get_address_transactions(address)
+            # outputs of this address spent by pending transactions
+            spent_outputs = [output for entry in entries if address_key in entry.inputs_addresses for output in entry.inputs]
+            if spent_outputs:
+                point = string_to_point(address)
+                addresses = [point_to_string(point, address_format) for address_format in list(AddressFormat)]
+                async with self.pool.acquire() as connection:
+                    units -= await connection.fetchval('SELECT COALESCE(SUM(amount), 0) FROM unspent_outputs WHERE (tx_hash, index) = ANY($1::tx_output[]) AND address = ANY($2)', spent_outputs, addresses)
+            for entry in entries:
+                tx = await Transaction.from_hex(entry.tx_hex, check_signatures=False)
+                units += sum(tx_output.units for tx_output in tx.outputs if get_address_key(tx_output.address) == address_key)
+        return Decimal(units) / SMALLEST
+
+    async def get_address_balance_from_outputs(self, address: str, check_pending_txs: bool = False) -> Decimal:
         point = string_to_point(address)
-        search = ['%'+point_to_bytes(string_to_point(address), address_format).hex()+'%' for address_format in list(AddressFormat)]
         addresses = [point_to_string(point, address_format) for address_format in list(AddressFormat)]
         tx_inputs = await self.get_spendable_outputs(address, check_pending_txs=check_pending_txs)
         balance = sum([tx_input.amount for tx_input in tx_inputs], Decimal(0))
         if check_pending_txs:
-            async with self.pool.acquire() as connection:
-                txs = await connection.fetch('SELECT tx_hex FROM pending_transactions WHERE tx_hex LIKE ANY($1)', search)
-            for tx in txs:
-                tx = await Transaction.from_hex(tx['tx_hex'], check_signatures=False)
+            for entry in self.mempool.get_address_transactions(address):
+                tx = await Transaction.from_hex(entry.tx_hex, check_signatures=False)
                 for i, tx_output in enumerate(tx.outputs):
                     if tx_output.address in addresses:
                         balance += tx_output.amount
@@ -499,9 +951,9 @@ class Database:
         point = string_to_point(address)
         addresses = [point_to_string(point, address_format) for address_format in list(AddressFormat)]
         async with self.pool.acquire() as connection:
-            unspent_outputs = await connection.fetch('SELECT unspent_outputs.tx_hash, index, transactions.outputs_amounts[index + 1] AS amount FROM unspent_outputs INNER JOIN transactions ON (transactions.tx_hash = unspent_outputs.tx_hash) INNER JOIN blocks ON (blocks.hash = transactions.block_hash) WHERE unspent_outputs.address = ANY($1) AND blocks.id >= $2', addresses, block_no)
+            unspent_outputs = await connection.fetch('SELECT tx_hash, index, amount FROM unspent_outputs WHERE address = ANY($1) AND block_id >= $2', addresses, block_no)
             spending_txs = await connection.fetch('SELECT tx_hex, blocks.id AS block_no FROM transactions INNER JOIN blocks ON (transactions.block_hash = blocks.hash) WHERE $1 = ANY(inputs_addresses) AND blocks.id >= $2 LIMIT $2', address, block_no)
-        unspent_outputs = [TransactionInput(tx_hash, index, amount=Decimal(amount) / SMALLEST, public_key=point) for tx_hash, index, amount in unspent_outputs]
+        unspent_outputs = [TransactionInput(tx_hash, index, units=amount, public_key=point) for tx_hash, index, amount in unspent_outputs]
         spending_txs = [await Transaction.from_hex(tx['tx_hex'], False) for tx in spending_txs]
         spent_outputs = sum([tx.inputs for tx in spending_txs], [])
         return unspent_outputs, spent_outputs
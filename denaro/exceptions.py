@@ -1,2 +1,7 @@
 class DoubleSpendException(Exception):
-    pass
\ No newline at end of file
+    pass
+
+class RateLimitedException(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__(f'rate limited, retry after {retry_after}s')
+        self.retry_after = retry_after
@@ -1,11 +1,13 @@
 import hashlib
 import json
 import logging
+import os
 import sys
+from collections import OrderedDict
 from enum import Enum
 from math import ceil
 from datetime import datetime, timezone
-from typing import Union
+from typing import Union, Tuple, Callable, Hashable
 
 import base58
 from fastecdsa.point import Point
@@ -42,6 +44,14 @@ def sha256(message: Union[str, bytes]):
     return hashlib.sha256(message).hexdigest()
 
 
+# additive multiset hash of the unspent outputs: adding or removing an output only adds or subtracts its own hash
+UTXO_COMMITMENT_MODULUS = 2 ** 256
+
+
+def get_utxo_commitment(outputs) -> int:
+    return sum(int(sha256(tx_hash + index.to_bytes(2, ENDIAN).hex()), 16) for tx_hash, index in outputs) % UTXO_COMMITMENT_MODULUS
+
+
 def byte_length(i: int):
     return ceil(i.bit_length() / 8.0)
 
@@ -60,6 +70,70 @@ def x_to_y(x: int, is_odd: bool = False):
     return y_res if y_res % 2 == is_odd else y_mod
 
 
+class ConversionCache:
+    def __init__(self, max_size: int):
+        self.values: OrderedDict = OrderedDict()
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.values)
+
+    def get(self, key: Hashable, compute: Callable):
+        try:
+            value = self.values[key]
+        except KeyError:
+            self.misses += 1
+            value = compute()
+            if self.max_size:
+                self.values[key] = value
+                if len(self.values) > self.max_size:
+                    self.values.popitem(last=False)
+            return value
+        self.values.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def resize(self, max_size: int) -> None:
+        self.max_size = max_size
+        while len(self.values) > max_size:
+            self.values.popitem(last=False)
+
+    def clear(self) -> None:
+        self.values.clear()
+
+    def stats(self) -> dict:
+        requests = self.hits + self.misses
+        return {
+            'size': len(self.values),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / requests if requests else 0
+        }
+
+
+CONVERSION_CACHE_SIZE = int(os.environ.get('DENARO_CONVERSION_CACHE_SIZE', 20_000))
+
+# points and addresses are immutable, so cached values can be shared between callers
+conversion_caches = {
+    'string_to_bytes': ConversionCache(CONVERSION_CACHE_SIZE),
+    'bytes_to_point': ConversionCache(CONVERSION_CACHE_SIZE),
+    'string_to_point': ConversionCache(CONVERSION_CACHE_SIZE),
+    'point_to_string': ConversionCache(CONVERSION_CACHE_SIZE),
+}
+
+
+def set_conversion_cache_size(max_size: int) -> None:
+    for cache in conversion_caches.values():
+        cache.resize(max_size)
+
+
+def get_conversion_cache_stats() -> dict:
+    return {name: cache.stats() for name, cache in conversion_caches.items()}
+
+
 class AddressFormat(Enum):
     FULL_HEX = 'hex'
     COMPRESSED = 'compressed'
@@ -75,6 +149,11 @@ def point_to_bytes(point: Point, address_format: AddressFormat = AddressFormat.F
 
 
 def bytes_to_point(point_bytes: bytes) -> Point:
+    point_bytes = bytes(point_bytes)
+    return conversion_caches['bytes_to_point'].get(point_bytes, lambda: _bytes_to_point(point_bytes))
+
+
+def _bytes_to_point(point_bytes: bytes) -> Point:
     if len(point_bytes) == 64:
         x, y = int.from_bytes(point_bytes[:32], ENDIAN), int.from_bytes(point_bytes[32:], ENDIAN)
         return Point(x, y, CURVE)
@@ -97,7 +176,27 @@ def bytes_to_string(point_bytes: bytes) -> str:
     return point_to_string(point, address_format)
 
 
+def bytes_to_address(point_bytes: bytes) -> Tuple[str, bytes]:
+    # same address as bytes_to_string, without the curve math: the compressed prefix
+    # is normalized the way bytes_to_point and point_to_string would do
+    if len(point_bytes) == 64:
+        return point_bytes.hex(), point_bytes
+    elif len(point_bytes) == 33:
+        point_bytes = (43 if point_bytes[0] == 43 else 42).to_bytes(1, ENDIAN) + point_bytes[1:]
+        address = base58.b58encode(point_bytes)
+        return address if isinstance(address, str) else address.decode('utf-8'), point_bytes
+    else:
+        raise NotImplementedError()
+
+
 def point_to_string(point: Point, address_format: AddressFormat = AddressFormat.COMPRESSED) -> str:
+    # Point is not hashable, the cache is keyed by its coordinates
+    return conversion_caches['point_to_string'].get(
+        (point.x, point.y, address_format), lambda: _point_to_string(point, address_format)
+    )
+
+
+def _point_to_string(point: Point, address_format: AddressFormat) -> str:
     if address_format is AddressFormat.FULL_HEX:
         point_bytes = point_to_bytes(point)
         return point_bytes.hex()
@@ -110,6 +209,10 @@ def point_to_string(point: Point, address_format: AddressFormat = AddressFormat.
 
 
 def string_to_bytes(string: str) -> bytes:
+    return conversion_caches['string_to_bytes'].get(string, lambda: _string_to_bytes(string))
+
+
+def _string_to_bytes(string: str) -> bytes:
     try:
         point_bytes = bytes.fromhex(string)
     except ValueError:
@@ -118,7 +221,7 @@ def string_to_bytes(string: str) -> bytes:
 
 
 def string_to_point(string: str) -> Point:
-    return bytes_to_point(string_to_bytes(string))
+    return conversion_caches['string_to_point'].get(string, lambda: bytes_to_point(string_to_bytes(string)))
 
 
 async def transaction_to_json(tx, verify: bool = False, address: str = None):
@@ -1,5 +1,6 @@
 import hashlib
-from decimal import Decimal
+from datetime import datetime, timezone
+from decimal import Decimal, ROUND_HALF_UP
 from io import BytesIO
 from math import ceil, floor, log
 from typing import Tuple, List, Union
@@ -11,10 +12,15 @@ from .constants import MAX_SUPPLY, ENDIAN, MAX_BLOCK_SIZE_HEX
 from .database import OLD_BLOCKS_TRANSACTIONS_ORDER
 from .helpers import sha256, timestamp, bytes_to_string, string_to_bytes
 from .transactions import CoinbaseTransaction, Transaction
+from .verification import SignatureVerifier
 
 BLOCK_TIME = 180
 BLOCKS_COUNT = Decimal(500)
 START_DIFFICULTY = Decimal('6.0')
+BULK_INGEST_MIN_BLOCKS = 50
+BULK_INGEST_MAX_BLOCKS = 500
+# blocks up to here have consensus exceptions, their headers are only checked together with their bodies
+HEADERS_CHECK_FROM = 150_000
 
 _print = print
 print = ic
@@ -64,18 +70,18 @@ def hashrate_to_difficulty(hashrate: int) -> Decimal:
     return Decimal(difficulty) + Decimal('0.9')
 
 
-async def calculate_difficulty() -> Tuple[Decimal, dict]:
-    database = Database.instance
-    last_block = await database.get_last_block()
-    if last_block is None:
-        return START_DIFFICULTY, dict()
-    last_block = dict(last_block)
-    last_block['address'] = last_block['address'].strip(' ')
+def get_window_start_id(block_id: int) -> int:
+    # first block of the retarget period block_id belongs to
+    return (block_id - 1) // int(BLOCKS_COUNT) * int(BLOCKS_COUNT) + 1
+
+
+def get_next_difficulty(last_block: dict, last_adjust_block: dict) -> Decimal:
+    if not last_block:
+        return START_DIFFICULTY
     if last_block['id'] < BLOCKS_COUNT:
-        return START_DIFFICULTY, last_block
+        return START_DIFFICULTY
 
     if last_block['id'] % BLOCKS_COUNT == 0:
-        last_adjust_block = await database.get_block_by_id(last_block['id'] - BLOCKS_COUNT + 1)
         elapsed = last_block['timestamp'] - last_adjust_block['timestamp']
         average_per_block = elapsed / BLOCKS_COUNT
         last_difficulty = last_block['difficulty']
@@ -94,15 +100,34 @@ async def calculate_difficulty() -> Tuple[Decimal, dict]:
             new_difficulty = hashrate_to_difficulty_wrong(hashrate)
         else:
             new_difficulty = hashrate_to_difficulty(hashrate)
-        return new_difficulty, last_block
+        return new_difficulty
+
+    return last_block['difficulty']
 
-    return last_block['difficulty'], last_block
+
+def get_block_record(block: dict) -> dict:
+    # the block as normalize_block returns it once it has been read back from the database
+    block_timestamp = block['timestamp']
+    if isinstance(block_timestamp, datetime):
+        block_timestamp = int(block_timestamp.replace(tzinfo=timezone.utc).timestamp())
+    return {
+        'id': block['id'],
+        'hash': block['hash'],
+        'content': block['content'],
+        'address': block['address'].strip(' '),
+        'random': block['random'],
+        'difficulty': Decimal(block['difficulty']).quantize(Decimal('0.1'), ROUND_HALF_UP),
+        'reward': Decimal(block['reward']).quantize(Decimal('0.000001'), ROUND_HALF_UP),
+        'timestamp': block_timestamp
+    }
+
+
+async def calculate_difficulty() -> Tuple[Decimal, dict]:
+    return await ChainState.get()
 
 
 async def get_difficulty() -> Tuple[Decimal, dict]:
-    if Manager.difficulty is None:
-        Manager.difficulty = await calculate_difficulty()
-    return Manager.difficulty
+    return await ChainState.get()
 
 
 async def check_block_is_valid(block_content: str, mining_info: tuple = None) -> bool:
@@ -126,6 +151,35 @@ async def check_block_is_valid(block_content: str, mining_info: tuple = None) ->
     return block_hash.startswith(last_block_hash[-difficulty:])
 
 
+async def check_block_headers(headers: List[dict], last_block: dict, window_start: dict) -> Tuple[int, dict, dict]:
+    # returns how many headers are linked to last_block and valid, and the state after the last valid one
+    for n, header in enumerate(headers):
+        block_id = header['id']
+        if block_id != (last_block['id'] + 1 if last_block else 1):
+            return n, last_block, window_start
+        header = {
+            'id': block_id,
+            'hash': header['hash'],
+            'content': header['content'],
+            'difficulty': Decimal(str(header['difficulty'])),
+            'timestamp': header['timestamp']
+        }
+        content = header['content']
+        if block_id > HEADERS_CHECK_FROM and content is not None and last_block and window_start is not None:
+            try:
+                previous_hash, _, _, content_time, _, _ = split_block_content(content)
+            except (AssertionError, NotImplementedError, ValueError):
+                return n, last_block, window_start
+            difficulty = get_next_difficulty(last_block, window_start)
+            if previous_hash != last_block['hash'] or sha256(content) != header['hash'] or content_time != header['timestamp'] or \
+               header['difficulty'] != difficulty or not await check_block_is_valid(content, (difficulty, last_block)):
+                return n, last_block, window_start
+        if get_window_start_id(block_id) == block_id:
+            window_start = header
+        last_block = header
+    return len(headers), last_block, window_start
+
+
 def get_block_reward(number: int) -> Decimal:
     divider = floor(number / 150000)
     if divider == 0:
@@ -157,48 +211,69 @@ def __check():
 
 async def clear_pending_transactions(transactions=None):
     database: Database = Database.instance
+    await database.sync_mempool()
     await database.clear_duplicate_pending_transactions()
-    transactions = transactions or await database.get_pending_transactions_limit(hex_only=True)
-    used_inputs = []
-    for transaction in transactions:
-        if isinstance(transaction, str):
-            tx_hash = sha256(transaction)
-            transaction = await Transaction.from_hex(transaction, check_signatures=False)
-        else:
-            tx_hash = sha256(transaction.hex())
-        tx_inputs = [(tx_input.tx_hash, tx_input.index) for tx_input in transaction.inputs]
-        if any(used_input in tx_inputs for used_input in used_inputs):
-            await database.remove_pending_transaction(tx_hash)
-            print(f'removed {tx_hash}')
-            return await clear_pending_transactions()
-        used_inputs += tx_inputs
+    if transactions:
+        tx_hashes = [sha256(transaction) if isinstance(transaction, str) else transaction.hash() for transaction in transactions]
+        used_inputs = database.mempool.get_inputs(tx_hashes)
+    else:
+        used_inputs = database.mempool.get_spent_outputs()
+    # the mempool never holds two transactions spending the same output, only outputs spent by a block are left
     unspent_outputs = await database.get_unspent_outputs(used_inputs)
     double_spend_inputs = set(used_inputs) - set(unspent_outputs)
-    if double_spend_inputs == set(used_inputs):
-        await database.remove_pending_transactions()
-    elif double_spend_inputs:
-        await database.remove_pending_transactions_by_contains([tx_input[0] + bytes([tx_input[1]]).hex() for tx_input in double_spend_inputs])
+    if double_spend_inputs:
+        tx_hashes = database.mempool.get_conflicts(list(double_spend_inputs))
+        await database.remove_pending_transactions_by_hash(tx_hashes)
+        print(f'removed {len(tx_hashes)} double spending pending transactions')
 
 
-def get_transactions_merkle_tree_ordered(transactions: List[Union[Transaction, str]]):
-    _bytes = bytes()
-    for transaction in transactions:
-        _bytes += hashlib.sha256(bytes.fromhex(transaction.hex() if isinstance(transaction, Transaction) else transaction)).digest()
-    return hashlib.sha256(_bytes).hexdigest()
-
-
-def get_transactions_merkle_tree(transactions: List[Union[Transaction, str]]):
-    _bytes = bytes()
-    transactions_bytes = []
-    for transaction in transactions:
-        transactions_bytes.append(bytes.fromhex(transaction.hex() if isinstance(transaction, Transaction) else transaction))
-    for transaction in sorted(transactions_bytes):
-        _bytes += hashlib.sha256(transaction).digest()
-    return hashlib.sha256(_bytes).hexdigest()
+async def check_pending_transactions(transactions: List[Transaction]) -> List[bool]:
+    # the checks of Transaction.verify_pending, with one lookup and one signatures batch for all the transactions
+    database: Database = Database.instance
+    valid = [not isinstance(transaction, CoinbaseTransaction) and transaction._verify_double_spend_same_transaction() for transaction in transactions]
+    check_inputs = [(tx_input.tx_hash, tx_input.index) for transaction, ok in zip(transactions, valid) if ok for tx_input in transaction.inputs]
+    unspent_outputs = set(await database.get_unspent_outputs(check_inputs))
+    pending_spent_outputs = set(database.mempool.get_spent_outputs(check_inputs))
+    batch_spent_outputs = set()
+    for n, transaction in enumerate(transactions):
+        if not valid[n]:
+            continue
+        inputs = [(tx_input.tx_hash, tx_input.index) for tx_input in transaction.inputs]
+        if any(output not in unspent_outputs or output in pending_spent_outputs or output in batch_spent_outputs for output in inputs):
+            valid[n] = False
+            continue
+        batch_spent_outputs.update(inputs)
+
+    candidates = [transaction for transaction, ok in zip(transactions, valid) if ok]
+    input_txs = await database.get_transactions_info(list({tx_input.tx_hash for transaction in candidates for tx_input in transaction.inputs}))
+    for transaction in candidates:
+        await transaction._fill_transaction_inputs(input_txs)
+    batch_verify = SignatureVerifier.enabled
+    signatures = await SignatureVerifier.verify_transactions(candidates) if batch_verify else [True] * len(candidates)
+    results = {}
+    for transaction, signatures_valid in zip(candidates, signatures):
+        results[id(transaction)] = signatures_valid and await transaction.verify(check_double_spend=False, check_signatures=not batch_verify)
+    return [ok and results[id(transaction)] for transaction, ok in zip(transactions, valid)]
+
+
+def get_transaction_bytes(transaction: Union[Transaction, str, bytes]) -> bytes:
+    if isinstance(transaction, Transaction):
+        return transaction.to_bytes()
+    return bytes.fromhex(transaction) if isinstance(transaction, str) else transaction
+
+
+def get_transactions_merkle_tree_ordered(transactions: List[Union[Transaction, str, bytes]]):
+    return hashlib.sha256(b''.join(hashlib.sha256(get_transaction_bytes(transaction)).digest() for transaction in transactions)).hexdigest()
+
+
+def get_transactions_merkle_tree(transactions: List[Union[Transaction, str, bytes]]):
+    transactions_bytes = sorted(get_transaction_bytes(transaction) for transaction in transactions)
+    return hashlib.sha256(b''.join(hashlib.sha256(transaction).digest() for transaction in transactions_bytes)).hexdigest()
 
 
 def get_transactions_size(transactions: List[Transaction]):
-    return sum(len(transaction.hex()) for transaction in transactions)
+    # size in hex characters
+    return sum(len(transaction.to_bytes()) * 2 for transaction in transactions)
 
 
 def block_to_bytes(last_block_hash: str, block: dict) -> bytes:
@@ -291,8 +366,17 @@ async def check_block(block_content: str, transactions: List[Transaction], minin
         for transaction in transactions:
             await transaction._fill_transaction_inputs(input_txs)
 
+    batch_verify = SignatureVerifier.enabled
+    if batch_verify:
+        unverified = [transaction for transaction in transactions if not transaction.signatures_verified]
+        for transaction, valid in zip(unverified, await SignatureVerifier.verify_transactions(unverified)):
+            if not valid:
+                print(f'transaction {transaction.hash()} has invalid signatures')
+                return False
+
     for transaction in transactions:
-        if not await transaction.verify(check_double_spend=False):
+        check_signatures = not batch_verify and not transaction.signatures_verified
+        if not await transaction.verify(check_double_spend=False, check_signatures=check_signatures):
             print(f'transaction {transaction.hash()} has been not verified')
             return False
 
@@ -309,18 +393,10 @@ async def check_block(block_content: str, transactions: List[Transaction], minin
     return True
 
 
-async def create_block(block_content: str, transactions: List[Transaction], last_block: dict = None):
-    Manager.difficulty = None
-    if last_block is None or last_block['id'] % BLOCKS_COUNT == 0:
-        difficulty, last_block = await calculate_difficulty()
-    else:
-        # fixme temp fix
-        difficulty, last_block = await get_difficulty()
-        #difficulty = Decimal(str(last_block['difficulty']))
+async def build_block(block_content: str, transactions: List[Transaction], difficulty: Decimal, last_block: dict) -> Union[dict, bool]:
     if not await check_block(block_content, transactions, (difficulty, last_block)):
         return False
 
-    database: Database = Database.instance
     block_no = last_block['id'] + 1 if last_block != {} else 1
     block_hash = sha256(block_content) if block_no != 17972 else '37cb1a0522c039330775e07d824c94e0422dbfb2dba6dcd421f4dc9f11601672'
     previous_hash, address, merkle_tree, content_time, content_difficulty, random = split_block_content(block_content)
@@ -337,27 +413,149 @@ async def create_block(block_content: str, transactions: List[Transaction], last
         if not coinbase_transaction.outputs[0].verify():
             return False
 
-    await database.add_block(block_no, block_hash, block_content, address, random, difficulty, block_reward + fees, content_time)
-    await database.add_transaction(coinbase_transaction, block_hash)
+    return {
+        'id': block_no,
+        'hash': block_hash,
+        'content': block_content,
+        'address': address,
+        'random': random,
+        'difficulty': difficulty,
+        'reward': block_reward + fees,
+        'timestamp': content_time,
+        'fees': fees,
+        'transactions': transactions,
+        'coinbase_transaction': coinbase_transaction
+    }
+
+
+def blocks_added(blocks: List[dict]):
+    for block in blocks:
+        transactions = block['transactions']
+        if len(transactions) > 1 and block['id'] < 22500:
+            OLD_BLOCKS_TRANSACTIONS_ORDER.set(block['hash'], [transaction.hex() for transaction in transactions])
+        if transactions:
+            _print(f'Added {len(transactions)} transactions in block {block["id"]}. Reward: {block["reward"] - block["fees"]}, Fees: {block["fees"]}')
+
+
+class BlockIngest:
+    # buffers validated blocks so that long ranges are written with a few bulk transactions.
+    # the buffer is flushed before validating anything which depends on the buffered blocks,
+    # so that validation always reads a consistent database
+    def __init__(self, max_blocks: int = BULK_INGEST_MAX_BLOCKS):
+        self.max_blocks = max_blocks
+        self.blocks: List[dict] = []
+        self.tx_hashes = set()
+        self.spent_outputs = set()
+        self.difficulty: Decimal = None
+
+    def depends_on(self, transactions: List[Transaction]) -> bool:
+        return any(
+            tx_input.tx_hash in self.tx_hashes or (tx_input.tx_hash, tx_input.index) in self.spent_outputs
+            for transaction in transactions if isinstance(transaction, Transaction) for tx_input in transaction.inputs
+        )
+
+    async def get_difficulty(self, transactions: List[Transaction]) -> Tuple[Decimal, dict]:
+        if self.blocks:
+            # the tip is the last buffered block as build_block made it, its hash is computed from the content
+            last_block = get_block_record(self.blocks[-1])
+            if last_block['id'] % BLOCKS_COUNT == 0 or len(self.blocks) >= self.max_blocks or self.depends_on(transactions):
+                await self.flush()
+        if not self.blocks:
+            self.difficulty, last_block = await calculate_difficulty()
+        # between two retargets every block has the difficulty of the previous one
+        return self.difficulty, last_block
+
+    def add(self, block: dict):
+        self.blocks.append(block)
+        for transaction in block['transactions']:
+            self.tx_hashes.add(transaction.hash())
+            self.spent_outputs.update((tx_input.tx_hash, tx_input.index) for tx_input in transaction.inputs)
+        self.tx_hashes.add(block['coinbase_transaction'].hash())
+
+    async def flush(self) -> None:
+        if not self.blocks:
+            return
+        blocks = self.blocks
+        self.blocks = []
+        self.tx_hashes.clear()
+        self.spent_outputs.clear()
+        await Database.instance.add_blocks(blocks)
+        blocks_added(blocks)
+
+
+async def create_block(block_content: str, transactions: List[Transaction], last_block: dict = None, ingest: BlockIngest = None):
+    if ingest is not None:
+        difficulty, last_block = await ingest.get_difficulty(transactions)
+    else:
+        difficulty, last_block = await calculate_difficulty()
+    block = await build_block(block_content, transactions, difficulty, last_block)
+    if not block:
+        return False
+
+    if ingest is not None:
+        ingest.add(block)
+        return True
 
+    database: Database = Database.instance
     try:
-        await database.add_transactions(transactions, block_hash)
-        if len(transactions) > 1 and block_no < 22500:
-            OLD_BLOCKS_TRANSACTIONS_ORDER.set(block_hash, [transaction.hex() for transaction in transactions])
+        await database.add_blocks([block])
     except Exception as e:
-        print(f'a transaction has not been added in block', e)
-        await database.delete_block(block_no)
+        print(f'block {block["id"]} has not been added', e)
         return False
-    await database.add_unspent_transactions_outputs(transactions + [coinbase_transaction])
-    if transactions:
-        await database.remove_pending_transactions_by_hash([transaction.hash() for transaction in transactions])
-        await database.remove_unspent_outputs(transactions)
-        await database.remove_pending_spent_outputs(transactions)
-
-        _print(f'Added {len(transactions)} transactions in block {block_no}. Reward: {block_reward}, Fees: {fees}')
-    Manager.difficulty = None
+    blocks_added([block])
     return True
 
 
-class Manager:
-    difficulty: Tuple[float, dict] = None
+class ChainState:
+    # chain tip kept in memory: updated when blocks are added, reloaded after blocks are removed
+    last_block: dict = None
+    next_id: int = None
+    # first block of the current retarget period, needed to compute the next difficulty
+    window_start: dict = None
+    difficulty: Decimal = None
+
+    @staticmethod
+    async def get() -> Tuple[Decimal, dict]:
+        if ChainState.difficulty is None:
+            await ChainState.load()
+        return ChainState.difficulty, dict(ChainState.last_block)
+
+    @staticmethod
+    async def get_next_block_id() -> int:
+        if ChainState.difficulty is None:
+            await ChainState.load()
+        return ChainState.next_id
+
+    @staticmethod
+    async def load() -> None:
+        database: Database = Database.instance
+        last_block = await database.get_last_block()
+        window_start = None
+        if last_block is not None:
+            window_start = await database.get_block_by_id(get_window_start_id(last_block['id']))
+        ChainState.set(last_block or {}, window_start)
+
+    @staticmethod
+    def set(last_block: dict, window_start: dict) -> None:
+        ChainState.last_block = last_block
+        ChainState.window_start = window_start
+        ChainState.next_id = last_block['id'] + 1 if last_block else 1
+        ChainState.difficulty = get_next_difficulty(last_block, window_start)
+
+    @staticmethod
+    def blocks_added(blocks: List[dict]) -> None:
+        if ChainState.difficulty is None or not blocks:
+            return
+        window_start = ChainState.window_start
+        for block in blocks:
+            if get_window_start_id(block['id']) == block['id']:
+                window_start = get_block_record(block)
+        last_block = get_block_record(blocks[-1])
+        if last_block['id'] != ChainState.next_id + len(blocks) - 1 or window_start is None or window_start['id'] != get_window_start_id(last_block['id']):
+            ChainState.invalidate()
+            return
+        ChainState.set(last_block, window_start)
+
+    @staticmethod
+    def invalidate() -> None:
+        ChainState.difficulty = None
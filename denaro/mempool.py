@@ -0,0 +1,154 @@
+from bisect import insort, bisect_left
+from decimal import Decimal
+from fractions import Fraction
+from hashlib import blake2b
+from typing import Dict, List, Set, Tuple
+
+from .constants import MAX_BLOCK_SIZE_HEX
+from .helpers import point_to_string, string_to_point
+
+
+def get_address_key(address: str) -> str:
+    # the same public key can be written in both address formats
+    return point_to_string(string_to_point(address))
+
+
+def get_short_id(salt: bytes, tx_hash: str) -> str:
+    # 6 bytes keyed by a salt taken from the block hash, so colliding transactions cannot be crafted in advance
+    return blake2b(bytes.fromhex(tx_hash), digest_size=6, key=salt).hexdigest()
+
+
+class MempoolEntry:
+    __slots__ = ('tx_hash', 'tx_hex', 'fees', 'inputs', 'inputs_addresses', 'addresses', 'order_key')
+
+    def __init__(self, tx_hash: str, tx_hex: str, fees: Decimal, inputs: List[Tuple[str, int]], inputs_addresses: Set[str], addresses: Set[str]):
+        self.tx_hash = tx_hash
+        self.tx_hex = tx_hex
+        self.fees = fees
+        self.inputs = inputs
+        self.inputs_addresses = inputs_addresses
+        self.addresses = addresses
+        # same order as the old ORDER BY fees / LENGTH(tx_hex) DESC, LENGTH(tx_hex), tx_hex
+        self.order_key = (-Fraction(fees) / len(tx_hex), len(tx_hex), tx_hex, tx_hash)
+
+
+class Mempool:
+    def __init__(self):
+        self.transactions: Dict[str, MempoolEntry] = {}
+        # (tx_hash, index) of a spent output -> hash of the pending transaction spending it
+        self.spenders: Dict[Tuple[str, int], str] = {}
+        # canonical address -> hashes of the pending transactions spending from or sending to it
+        self.addresses: Dict[str, Set[str]] = {}
+        # order keys of the pending transactions, best fee rate first
+        self.fee_order: list = []
+        self.size = 0
+        # incremented on every change, lets callers cache what they derive from the mempool
+        self.version = 0
+        # salt of the last compact block, short id -> hashes of the pending transactions, kept up to date from then on
+        self.short_ids_salt: bytes = None
+        self.short_ids: Dict[str, List[str]] = {}
+
+    def __len__(self):
+        return len(self.transactions)
+
+    def __contains__(self, tx_hash: str):
+        return tx_hash in self.transactions
+
+    def add(self, transaction, tx_hex: str, inputs_addresses: List[str], fees: Decimal) -> bool:
+        tx_hash = transaction.hash()
+        inputs = [(tx_input.tx_hash, tx_input.index) for tx_input in transaction.inputs]
+        if tx_hash in self.transactions or self.get_conflicts(inputs):
+            return False
+        inputs_addresses = {get_address_key(address) for address in inputs_addresses}
+        addresses = inputs_addresses.union(get_address_key(tx_output.address) for tx_output in transaction.outputs)
+        entry = MempoolEntry(tx_hash, tx_hex, fees, inputs, inputs_addresses, addresses)
+        self.transactions[tx_hash] = entry
+        for output in inputs:
+            self.spenders[output] = tx_hash
+        for address in addresses:
+            self.addresses.setdefault(address, set()).add(tx_hash)
+        insort(self.fee_order, entry.order_key)
+        if self.short_ids_salt is not None:
+            self.short_ids.setdefault(get_short_id(self.short_ids_salt, tx_hash), []).append(tx_hash)
+        self.size += len(tx_hex)
+        self.version += 1
+        return True
+
+    def remove(self, tx_hashes: List[str]) -> List[MempoolEntry]:
+        removed = []
+        for tx_hash in tx_hashes:
+            entry = self.transactions.pop(tx_hash, None)
+            if entry is None:
+                continue
+            for output in entry.inputs:
+                if self.spenders.get(output) == tx_hash:
+                    del self.spenders[output]
+            for address in entry.addresses:
+                address_txs = self.addresses[address]
+                address_txs.discard(tx_hash)
+                if not address_txs:
+                    del self.addresses[address]
+            del self.fee_order[bisect_left(self.fee_order, entry.order_key)]
+            if self.short_ids_salt is not None:
+                short_id = get_short_id(self.short_ids_salt, tx_hash)
+                self.short_ids[short_id].remove(tx_hash)
+                if not self.short_ids[short_id]:
+                    del self.short_ids[short_id]
+            self.size -= len(entry.tx_hex)
+            removed.append(entry)
+        if removed:
+            self.version += 1
+        return removed
+
+    def clear(self) -> None:
+        self.transactions.clear()
+        self.spenders.clear()
+        self.addresses.clear()
+        self.fee_order.clear()
+        self.short_ids.clear()
+        self.size = 0
+        self.version += 1
+
+    def get(self, tx_hash: str) -> MempoolEntry:
+        return self.transactions.get(tx_hash)
+
+    def get_conflicts(self, outputs: List[Tuple[str, int]]) -> List[str]:
+        spenders = self.spenders
+        return list(dict.fromkeys(spenders[output] for output in outputs if output in spenders))
+
+    def get_spent_outputs(self, outputs: List[Tuple[str, int]] = None) -> List[Tuple[str, int]]:
+        if outputs is None:
+            return list(self.spenders)
+        return [output for output in outputs if output in self.spenders]
+
+    def get_inputs(self, tx_hashes: List[str]) -> List[Tuple[str, int]]:
+        return [output for tx_hash in tx_hashes if tx_hash in self.transactions for output in self.transactions[tx_hash].inputs]
+
+    def get_address_transactions(self, address: str) -> List[MempoolEntry]:
+        tx_hashes = self.addresses.get(get_address_key(address), ())
+        return sorted((self.transactions[tx_hash] for tx_hash in tx_hashes), key=lambda entry: entry.order_key)
+
+    def get_ordered(self, limit: int = None) -> List[MempoolEntry]:
+        # entries by fee rate until limit hex characters, like a block template
+        entries = []
+        size = 0
+        for _, _, _, tx_hash in self.fee_order:
+            entry = self.transactions[tx_hash]
+            if limit is not None and size + len(entry.tx_hex) > limit:
+                break
+            size += len(entry.tx_hex)
+            entries.append(entry)
+        return entries
+
+    def get_short_ids(self, salt: bytes) -> Dict[str, List[str]]:
+        # short id -> hashes of the pending transactions with that short id, more than one is a collision.
+        # every node relays a block with the same salt, so the mempool is hashed once per block
+        if salt != self.short_ids_salt:
+            self.short_ids_salt = salt
+            self.short_ids = {}
+            for tx_hash in self.transactions:
+                self.short_ids.setdefault(get_short_id(salt, tx_hash), []).append(tx_hash)
+        return self.short_ids
+
+    def get_blocks_count(self) -> int:
+        return int(self.size / MAX_BLOCK_SIZE_HEX + 1)
@@ -0,0 +1,237 @@
+from asyncio import Event, Semaphore, gather, sleep
+from collections import OrderedDict
+from importlib.util import find_spec
+from os import environ
+from random import uniform
+from time import monotonic
+from typing import Dict, List
+
+import httpx
+
+from ..constants import MAX_BLOCK_SIZE_HEX
+from ..helpers import sha256
+from ..mempool import get_short_id
+from .nodes_manager import NodesManager, NodeInterface
+from .seen_filter import SeenFilter
+
+# http2 needs the optional h2 package
+HTTP2 = find_spec('h2') is not None
+GOSSIP_BATCH_DELAY = float(environ.get('DENARO_GOSSIP_BATCH_DELAY', 0.5))
+# hex characters of transactions sent in one push_txs request
+GOSSIP_BATCH_SIZE = MAX_BLOCK_SIZE_HEX
+# hashes sent in one announce_txs request, the receiving node reads up to 1000
+GOSSIP_ANNOUNCE_SIZE = 1000
+GOSSIP_PEER_CONCURRENCY = 2
+GOSSIP_BACKOFF_MIN = 5
+GOSSIP_BACKOFF_MAX = 60 * 10
+GOSSIP_PEER_IDLE_TIMEOUT = 60 * 5
+SEEN_BLOCKS_CAPACITY = int(environ.get('DENARO_SEEN_BLOCKS_CAPACITY', 2_000))
+SEEN_FILTER_LRU_SIZE = int(environ.get('DENARO_SEEN_FILTER_LRU_SIZE', 20_000))
+SEEN_FILTER_MAX_AGE = 60 * 60 * 2
+
+
+class GossipPeer:
+    def __init__(self, url: str):
+        self.url = url.strip('/')
+        self.base_url = NodeInterface(self.url).base_url
+        # keep-alive connections to this peer only, at most GOSSIP_PEER_CONCURRENCY requests at a time
+        self.client = httpx.AsyncClient(
+            base_url=self.url,
+            http2=HTTP2,
+            timeout=httpx.Timeout(10, connect=3),
+            limits=httpx.Limits(max_connections=GOSSIP_PEER_CONCURRENCY, max_keepalive_connections=GOSSIP_PEER_CONCURRENCY),
+            follow_redirects=True
+        )
+        self.semaphore = Semaphore(GOSSIP_PEER_CONCURRENCY)
+        self.failures = 0
+        self.backoff_until = 0
+        self.last_used = monotonic()
+        self.supports_batch = True
+        self.supports_compact = True
+
+    def is_available(self) -> bool:
+        return monotonic() >= self.backoff_until
+
+    async def request(self, path: str, data: dict, sender_node: str = '') -> dict:
+        headers = {'Sender-Node': sender_node}
+        async with self.semaphore:
+            self.last_used = monotonic()
+            try:
+                if path in ('push_block', 'push_compact_block', 'push_tx', 'push_txs', 'announce_txs'):
+                    response = await self.client.post(f'/{path}', json=data, headers=headers)
+                else:
+                    response = await self.client.get(f'/{path}', params=data, headers=headers)
+                response.raise_for_status()
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code not in (404, 405):
+                    self.failed()
+                raise
+            except Exception:
+                self.failed()
+                raise
+        self.failures = 0
+        return response.json()
+
+    def failed(self):
+        self.failures += 1
+        delay = min(GOSSIP_BACKOFF_MAX, GOSSIP_BACKOFF_MIN * 2 ** (self.failures - 1))
+        self.backoff_until = monotonic() + delay * uniform(1, 1.5)
+
+    async def get_missing_transactions(self, txs: Dict[str, str], sender_node: str) -> Dict[str, str]:
+        tx_hashes = list(txs)
+        missing = set()
+        for i in range(0, len(tx_hashes), GOSSIP_ANNOUNCE_SIZE):
+            res = await self.request('announce_txs', {'hashes': tx_hashes[i:i + GOSSIP_ANNOUNCE_SIZE]}, sender_node)
+            missing.update(res['result'])
+        return {tx_hash: tx_hex for tx_hash, tx_hex in txs.items() if tx_hash in missing}
+
+    async def push_transactions(self, txs: Dict[str, str], sender_node: str):
+        if self.supports_batch:
+            try:
+                # only the transactions the peer does not know are sent
+                txs = await self.get_missing_transactions(txs, sender_node)
+            except httpx.HTTPStatusError as e:
+                # nodes without the inventory endpoints
+                if e.response.status_code not in (404, 405):
+                    raise
+                self.supports_batch = False
+        batches = []
+        size = 0
+        for tx_hex in txs.values():
+            if not batches or size + len(tx_hex) > GOSSIP_BATCH_SIZE:
+                batches.append([])
+                size = 0
+            batches[-1].append(tx_hex)
+            size += len(tx_hex)
+        for batch in batches:
+            if self.supports_batch:
+                try:
+                    await self.request('push_txs', {'txs': batch}, sender_node)
+                    continue
+                except httpx.HTTPStatusError as e:
+                    if e.response.status_code not in (404, 405):
+                        raise
+                    self.supports_batch = False
+            await gather(*(self.request('push_tx', {'tx_hex': tx_hex}, sender_node) for tx_hex in batch), return_exceptions=True)
+
+    async def push_block(self, compact: dict, legacy: dict, txs: List[str], sender_node: str) -> dict:
+        if self.supports_compact and compact['short_ids']:
+            try:
+                res = await self.request('push_compact_block', compact, sender_node)
+                missing = res.get('missing')
+                if missing:
+                    # one more round trip with the transactions the peer could not find in its mempool
+                    res = await self.request('push_compact_block', dict(compact, txs={str(index): txs[index] for index in missing if 0 <= index < len(txs)}), sender_node)
+                return res
+            except httpx.HTTPStatusError as e:
+                # nodes without compact blocks
+                if e.response.status_code not in (404, 405):
+                    raise
+                self.supports_compact = False
+        return await self.request('push_block', legacy, sender_node)
+
+    async def close(self):
+        await self.client.aclose()
+
+
+class Gossip:
+    peers: Dict[str, GossipPeer] = {}
+    # hashes of the transactions and blocks received or relayed recently, shared by the push endpoints and the relay
+    # a probable hit saves nothing for transactions, they are looked up in the index either way
+    seen = SeenFilter(0, SEEN_FILTER_LRU_SIZE, SEEN_FILTER_MAX_AGE)
+    seen_blocks = SeenFilter(SEEN_BLOCKS_CAPACITY, SEEN_FILTER_LRU_SIZE // 100, SEEN_FILTER_MAX_AGE)
+    # tx_hash -> (tx_hex, url of the node it came from), waiting for the next batch
+    queue: OrderedDict = OrderedDict()
+    event: Event = None
+    self_url: str = None
+
+    @staticmethod
+    def get_peer(url: str) -> GossipPeer:
+        url = url.strip('/')
+        peer = Gossip.peers.get(url)
+        if peer is None:
+            peer = Gossip.peers[url] = GossipPeer(url)
+        return peer
+
+    @staticmethod
+    def get_targets(ignore_url: str = None, nodes: list = None) -> List[GossipPeer]:
+        ignored = {NodeInterface(url).base_url for url in (Gossip.self_url, ignore_url) if url}
+        peers = []
+        for node_url in nodes or NodesManager.get_propagate_nodes():
+            peer = Gossip.get_peer(node_url)
+            if peer.base_url not in ignored and peer.is_available() and peer not in peers:
+                peers.append(peer)
+        return peers
+
+    @staticmethod
+    async def broadcast(path: str, args: dict, ignore_url: str = None, nodes: list = None):
+        peers = Gossip.get_targets(ignore_url, nodes)
+        for response in await gather(*(peer.request(path, args, Gossip.self_url or '') for peer in peers), return_exceptions=True):
+            print('node response: ', response)
+
+    @staticmethod
+    async def broadcast_block(args: dict, ignore_url: str = None, nodes: list = None):
+        block_hash = sha256(args['block_content'])
+        Gossip.seen_blocks.add(block_hash)
+        txs = args['txs']
+        tx_hashes = [sha256(tx_hex) for tx_hex in txs]
+        # unknown until the block is mined, and the same for every node relaying it
+        salt = bytes.fromhex(block_hash)[:8]
+        compact = {'block_content': args['block_content'], 'block_no': args['block_no'], 'salt': salt.hex(), 'short_ids': [get_short_id(salt, tx_hash) for tx_hash in tx_hashes]}
+        legacy = {'block_content': args['block_content'], 'block_no': args['block_no'], 'txs': txs if len(txs) < 10 else tx_hashes}
+        peers = Gossip.get_targets(ignore_url, nodes)
+        for response in await gather(*(peer.push_block(compact, legacy, txs, Gossip.self_url or '') for peer in peers), return_exceptions=True):
+            print('node response: ', response)
+
+    @staticmethod
+    def add_transactions(txs: List[str], ignore_url: str = None):
+        # txs are Transaction.hex() encodings, their sha256 is the transaction hash
+        for tx_hex in txs:
+            tx_hash = sha256(tx_hex)
+            Gossip.seen.add(tx_hash)
+            Gossip.queue[tx_hash] = (tx_hex, ignore_url)
+        if Gossip.event is None:
+            Gossip.event = Event()
+        Gossip.event.set()
+
+    @staticmethod
+    async def send_transactions(queue: OrderedDict):
+        aws = []
+        for peer in Gossip.get_targets():
+            # a transaction is not sent back to the node it came from
+            txs = {tx_hash: tx_hex for tx_hash, (tx_hex, origin) in queue.items() if origin is None or NodeInterface(origin).base_url != peer.base_url}
+            if txs:
+                aws.append(peer.push_transactions(txs, Gossip.self_url or ''))
+        for response in await gather(*aws, return_exceptions=True):
+            if isinstance(response, Exception):
+                print('node response: ', response)
+
+    @staticmethod
+    async def close_idle_peers():
+        now = monotonic()
+        for url, peer in list(Gossip.peers.items()):
+            if now - peer.last_used > GOSSIP_PEER_IDLE_TIMEOUT and not peer.semaphore.locked():
+                del Gossip.peers[url]
+                await peer.close()
+
+    @staticmethod
+    async def run():
+        if Gossip.event is None:
+            Gossip.event = Event()
+        while True:
+            await Gossip.event.wait()
+            # transactions arriving meanwhile go in the same batch
+            await sleep(GOSSIP_BATCH_DELAY)
+            Gossip.event.clear()
+            queue, Gossip.queue = Gossip.queue, OrderedDict()
+            try:
+                await Gossip.send_transactions(queue)
+                await Gossip.close_idle_peers()
+            except Exception as e:
+                print(e)
+
+    @staticmethod
+    async def close():
+        peers = list(Gossip.peers.values())
+        Gossip.peers.clear()
+        await gather(*(peer.close() for peer in peers), return_exceptions=True)
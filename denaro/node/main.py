@@ -1,32 +1,41 @@
+import json
 import random
-from asyncio import gather
+from asyncio import gather, Queue, create_task, wait, sleep, FIRST_COMPLETED
 from collections import deque
 from os import environ
+from time import perf_counter
+from typing import List, Tuple
 import re
 
 from asyncpg import UniqueViolationError
 from fastapi import FastAPI, Body, Query
+from fastapi.encoders import jsonable_encoder
 from fastapi.responses import RedirectResponse
 
 from httpx import TimeoutException
 from icecream import ic
-from starlette.background import BackgroundTasks, BackgroundTask
+from starlette.background import BackgroundTasks
 from starlette.middleware.cors import CORSMiddleware
 from starlette.requests import Request
-from starlette.responses import JSONResponse
+from starlette.responses import JSONResponse, Response, StreamingResponse
 
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
 
-from denaro.helpers import timestamp, sha256, transaction_to_json
-from denaro.manager import create_block, get_difficulty, Manager, get_transactions_merkle_tree, \
-    split_block_content, calculate_difficulty, clear_pending_transactions, block_to_bytes, get_transactions_merkle_tree_ordered
-from denaro.node.nodes_manager import NodesManager, NodeInterface
+from denaro.helpers import timestamp, sha256, transaction_to_json, get_conversion_cache_stats
+from denaro.manager import create_block, get_difficulty, get_transactions_merkle_tree, \
+    split_block_content, calculate_difficulty, clear_pending_transactions, check_pending_transactions, block_to_bytes, get_transactions_merkle_tree_ordered, \
+    BlockIngest, BULK_INGEST_MIN_BLOCKS, ChainState, check_block_headers
+from denaro.node.nodes_manager import NodesManager, NodeInterface, SyncPeer
+from denaro.node.gossip import Gossip
+from denaro.node.seen_filter import SEEN, PROBABLY_SEEN
 from denaro.node.utils import ip_is_local
 from denaro.transactions import Transaction, CoinbaseTransaction
 from denaro import Database
-from denaro.constants import VERSION, ENDIAN
+from denaro.constants import VERSION, ENDIAN, MAX_BLOCK_SIZE_HEX
+from denaro.exceptions import RateLimitedException
+from denaro.verification import SignatureVerifier
 
 
 limiter = Limiter(key_func=get_remote_address)
@@ -35,9 +44,30 @@ app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 db: Database = None
 NodesManager.init()
-started = False
+self_announced = 0
 is_syncing = False
-self_url = None
+self_url = Gossip.self_url = environ.get('DENARO_SELF_URL', '').strip('/') or None
+
+PIPELINED_SYNC = environ.get('DENARO_PIPELINED_SYNC', '1') == '1'
+SYNC_PEERS = int(environ.get('DENARO_SYNC_PEERS', 3))
+SYNC_QUEUE_SIZE = 2
+HEADER_FIRST_SYNC = environ.get('DENARO_HEADER_FIRST_SYNC', '1') == '1'
+SYNC_HEADERS_WINDOW = 10_000
+# the ranges endpoints allow 10 requests per minute, a peer can serve 10_000 blocks per minute
+SYNC_BODIES_RANGE = 1000
+SYNC_PEER_MAX_FAILURES = 3
+# a range is given to another peer when it takes this many times longer than the fastest peer would need
+SYNC_SLOW_FACTOR = 4
+SYNC_SLOW_MIN_SECONDS = 10
+NODES_DISCOVERY_INTERVAL = int(environ.get('DENARO_NODES_DISCOVERY_INTERVAL', 60 * 10))
+SELF_ANNOUNCE_INTERVAL = int(environ.get('DENARO_SELF_ANNOUNCE_INTERVAL', 60 * 60 * 6))
+SELF_ANNOUNCE_CHECK_INTERVAL = 30
+PROPAGATE_PENDING_INTERVAL = int(environ.get('DENARO_PROPAGATE_PENDING_INTERVAL', 60))
+NODES_FLUSH_INTERVAL = int(environ.get('DENARO_NODES_FLUSH_INTERVAL', 10))
+# fraction of the interval added at random, so nodes started together do not hit their peers together
+MAINTENANCE_JITTER = 0.2
+MAX_PUSH_TXS = 1000
+MAX_COMPACT_BLOCK_TXS = MAX_BLOCK_SIZE_HEX // 64
 
 print = ic
 
@@ -50,66 +80,389 @@ app.add_middleware(
 
 
 async def propagate(path: str, args: dict, ignore_url=None, nodes: list = None):
-    global self_url
-    self_node = NodeInterface(self_url or '')
-    ignore_node = NodeInterface(ignore_url or '')
-    aws = []
-    for node_url in nodes or NodesManager.get_propagate_nodes():
-        node_interface = NodeInterface(node_url)
-        if node_interface.base_url == self_node.base_url or node_interface.base_url == ignore_node.base_url:
-            continue
-        aws.append(node_interface.request(path, args, self_node.url))
-    for response in await gather(*aws, return_exceptions=True):
-        print('node response: ', response)
+    if path == 'push_tx' and nodes is None:
+        # relayed in batches by the gossip task
+        Gossip.add_transactions([args['tx_hex']], ignore_url)
+        return
+    if path == 'push_block':
+        await Gossip.broadcast_block(args, ignore_url, nodes)
+        return
+    await Gossip.broadcast(path, args, ignore_url, nodes)
 
 
-async def create_blocks(blocks: list):
+async def get_sync_last_block() -> dict:
     _, last_block = await calculate_difficulty()
     last_block['id'] = last_block['id'] if last_block != {} else 0
     last_block['hash'] = last_block['hash'] if 'hash' in last_block else (30_06_2005).to_bytes(32, ENDIAN).hex()
+    return last_block
+
+
+async def prepare_block(block_info: dict, last_block: dict) -> Tuple[str, List[Transaction], CoinbaseTransaction]:
     i = last_block['id'] + 1
-    for block_info in blocks:
-        block = block_info['block']
-        txs_hex = block_info['transactions']
-        txs = [await Transaction.from_hex(tx) for tx in txs_hex]
-        for tx in txs:
-            if isinstance(tx, CoinbaseTransaction):
-                txs.remove(tx)
+    block = block_info['block']
+    txs_hex = block_info['transactions']
+    txs = [await Transaction.from_hex(tx) for tx in txs_hex]
+    coinbase_transaction = None
+    for tx in txs:
+        if isinstance(tx, CoinbaseTransaction):
+            txs.remove(tx)
+            coinbase_transaction = tx
+            break
+    txs_bytes = [tx.to_bytes() for tx in txs]
+    block['merkle_tree'] = get_transactions_merkle_tree(txs_bytes) if i > 22500 else get_transactions_merkle_tree_ordered(txs_bytes)
+    block_content = block.get('content') or block_to_bytes(last_block['hash'], block)
+
+    if i <= 22500 and sha256(block_content) != block['hash'] and i != 17972:
+        from itertools import permutations
+        for l in permutations(txs_bytes):
+            _txs_bytes = list(l)
+            block['merkle_tree'] = get_transactions_merkle_tree_ordered(_txs_bytes)
+            block_content = block_to_bytes(last_block['hash'], block)
+            if sha256(block_content) == block['hash']:
                 break
-        hex_txs = [tx.hex() for tx in txs]
-        block['merkle_tree'] = get_transactions_merkle_tree(hex_txs) if i > 22500 else get_transactions_merkle_tree_ordered(hex_txs)
-        block_content = block.get('content') or block_to_bytes(last_block['hash'], block)
-
-        if i <= 22500 and sha256(block_content) != block['hash'] and i != 17972:
-            from itertools import permutations
-            for l in permutations(hex_txs):
-                _hex_txs = list(l)
-                block['merkle_tree'] = get_transactions_merkle_tree_ordered(_hex_txs)
-                block_content = block_to_bytes(last_block['hash'], block)
-                if sha256(block_content) == block['hash']:
-                    break
-        elif 131309 < i < 150000 and sha256(block_content) != block['hash']:
-            for diff in range(0, 100):
-                block['difficulty'] = diff / 10
-                block_content = block_to_bytes(last_block['hash'], block)
-                if sha256(block_content) == block['hash']:
-                    break
-        assert i == block['id']
-        if not await create_block(block_content.hex() if isinstance(block_content, bytes) else block_content, txs, last_block):
-            return False
-        last_block = block
-        i += 1
+    elif 131309 < i < 150000 and sha256(block_content) != block['hash']:
+        for diff in range(0, 100):
+            block['difficulty'] = diff / 10
+            block_content = block_to_bytes(last_block['hash'], block)
+            if sha256(block_content) == block['hash']:
+                break
+    assert i == block['id']
+    return block_content.hex() if isinstance(block_content, bytes) else block_content, txs, coinbase_transaction
+
+
+async def prepare_block_ingest(block_info: dict, last_block: dict, ingest: BlockIngest = None) -> Tuple[str, List[Transaction], CoinbaseTransaction]:
+    try:
+        return await prepare_block(block_info, last_block)
+    except AssertionError:
+        if ingest is None or not ingest.blocks:
+            raise
+    # transactions inputs may be in the blocks not written yet
+    await ingest.flush()
+    return await prepare_block(block_info, last_block)
+
+
+async def create_blocks(blocks: list):
+    last_block = await get_sync_last_block()
+    ingest = BlockIngest() if len(blocks) >= BULK_INGEST_MIN_BLOCKS else None
+    try:
+        for block_info in blocks:
+            block_content, txs, _ = await prepare_block_ingest(block_info, last_block, ingest)
+            if not await create_block(block_content, txs, last_block, ingest):
+                if ingest is not None:
+                    await ingest.flush()
+                return False
+            last_block = block_info['block']
+        if ingest is not None:
+            await ingest.flush()
+    except Exception as e:
+        print(e)
+        return False
+    return True
+
+
+def _sync_stats_report(stats: dict) -> str:
+    return ', '.join(f'{stage}: {blocks / elapsed if elapsed else 0:.1f} blocks/s' for stage, (blocks, elapsed) in stats.items())
+
+
+async def _download_blocks(node_interfaces: List[NodeInterface], offset: int, limit: int):
+    while True:
+        errors = []
+        retry_after = None
+        for node_interface in node_interfaces:
+            try:
+                return await node_interface.download_blocks(offset, limit)
+            except RateLimitedException as e:
+                retry_after = min(retry_after or e.retry_after, e.retry_after)
+            except Exception as e:
+                errors.append(e)
+        if retry_after is None:
+            raise Exception(f'could not download blocks from {offset}: {errors}')
+        await sleep(retry_after)
+
+
+async def _sync_download_stage(node_urls: List[str], offset: int, limit: int, queue: Queue, stats: dict):
+    node_interfaces = [NodeInterface(node_url) for node_url in node_urls]
+    pending = deque()
+    turn = 0
+    try:
+        while True:
+            while len(pending) < len(node_interfaces):
+                # rotate the peers so that each range is asked first to a different node
+                interfaces = node_interfaces[turn:] + node_interfaces[:turn]
+                pending.append((offset, create_task(_download_blocks(interfaces, offset, limit))))
+                turn = (turn + 1) % len(node_interfaces)
+                offset += limit
+            t = perf_counter()
+            _, task = pending.popleft()
+            blocks = await task
+            stats['download'][0] += len(blocks)
+            stats['download'][1] += perf_counter() - t
+            if not blocks:
+                await queue.put(None)
+                return
+            next_offset = blocks[-1]['block']['id'] + 1
+            if pending and pending[0][0] != next_offset:
+                # the peer returned a shorter range than requested, re-plan the following ranges
+                for _, task in pending:
+                    task.cancel()
+                pending.clear()
+                offset = next_offset
+            await queue.put(blocks)
+    except Exception as e:
+        await queue.put(e)
+    finally:
+        for _, task in pending:
+            task.cancel()
+
+
+def _is_peer_usable(peer: SyncPeer) -> bool:
+    return peer.failures < SYNC_PEER_MAX_FAILURES
+
+
+async def _wait_rate_limited(peers: List[SyncPeer]) -> bool:
+    # sleeps until the first rate limited peer can be asked again, False when no usable peer is waited for
+    resume_at = min((peer.resume_at for peer in peers if _is_peer_usable(peer) and peer.resume_at > perf_counter()), default=None)
+    if resume_at is None:
+        return False
+    await sleep(resume_at - perf_counter())
     return True
 
 
+async def _download_headers(peers: List[SyncPeer], offset: int) -> Tuple[SyncPeer, list]:
+    while True:
+        errors = []
+        for peer in peers:
+            if not _is_peer_usable(peer) or peer.resume_at > perf_counter():
+                continue
+            try:
+                return peer, await peer.node_interface.get_block_headers(offset, SYNC_HEADERS_WINDOW)
+            except RateLimitedException as e:
+                peer.rate_limited(e.retry_after)
+            except Exception as e:
+                peer.failures += 1
+                errors.append(e)
+        if not await _wait_rate_limited(peers):
+            raise Exception(f'could not download headers from {offset}: {errors}')
+
+
+def _check_bodies(blocks: list, offset: int, hashes: dict) -> bool:
+    return bool(blocks) and all(
+        block_info['block']['id'] == offset + n and hashes.get(offset + n) == block_info['block']['hash']
+        for n, block_info in enumerate(blocks)
+    )
+
+
+async def _download_bodies(peers: List[SyncPeer], headers: List[dict], queue: Queue, stats: dict):
+    hashes = {header['id']: header['hash'] for header in headers}
+    next_id, end_id = headers[0]['id'], headers[-1]['id'] + 1
+    ranges = deque((offset, min(SYNC_BODIES_RANGE, end_id - offset)) for offset in range(next_id, end_id, SYNC_BODIES_RANGE))
+    results = {}
+    running = {}
+    try:
+        while next_id < end_id:
+            busy = {peer for peer, _, _, _ in running.values()}
+            now = perf_counter()
+            idle = sorted((peer for peer in peers if peer not in busy and _is_peer_usable(peer) and peer.resume_at <= now), key=SyncPeer.score, reverse=True)
+            for peer in idle:
+                # do not get too far ahead of the next range to be committed
+                if not ranges or ranges[0][0] >= next_id + SYNC_BODIES_RANGE * len(peers) * 2:
+                    break
+                offset, count = ranges.popleft()
+                running[create_task(peer.node_interface.download_blocks(offset, count))] = (peer, offset, count, perf_counter())
+            if not running:
+                if await _wait_rate_limited(peers):
+                    continue
+                raise Exception('no peer left to download blocks from')
+            t = perf_counter()
+            done, _ = await wait(running, timeout=1, return_when=FIRST_COMPLETED)
+            stats['download'][1] += perf_counter() - t
+            now = perf_counter()
+            for task in done:
+                peer, offset, count, started = running.pop(task)
+                error = task.exception() if not task.cancelled() else None
+                blocks = task.result() if not task.cancelled() and error is None else None
+                if isinstance(error, RateLimitedException):
+                    peer.rate_limited(error.retry_after)
+                    ranges.appendleft((offset, count))
+                elif _check_bodies(blocks, offset, hashes):
+                    peer.record(len(blocks), now - started)
+                    results[offset] = blocks
+                    if len(blocks) < count:
+                        ranges.appendleft((offset + len(blocks), count - len(blocks)))
+                else:
+                    # missing or not matching the headers, another peer will download the range
+                    peer.failures += 1
+                    ranges.appendleft((offset, count))
+            fastest = max((peer.throughput for peer in peers if peer.throughput is not None), default=None)
+            busy = {peer for peer, _, _, _ in running.values()}
+            if fastest is not None and any(peer not in busy and _is_peer_usable(peer) and peer.resume_at <= now for peer in peers):
+                for task, (peer, offset, count, started) in list(running.items()):
+                    elapsed = now - started
+                    if elapsed > SYNC_SLOW_MIN_SECONDS and elapsed > SYNC_SLOW_FACTOR * count / fastest:
+                        task.cancel()
+                        del running[task]
+                        peer.failures += 1
+                        ranges.appendleft((offset, count))
+            while next_id in results:
+                blocks = results.pop(next_id)
+                stats['download'][0] += len(blocks)
+                next_id += len(blocks)
+                await queue.put(blocks)
+    finally:
+        for task in running:
+            task.cancel()
+
+
+async def _sync_headers_download_stage(node_urls: List[str], offset: int, limit: int, queue: Queue, stats: dict):
+    peers = [SyncPeer(NodeInterface(node_url)) for node_url in node_urls]
+    _, last_block = await get_difficulty()
+    window_start = ChainState.window_start
+    try:
+        while True:
+            try:
+                peer, headers = await _download_headers(peers, offset)
+            except Exception:
+                if offset != last_block.get('id', 0) + 1 or stats['download'][0]:
+                    raise
+                # peers without the headers endpoint
+                print('headers not available, syncing by ranges')
+                return await _sync_download_stage(node_urls, offset, limit, queue, stats)
+            if not headers:
+                await queue.put(None)
+                return
+            valid, last_block, window_start = await check_block_headers(headers, last_block, window_start)
+            if valid:
+                # the valid prefix is kept, the rest of the window is asked again
+                await _download_bodies(peers, headers[:valid], queue, stats)
+                offset += valid
+            if valid < len(headers):
+                print(f'invalid block header {headers[valid]["id"]} from {peer.node_interface.url}')
+                peer.failures += 1
+    except Exception as e:
+        await queue.put(e)
+    finally:
+        for peer in peers:
+            if peer.throughput is not None:
+                NodesManager.update_score(peer.node_interface.url, peer.score())
+
+
+async def _prefill_transactions_inputs(transactions: list, overlay: dict):
+    hashes = {tx_input.tx_hash for transaction in transactions for tx_input in transaction.inputs}
+    txs_info = {tx_hash: overlay[tx_hash] for tx_hash in hashes if tx_hash in overlay}
+    txs_info.update(await db.get_transactions_info([tx_hash for tx_hash in hashes if tx_hash not in txs_info]))
+    for transaction in transactions:
+        await transaction._fill_transaction_inputs(txs_info)
+
+
+async def _sync_verify_stage(last_block: dict, input_queue: Queue, output_queue: Queue, overlay: dict, stats: dict):
+    try:
+        while True:
+            blocks = await input_queue.get()
+            if blocks is None or isinstance(blocks, Exception):
+                await output_queue.put(blocks)
+                return
+            t = perf_counter()
+            prepared = []
+            transactions = []
+            batch_hashes = []
+            for block_info in blocks:
+                try:
+                    block_content, txs, coinbase_transaction = await prepare_block(block_info, last_block)
+                except AssertionError:
+                    # needs inputs which are not committed yet, it will be prepared by the commit stage
+                    prepared.append((block_info, None, None))
+                else:
+                    prepared.append((block_info, block_content, txs))
+                    transactions.extend(txs)
+                    for tx in txs + ([coinbase_transaction] if coinbase_transaction is not None else []):
+                        overlay[tx.hash()] = {
+                            'outputs_addresses': [tx_output.address for tx_output in tx.outputs],
+                            'outputs_amounts': [tx_output.units for tx_output in tx.outputs]
+                        }
+                        batch_hashes.append(tx.hash())
+                last_block = block_info['block']
+            if transactions and SignatureVerifier.enabled:
+                # signatures are checked here while the previous batch is being committed
+                await _prefill_transactions_inputs(transactions, overlay)
+                transactions = [tx for tx in transactions if all(tx_input.transaction_info is not None for tx_input in tx.inputs)]
+                for transaction, valid in zip(transactions, await SignatureVerifier.verify_transactions(transactions)):
+                    transaction.signatures_verified = valid
+            stats['verify'][0] += len(blocks)
+            stats['verify'][1] += perf_counter() - t
+            await output_queue.put((prepared, batch_hashes))
+    except Exception as e:
+        await output_queue.put(e)
+
+
+async def _sync_commit_stage(last_block: dict, queue: Queue, overlay: dict, stats: dict):
+    ingest = BlockIngest()
+    try:
+        while True:
+            item = await queue.get()
+            if item is None:
+                return True
+            if isinstance(item, Exception):
+                print(item)
+                return None
+            t = perf_counter()
+            prepared, batch_hashes = item
+            for block_info, block_content, txs in prepared:
+                if block_content is None:
+                    block_content, txs, _ = await prepare_block_ingest(block_info, last_block, ingest)
+                if not await create_block(block_content, txs, last_block, ingest):
+                    return False
+                last_block = block_info['block']
+            await ingest.flush()
+            for tx_hash in batch_hashes:
+                overlay.pop(tx_hash, None)
+            stats['commit'][0] += len(prepared)
+            stats['commit'][1] += perf_counter() - t
+            print(f'synced up to block {last_block["id"]} ({_sync_stats_report(stats)})')
+    finally:
+        # the validated blocks are written whatever stopped the sync, the caller may revert them
+        await ingest.flush()
+
+
+async def _sync_pipelined(node_urls: List[str], limit: int):
+    last_block = await get_sync_last_block()
+    downloaded, verified = Queue(SYNC_QUEUE_SIZE), Queue(SYNC_QUEUE_SIZE)
+    overlay = {}
+    stats = {'download': [0, 0.0], 'verify': [0, 0.0], 'commit': [0, 0.0]}
+    tasks = [
+        create_task((_sync_headers_download_stage if HEADER_FIRST_SYNC else _sync_download_stage)(node_urls, last_block['id'] + 1, limit, downloaded, stats)),
+        create_task(_sync_verify_stage(dict(last_block), downloaded, verified, overlay, stats))
+    ]
+    try:
+        return await _sync_commit_stage(last_block, verified, overlay, stats)
+    finally:
+        for task in tasks:
+            task.cancel()
+        print(f'sync stages: {_sync_stats_report(stats)}')
+
+
+async def _sync_complete(node_url: str, starting_from: int):
+    print('syncing complete')
+    _, last_block = await calculate_difficulty()
+    if last_block['id'] > starting_from:
+        NodesManager.update_last_message(node_url)
+        if timestamp() - last_block['timestamp'] < 86400:
+            # if last block is from less than a day ago, propagate it
+            # the coinbase transaction spends the block hash
+            txs = [tx_hex for tx_hex in await db.get_block_transactions(last_block['hash'], hex_only=True) if last_block['hash'] not in tx_hex]
+            await propagate('push_block', {'block_content': last_block['content'], 'txs': txs, 'block_no': last_block['id']}, node_url)
+
+
 async def _sync_blockchain(node_url: str = None):
     print('sync blockchain')
+    node_urls = []
     if not node_url:
         nodes = NodesManager.get_recent_nodes()
         if not nodes:
             return
         node_url = random.choice(nodes)
+        node_urls = sorted(random.sample(nodes, k=min(len(nodes), SYNC_PEERS)), key=NodesManager.get_score, reverse=True)
     node_url = node_url.strip('/')
+    node_urls = [node_url] + [url.strip('/') for url in node_urls if url.strip('/') != node_url][:SYNC_PEERS - 1]
     _, last_block = await calculate_difficulty()
     starting_from = i = await db.get_next_block_id()
     node_interface = NodeInterface(node_url)
@@ -136,32 +489,46 @@ async def _sync_blockchain(node_url: str = None):
 
     #return
     limit = 1000
+    if PIPELINED_SYNC:
+        try:
+            completed = await _sync_pipelined(node_urls, limit)
+        except Exception as e:
+            print(e)
+            completed = False
+        if not completed:
+            # a download or verification failure reverts like a failed commit
+            if local_cache is not None:
+                print('sync failed, reverting back to previous chain')
+                await db.remove_blocks(last_common_block + 1)
+                await create_blocks(local_cache)
+            if completed is None:
+                NodesManager.sync()
+            return
+        await _sync_complete(node_url, starting_from)
+        return
+
     while True:
         i = await db.get_next_block_id()
         try:
-            blocks = await node_interface.get_blocks(i, limit)
+            blocks = await node_interface.download_blocks(i, limit)
+        except RateLimitedException as e:
+            await sleep(e.retry_after)
+            continue
         except Exception as e:
             print(e)
             #NodesManager.get_nodes().remove(node_url)
             NodesManager.sync()
             break
         try:
-            _, last_block = await calculate_difficulty()
             if not blocks:
-                print('syncing complete')
-                if last_block['id'] > starting_from:
-                    NodesManager.update_last_message(node_url)
-                    if timestamp() - last_block['timestamp'] < 86400:
-                        # if last block is from less than a day ago, propagate it
-                        txs_hashes = await db.get_block_transaction_hashes(last_block['hash'])
-                        await propagate('push_block', {'block_content': last_block['content'], 'txs': txs_hashes, 'block_no': last_block['id']}, node_url)
+                await _sync_complete(node_url, starting_from)
                 break
             assert await create_blocks(blocks)
         except Exception as e:
             print(e)
             if local_cache is not None:
                 print('sync failed, reverting back to previous chain')
-                await db.delete_blocks(last_common_block)
+                await db.remove_blocks(last_common_block + 1)
                 await create_blocks(local_cache)
             return
 
@@ -183,6 +550,17 @@ async def startup():
         database=environ.get('DENARO_DATABASE_NAME', 'denaro'),
         host=environ.get('DENARO_DATABASE_HOST', None)
     )
+    create_task(Gossip.run())
+    create_task(run_periodically(NodesManager.flush, NODES_FLUSH_INTERVAL, NODES_FLUSH_INTERVAL))
+    create_task(run_periodically(discover_nodes, NODES_DISCOVERY_INTERVAL, 0))
+    create_task(run_periodically(announce_self, SELF_ANNOUNCE_CHECK_INTERVAL))
+    create_task(run_periodically(propagate_pending_transactions, PROPAGATE_PENDING_INTERVAL))
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await NodesManager.flush()
+    await Gossip.close()
 
 
 @app.get("/")
@@ -190,18 +568,71 @@ async def root():
     return {"version": VERSION, "unspent_outputs_hash": await db.get_unspent_outputs_hash()}
 
 
+@app.get("/get_cache_stats")
+async def get_cache_stats():
+    return {'ok': True, 'result': {
+        'unspent_outputs': db.utxo_cache.stats(),
+        'address_balances': db.balance_cache.stats(),
+        'conversions': get_conversion_cache_stats(),
+        'seen_transactions': Gossip.seen.stats(),
+        'seen_blocks': Gossip.seen_blocks.stats(),
+        'admission': TransactionAdmission.get_stats()
+    }}
+
+
 async def propagate_old_transactions(propagate_txs):
     await db.update_pending_transactions_propagation_time([sha256(tx_hex) for tx_hex in propagate_txs])
-    for tx_hex in propagate_txs:
-        await propagate('push_tx', {'tx_hex': tx_hex})
+    Gossip.add_transactions(propagate_txs)
 
 
-@app.middleware("http")
-async def middleware(request: Request, call_next):
-    global started, self_url
+async def propagate_pending_transactions():
+    propagate_txs = await db.get_need_propagate_transactions()
+    if propagate_txs:
+        await propagate_old_transactions(propagate_txs)
+
+
+async def discover_nodes():
     nodes = NodesManager.get_recent_nodes()
-    hostname = request.base_url.hostname
+    if not nodes:
+        return
+    j = await NodesManager.request(f'{random.choice(nodes)}/get_nodes')
+    for node_url in j['result']:
+        if self_url is None or NodeInterface(node_url).base_url != NodeInterface(self_url).base_url:
+            try:
+                NodesManager.add_node(node_url)
+            except Exception:
+                break
+
+
+async def announce_self():
+    global self_announced
+    # self url is known after the first request from outside
+    if self_url is None or timestamp() - self_announced < SELF_ANNOUNCE_INTERVAL:
+        return
+    nodes = [node_url for node_url in NodesManager.get_recent_nodes() if NodeInterface(node_url).base_url != NodeInterface(self_url).base_url]
+    await propagate('add_node', {'url': self_url}, nodes=nodes)
+    cousin_nodes = []
+    for response in await gather(*(NodeInterface(url).get_nodes() for url in nodes), return_exceptions=True):
+        if isinstance(response, list):
+            cousin_nodes.extend(node_url for node_url in response if node_url not in nodes)
+    if cousin_nodes:
+        await propagate('add_node', {'url': self_url}, nodes=list(dict.fromkeys(cousin_nodes)))
+    self_announced = timestamp()
+
+
+async def run_periodically(job, interval: int, delay: int = None):
+    await sleep(random.uniform(0, MAINTENANCE_JITTER * interval) if delay is None else delay)
+    while True:
+        try:
+            await job()
+        except Exception as e:
+            print(job.__name__, e)
+        await sleep(interval * (1 + random.uniform(0, MAINTENANCE_JITTER)))
+
 
+@app.middleware("http")
+async def middleware(request: Request, call_next):
+    global self_url
     # Normalize the URL path by removing extra slashes
     normalized_path = re.sub('/+', '/', request.scope['path'])
     if normalized_path != request.scope['path']:
@@ -213,47 +644,13 @@ async def middleware(request: Request, call_next):
     if 'Sender-Node' in request.headers:
         NodesManager.add_node(request.headers['Sender-Node'])
 
-    if nodes and not started or (ip_is_local(hostname) or hostname == 'localhost'):
-        try:
-            node_url = nodes[0]
-            #requests.get(f'{node_url}/add_node', {'url': })
-            j = await NodesManager.request(f'{node_url}/get_nodes')
-            nodes.extend(j['result'])
-            NodesManager.sync()
-        except:
-            pass
-
-        if not (ip_is_local(hostname) or hostname == 'localhost'):
-            started = True
-
-            self_url = str(request.base_url).strip('/')
-            try:
-                nodes.remove(self_url)
-            except ValueError:
-                pass
-            try:
-                nodes.remove(self_url.replace("http://", "https://"))
-            except ValueError:
-                pass
-
-            NodesManager.sync()
+    hostname = request.base_url.hostname
+    if self_url is None and not (ip_is_local(hostname) or hostname == 'localhost'):
+        self_url = Gossip.self_url = str(request.base_url).strip('/')
 
-            try:
-                await propagate('add_node', {'url': self_url})
-                cousin_nodes = sum(await NodeInterface(url).get_nodes() for url in nodes)
-                await propagate('add_node', {'url': self_url}, nodes=cousin_nodes)
-            except:
-                pass
-    propagate_txs = await db.get_need_propagate_transactions()
-    try:
-        response = await call_next(request)
-        response.headers['Access-Control-Allow-Origin'] = '*'
-        if propagate_txs:
-            response.background = BackgroundTask(propagate_old_transactions, propagate_txs)
-        return response
-    except:
-        raise
-        return {'ok': False, 'error': 'Internal error'}
+    response = await call_next(request)
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    return response
 
 
 @app.exception_handler(Exception)
@@ -263,28 +660,135 @@ async def exception_handler(request: Request, e: Exception):
         content={"ok": False, "error": f"Uncaught {type(e).__name__} exception"},
     )
 
-transactions_cache = deque(maxlen=100)
+class TransactionAdmission:
+    # stage -> [transactions, seconds], the cheap checks run first so that duplicates are never parsed
+    stats: dict = {stage: [0, 0.0] for stage in ('hash', 'seen', 'index', 'parse', 'verify', 'insert')}
+    rejected: dict = {stage: 0 for stage in ('seen', 'index', 'parse', 'verify', 'insert')}
+
+    @staticmethod
+    def record(stage: str, count: int, started: float) -> float:
+        now = perf_counter()
+        TransactionAdmission.stats[stage][0] += count
+        TransactionAdmission.stats[stage][1] += now - started
+        return now
+
+    @staticmethod
+    def reject(results: dict, stage: str, tx_hex: str, error: str):
+        TransactionAdmission.rejected[stage] += 1
+        results[tx_hex] = {'ok': False, 'error': error}
+
+    @staticmethod
+    async def admit(txs_hex: List[str], sender_node: str = None) -> List[dict]:
+        results = {}
+        # results of the entries which are not hex strings, by position
+        invalid = {}
+        t = perf_counter()
+        # the hash of the raw bytes is the transaction hash when the encoding is canonical
+        hashes = {}
+        for n, tx_hex in enumerate(txs_hex):
+            try:
+                if not isinstance(tx_hex, str):
+                    raise TypeError()
+                if tx_hex not in hashes:
+                    hashes[tx_hex] = sha256(tx_hex)
+            except (TypeError, ValueError) as e:
+                TransactionAdmission.rejected['parse'] += 1
+                invalid[n] = {'ok': False, 'error': f'Invalid transaction: {type(e).__name__}'}
+        t = TransactionAdmission.record('hash', len(txs_hex), t)
+
+        count = len(hashes)
+        for tx_hex, tx_hash in list(hashes.items()):
+            # the hashes which are not in the recent window go on to the index lookup
+            if tx_hash in Gossip.seen:
+                TransactionAdmission.reject(results, 'seen', tx_hex, 'Transaction just added')
+                del hashes[tx_hex]
+        t = TransactionAdmission.record('seen', count, t)
+
+        count = len(hashes)
+        known = set(await db.get_known_transactions_hashes(list(hashes.values()))) if hashes else set()
+        for tx_hex, tx_hash in list(hashes.items()):
+            if tx_hash in known:
+                TransactionAdmission.reject(results, 'index', tx_hex, 'Transaction already present')
+                del hashes[tx_hex]
+        t = TransactionAdmission.record('index', count, t)
+
+        transactions = {}
+        for tx_hex in hashes:
+            try:
+                transactions[tx_hex] = await Transaction.from_hex(tx_hex)
+            except Exception as e:
+                TransactionAdmission.reject(results, 'parse', tx_hex, f'Invalid transaction: {type(e).__name__}')
+        t = TransactionAdmission.record('parse', len(hashes), t)
+
+        # the parser normalizes the encoding, the same transaction can come with different raw hashes
+        renamed = {tx_hex: transaction.hash() for tx_hex, transaction in transactions.items() if transaction.hash() != hashes[tx_hex]}
+        known = set(await db.get_known_transactions_hashes(list(set(renamed.values())))) if renamed else set()
+        canonical = set()
+        for tx_hex, transaction in list(transactions.items()):
+            tx_hash = transaction.hash()
+            if tx_hash in canonical or (tx_hex in renamed and tx_hash in Gossip.seen):
+                TransactionAdmission.reject(results, 'seen', tx_hex, 'Transaction just added')
+                del transactions[tx_hex]
+            elif tx_hex in renamed and tx_hash in known:
+                TransactionAdmission.reject(results, 'index', tx_hex, 'Transaction already present')
+                del transactions[tx_hex]
+            canonical.add(tx_hash)
+        t = TransactionAdmission.record('index', len(renamed), t)
+
+        valid = await check_pending_transactions(list(transactions.values()))
+        t = TransactionAdmission.record('verify', len(transactions), t)
+
+        try:
+            added = set(await db.add_pending_transactions([transaction for transaction, ok in zip(transactions.values(), valid) if ok]))
+        except UniqueViolationError:
+            # written meanwhile by another process
+            await db.sync_mempool()
+            added = set()
+        TransactionAdmission.record('insert', sum(valid), t)
+
+        accepted = []
+        for (tx_hex, transaction), ok in zip(transactions.items(), valid):
+            if transaction.hash() in added:
+                # relayed as stored, keyed by its transaction hash
+                accepted.append(transaction.hex())
+                results[tx_hex] = {'ok': True, 'result': 'Transaction has been accepted'}
+            else:
+                TransactionAdmission.reject(results, 'verify' if not ok else 'insert', tx_hex, 'Transaction has not been added')
+        if accepted:
+            if sender_node:
+                NodesManager.update_last_message(sender_node)
+            Gossip.add_transactions(accepted, sender_node)
+        return [invalid[n] if n in invalid else results[tx_hex] for n, tx_hex in enumerate(txs_hex)]
+
+    @staticmethod
+    def get_stats() -> dict:
+        return {stage: {
+            'transactions': count,
+            'seconds': elapsed,
+            'avg_ms': elapsed / count * 1000 if count else 0,
+            'rejected': TransactionAdmission.rejected.get(stage, 0)
+        } for stage, (count, elapsed) in TransactionAdmission.stats.items()}
 
 
 @app.get("/push_tx")
 @app.post("/push_tx")
-async def push_tx(request: Request, background_tasks: BackgroundTasks, tx_hex: str = None, body=Body(False)):
+async def push_tx(request: Request, tx_hex: str = None, body=Body(False)):
     if body and tx_hex is None:
         tx_hex = body['tx_hex']
-    tx = await Transaction.from_hex(tx_hex)
-    if tx.hash() in transactions_cache:
-        return {'ok': False, 'error': 'Transaction just added'}
-    try:
-        if await db.add_pending_transaction(tx):
-            if 'Sender-Node' in request.headers:
-                NodesManager.update_last_message(request.headers['Sender-Node'])
-            background_tasks.add_task(propagate, 'push_tx', {'tx_hex': tx_hex})
-            transactions_cache.append(tx.hash())
-            return {'ok': True, 'result': 'Transaction has been accepted'}
-        else:
-            return {'ok': False, 'error': 'Transaction has not been added'}
-    except UniqueViolationError:
-        return {'ok': False, 'error': 'Transaction already present'}
+    return (await TransactionAdmission.admit([tx_hex], request.headers.get('Sender-Node')))[0]
+
+
+@app.post("/announce_txs")
+async def announce_txs(body=Body(False)):
+    # only exact hits are filtered here, the others are looked up in the mempool and the database
+    tx_hashes = [tx_hash for tx_hash in dict.fromkeys(body['hashes'][:MAX_PUSH_TXS]) if tx_hash not in Gossip.seen]
+    known = set(await db.get_known_transactions_hashes(tx_hashes)) if tx_hashes else set()
+    return {'ok': True, 'result': [tx_hash for tx_hash in tx_hashes if tx_hash not in known]}
+
+
+@app.post("/push_txs")
+async def push_txs(request: Request, body=Body(False)):
+    return {'ok': True, 'result': await TransactionAdmission.admit(body['txs'][:MAX_PUSH_TXS], request.headers.get('Sender-Node'))}
 
 
 @app.post("/push_block")
@@ -304,10 +808,52 @@ async def push_block(request: Request, background_tasks: BackgroundTasks, block_
         txs = txs.split(',')
         if txs == ['']:
             txs = []
+    return await receive_block(request, background_tasks, block_content, txs, block_no)
+
+
+@app.post("/push_compact_block")
+async def push_compact_block(request: Request, background_tasks: BackgroundTasks, body=Body(False)):
+    if is_syncing:
+        return {'ok': False, 'error': 'Node is already syncing'}
+    block_content = body['block_content']
+    if Gossip.seen_blocks.lookup(sha256(block_content)) == SEEN:
+        return {'ok': False, 'error': 'Block just added'}
+    short_ids = body['short_ids']
+    if len(short_ids) > MAX_COMPACT_BLOCK_TXS:
+        return {'ok': False, 'error': 'Too many transactions'}
+    salt = bytes.fromhex(body['salt'])
+    if len(salt) > 16:
+        return {'ok': False, 'error': 'Invalid salt'}
+    prefilled = {int(index): tx_hex for index, tx_hex in (body.get('txs') or {}).items()}
+    known = db.mempool.get_short_ids(salt)
+    txs = []
+    missing = []
+    for index, short_id in enumerate(short_ids):
+        if index in prefilled:
+            txs.append(prefilled[index])
+        elif len(known.get(short_id, ())) == 1:
+            txs.append(db.mempool.get(known[short_id][0]).tx_hex)
+        else:
+            missing.append(index)
+    if not missing and len(prefilled) < len(short_ids):
+        # a short id can match a different transaction, then the whole block is asked for
+        if get_transactions_merkle_tree(txs) != split_block_content(block_content)[2]:
+            missing = [index for index in range(len(short_ids)) if index not in prefilled]
+    if missing:
+        return {'ok': False, 'error': 'Missing transactions', 'missing': missing}
+    return await receive_block(request, background_tasks, block_content, txs, body.get('block_no'))
+
+
+async def receive_block(request: Request, background_tasks: BackgroundTasks, block_content: str, txs: List[str], block_no: int = None):
+    block_hash = sha256(block_content)
+    seen = Gossip.seen_blocks.lookup(block_hash)
+    if seen == SEEN or (seen == PROBABLY_SEEN and await db.get_block(block_hash) is not None):
+        return {'ok': False, 'error': 'Block just added'}
     previous_hash = split_block_content(block_content)[0]
     next_block_id = await db.get_next_block_id()
     if block_no is None:
-        previous_block = await db.get_block(previous_hash)
+        _, last_block = await get_difficulty()
+        previous_block = last_block if last_block.get('hash') == previous_hash else await db.get_block(previous_hash)
         if previous_block is None:
             if 'Sender-Node' in request.headers:
                 background_tasks.add_task(sync_blockchain, request.headers['Sender-Node'])
@@ -340,15 +886,16 @@ async def push_block(request: Request, background_tasks: BackgroundTasks, block_
         final_transactions.extend(pending_transactions)
     if not await create_block(block_content, final_transactions):
         return {'ok': False}
+    Gossip.seen_blocks.add(block_hash)
 
     if 'Sender-Node' in request.headers:
         NodesManager.update_last_message(request.headers['Sender-Node'])
 
     background_tasks.add_task(propagate, 'push_block', {
         'block_content': block_content,
-        'txs': [tx.hex() for tx in final_transactions] if len(final_transactions) < 10 else txs,
+        'txs': [tx.hex() for tx in final_transactions],
         'block_no': block_no
-    })
+    }, request.headers.get('Sender-Node'))
     return {'ok': True}
 
 
@@ -366,34 +913,60 @@ async def sync(request: Request, node_url: str = None):
 LAST_PENDING_TRANSACTIONS_CLEAN = [0]
 
 
+class MiningTemplate:
+    # (last block hash, mempool version) the template has been built for
+    key: tuple = None
+    etag: str = None
+    body: bytes = None
+    pending_transactions: List[str] = None
+
+    @staticmethod
+    async def get() -> 'MiningTemplate':
+        # ChainState follows every chain tip change
+        difficulty, last_block = await get_difficulty()
+        key = (last_block.get('hash'), db.mempool.version)
+        if MiningTemplate.key != key:
+            # the mempool already knows the hashes
+            entries = sorted(db.mempool.get_ordered(MAX_BLOCK_SIZE_HEX), key=lambda entry: entry.tx_hex)
+            pending_transactions = [entry.tx_hex for entry in entries]
+            pending_transactions_hashes = [entry.tx_hash for entry in entries]
+            merkle_root = get_transactions_merkle_tree(pending_transactions[:10])
+            MiningTemplate.body = JSONResponse(jsonable_encoder({'ok': True, 'result': {
+                'difficulty': difficulty,
+                'last_block': last_block,
+                'pending_transactions': pending_transactions[:10],
+                'pending_transactions_hashes': pending_transactions_hashes,
+                'merkle_root': merkle_root
+            }})).body
+            MiningTemplate.etag = '"' + sha256(MiningTemplate.body) + '"'
+            MiningTemplate.pending_transactions = pending_transactions
+            MiningTemplate.key = key
+        return MiningTemplate
+
+
 @app.get("/get_mining_info")
-async def get_mining_info(background_tasks: BackgroundTasks):
-    Manager.difficulty = None
-    difficulty, last_block = await get_difficulty()
-    pending_transactions = await db.get_pending_transactions_limit(hex_only=True)
-    pending_transactions = sorted(pending_transactions)
+async def get_mining_info(request: Request, background_tasks: BackgroundTasks):
+    template = await MiningTemplate.get()
     if LAST_PENDING_TRANSACTIONS_CLEAN[0] < timestamp() - 600:
         print(LAST_PENDING_TRANSACTIONS_CLEAN[0])
         LAST_PENDING_TRANSACTIONS_CLEAN[0] = timestamp()
-        background_tasks.add_task(clear_pending_transactions, pending_transactions)
-    return {'ok': True, 'result': {
-        'difficulty': difficulty,
-        'last_block': last_block,
-        'pending_transactions': pending_transactions[:10],
-        'pending_transactions_hashes': [sha256(tx) for tx in pending_transactions],
-        'merkle_root': get_transactions_merkle_tree(pending_transactions[:10])
-    }}
+        background_tasks.add_task(clear_pending_transactions, template.pending_transactions)
+    if request.headers.get('If-None-Match') == template.etag:
+        return Response(status_code=304, headers={'ETag': template.etag}, background=background_tasks)
+    return Response(template.body, media_type='application/json', headers={'ETag': template.etag}, background=background_tasks)
 
 
 @app.get("/get_address_info")
 @limiter.limit("2/second")
-async def get_address_info(request: Request, address: str, transactions_count_limit: int = Query(default=5, le=50), show_pending: bool = False, verify: bool = False):
-    outputs = await db.get_spendable_outputs(address)
-    balance = sum(output.amount for output in outputs)
+async def get_address_info(request: Request, address: str, transactions_count_limit: int = Query(default=5, le=50), show_pending: bool = False, show_outputs: bool = False, verify: bool = False, cursor: str = Query(default=None, regex='^[0-9]+:[0-9a-f]{64}$')):
+    balance = await db.get_address_balance(address)
+    outputs = await db.get_spendable_outputs(address) if show_outputs else None
+    transactions, next_cursor = await db.get_address_transactions_page(address, transactions_count_limit, cursor, check_signatures=True) if transactions_count_limit > 0 else ([], None)
     return {'ok': True, 'result': {
         'balance': "{:f}".format(balance),
-        'spendable_outputs': [{'amount': "{:f}".format(output.amount), 'tx_hash': output.tx_hash, 'index': output.index} for output in outputs],
-        'transactions': [await db.get_nice_transaction(tx.hash(), address if verify else None) for tx in await db.get_address_transactions(address, limit=transactions_count_limit, check_signatures=True)] if transactions_count_limit > 0 else [],
+        'spendable_outputs': [{'amount': "{:f}".format(output.amount), 'tx_hash': output.tx_hash, 'index': output.index} for output in outputs] if show_outputs else None,
+        'transactions': [await db.get_nice_transaction(tx.hash(), address if verify else None) for tx in transactions],
+        'next_cursor': next_cursor,
         'pending_transactions': [await db.get_nice_transaction(tx.hash(), address if verify else None) for tx in await db.get_address_pending_transactions(address, True)] if show_pending else None,
         'pending_spent_outputs': await db.get_address_pending_spent_outputs(address) if show_pending else None
     }}
@@ -465,3 +1038,21 @@ async def get_block(request: Request, block: str, full_transactions: bool = Fals
 async def get_blocks(request: Request, offset: int, limit: int = Query(default=..., le=1000)):
     blocks = await db.get_blocks(offset, limit)
     return {'ok': True, 'result': blocks}
+
+
+@app.get("/get_block_headers")
+@limiter.limit("10/minute")
+async def get_block_headers(request: Request, offset: int, limit: int = Query(default=..., le=10_000)):
+    return {'ok': True, 'result': await db.get_block_headers(offset, limit)}
+
+
+async def _encode_blocks_stream(offset: int, limit: int):
+    async for block in db.stream_blocks(offset, limit):
+        yield json.dumps(jsonable_encoder(block), separators=(',', ':')).encode() + b'\n'
+
+
+@app.get("/get_blocks_stream")
+@limiter.limit("10/minute")
+async def get_blocks_stream(request: Request, offset: int, limit: int = Query(default=..., le=10_000)):
+    # one JSON line per block, same objects as /get_blocks but without the total size cap
+    return StreamingResponse(_encode_blocks_stream(offset, limit), media_type='application/x-ndjson')
@@ -0,0 +1,102 @@
+import argparse
+import asyncio
+import os
+import sys
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, dir_path + "/../..")
+
+from denaro import Database
+
+Database.credentials = {
+    'user': os.environ.get('DENARO_DATABASE_USER', 'postgres'),
+    'password': os.environ.get('DENARO_DATABASE_PASSWORD', 'root'),
+    'database': os.environ.get('DENARO_DATABASE_NAME', 'denaro'),
+    'host': os.environ.get('DENARO_DATABASE_HOST', None)
+}
+
+
+async def verify_utxo_commitment(db: Database, fix: bool) -> bool:
+    stored = await db.get_utxo_commitment()
+    computed = await db.compute_utxo_commitment()
+    print(f'Stored commitment:   {stored:064x}\nComputed commitment: {computed:064x}')
+    if stored == computed:
+        print('Unspent outputs commitment is consistent')
+        return True
+    print('Unspent outputs commitment does not match the unspent outputs table')
+    if fix:
+        await db.set_utxo_commitment(computed)
+        print('Stored commitment has been replaced with the computed one')
+    return False
+
+
+async def backfill_address_transactions(db: Database):
+    if await db.get_node_state('address_transactions_indexed') is not None:
+        print('Address transactions are already indexed')
+        return
+    await db.backfill_address_transactions()
+    print('Address transactions have been indexed')
+
+
+async def check_address_balances(db: Database, fix: bool) -> bool:
+    if await db.get_node_state('address_balances_indexed') is None:
+        print('Address balances are computed after backfill_address_transactions')
+        return False
+    stored = await db.get_stored_address_balances()
+    computed = {address: balance for address, balance in (await db.compute_address_balances()).items() if balance}
+    different = [address for address in stored.keys() | computed.keys() if stored.get(address) != computed.get(address)]
+    for address in different[:20]:
+        print(f'{address}: stored {stored.get(address, 0)}, computed {computed.get(address, 0)}')
+    if not different:
+        print('Address balances are consistent')
+        return True
+    print(f'{len(different)} address balances do not match the unspent outputs')
+    if fix:
+        await db.build_address_balances()
+        print('Address balances have been computed again')
+    return False
+
+
+def print_tables_sizes(sizes: dict):
+    for table, (table_size, indexes_size) in sorted(sizes.items()):
+        print(f'{table:<24} table {table_size / 1024 ** 2:>10.1f} MiB   indexes {indexes_size / 1024 ** 2:>10.1f} MiB')
+    print(f'{"total":<24} table {sum(size[0] for size in sizes.values()) / 1024 ** 2:>10.1f} MiB   indexes {sum(size[1] for size in sizes.values()) / 1024 ** 2:>10.1f} MiB')
+
+
+async def migrate_binary_schema(db: Database):
+    if db.binary_schema:
+        print('Hashes and transactions are already stored as bytea')
+        return
+    # the tables are rewritten and locked, the node must be stopped
+    print('Before:')
+    print_tables_sizes(await db.get_tables_sizes())
+    await db.migrate_binary_schema()
+    print('After:')
+    print_tables_sizes(await db.get_tables_sizes())
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Denaro node maintenance')
+    parser.add_argument('command', metavar='command', type=str, help='maintenance task to run', choices=['verify_utxo_commitment', 'backfill_address_transactions', 'check_address_balances', 'migrate_binary_schema'])
+    parser.add_argument('--fix', action='store_true', help='repair the stored state when it is not consistent')
+
+    args = parser.parse_args()
+    db: Database = await Database.get()
+
+    command = args.command
+
+    if command == 'verify_utxo_commitment':
+        ok = await verify_utxo_commitment(db, args.fix)
+        sys.exit(0 if ok or args.fix else 1)
+    elif command == 'backfill_address_transactions':
+        await backfill_address_transactions(db)
+    elif command == 'check_address_balances':
+        ok = await check_address_balances(db, args.fix)
+        sys.exit(0 if ok or args.fix else 1)
+    elif command == 'migrate_binary_schema':
+        await migrate_binary_schema(db)
+
+
+if __name__ == '__main__':
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(main())
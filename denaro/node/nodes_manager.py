@@ -1,52 +1,158 @@
+import asyncio
 import json
 import os
+import sqlite3
+from collections import OrderedDict
 from os.path import dirname, exists
 from random import sample
+from time import perf_counter
 
 import httpx
-import pickledb
 
 from ..constants import MAX_BLOCK_SIZE_HEX
+from ..exceptions import RateLimitedException
 from ..helpers import timestamp
 
 ACTIVE_NODES_DELTA = 60 * 60 * 24 * 7  # 7 days
 INACTIVE_NODES_DELTA = 60 * 60 * 24 * 90  # 3 months
 MAX_NODES_COUNT = 100
+# a streamed block is a JSON line with the block and its transactions
+MAX_STREAM_LINE_SIZE = MAX_BLOCK_SIZE_HEX * 2
+DEFAULT_NODE = 'https://denaro-node.gaetano.eu.org'
+# seconds to wait after a 429 without a Retry-After header, the node limits are per minute
+RATE_LIMIT_RETRY_AFTER = 60
 
 path = dirname(os.path.realpath(__file__)) + '/nodes.json'
-if not exists(path):
-    json.dump({}, open(path, 'wt'))
-db = pickledb.load(path, True)
+db_path = os.environ.get('DENARO_NODES_DB', dirname(os.path.realpath(__file__)) + '/nodes.db')
+
+
+class Peer:
+    __slots__ = ('url', 'last_message', 'score')
+
+    def __init__(self, url: str, last_message: int = 0, score: float = 0):
+        self.url = url
+        self.last_message = last_message
+        self.score = score
+
+
+class NodesStore:
+    # peers are kept in sqlite, only the flush task and the startup touch the file
+
+    @staticmethod
+    def connect():
+        connection = sqlite3.connect(db_path)
+        connection.execute('CREATE TABLE IF NOT EXISTS peers (url TEXT PRIMARY KEY, last_message INTEGER NOT NULL DEFAULT 0, score REAL NOT NULL DEFAULT 0)')
+        connection.execute('CREATE INDEX IF NOT EXISTS peers_last_message_idx ON peers (last_message)')
+        return connection
+
+    @staticmethod
+    def load() -> list:
+        migrate = not exists(db_path)
+        connection = NodesStore.connect()
+        try:
+            if migrate and exists(path):
+                # first run after the pickledb nodes.json
+                with open(path) as f:
+                    data = json.load(f)
+                last_messages = data.get('last_messages') or {}
+                urls = dict.fromkeys(node.strip('/') for node in list(data.get('nodes') or []) + list(last_messages) if len(node.strip('/')))
+                rows = [(url, max(int(last_messages.get(url, 0)), int(last_messages.get(url + '/', 0))), 0) for url in urls]
+                with connection:
+                    connection.executemany('INSERT OR REPLACE INTO peers (url, last_message, score) VALUES (?, ?, ?)', rows)
+            return connection.execute('SELECT url, last_message, score FROM peers').fetchall()
+        finally:
+            connection.close()
+
+    @staticmethod
+    def write(rows: list, removed: list):
+        connection = NodesStore.connect()
+        try:
+            with connection:
+                connection.executemany('INSERT OR REPLACE INTO peers (url, last_message, score) VALUES (?, ?, ?)', rows)
+                connection.executemany('DELETE FROM peers WHERE url = ?', [(url,) for url in removed])
+        finally:
+            connection.close()
+
+
+def check_rate_limit(response: httpx.Response):
+    if response.status_code == 429:
+        retry_after = response.headers.get('Retry-After', '')
+        raise RateLimitedException(int(retry_after) if retry_after.isdigit() else RATE_LIMIT_RETRY_AFTER)
 
 
 class NodesManager:
-    last_messages: dict = None
-    nodes: list = None
-    db = db
+    # url -> Peer, ordered by last message, most recent last
+    peers: OrderedDict = None
+    dirty: set = set()
 
     timeout = httpx.Timeout(3)
     async_client = httpx.AsyncClient(timeout=timeout, follow_redirects=True)
 
     @staticmethod
     def init():
-        NodesManager.db._loaddb()
-        NodesManager.nodes = NodesManager.db.get('nodes') or ['https://denaro-node.gaetano.eu.org']
-        NodesManager.last_messages = NodesManager.db.get('last_messages') or {'https://denaro-node.gaetano.eu.org': timestamp()}
+        if NodesManager.peers is not None:
+            return
+        peers = [Peer(url, last_message, score) for url, last_message, score in NodesStore.load()]
+        if not peers:
+            peers = [Peer(DEFAULT_NODE, timestamp())]
+            NodesManager.dirty.add(DEFAULT_NODE)
+        peers.sort(key=lambda peer: peer.last_message)
+        NodesManager.peers = OrderedDict((peer.url, peer) for peer in peers)
 
     @staticmethod
     def sync():
-        NodesManager.db.set('nodes', NodesManager.nodes)
-        NodesManager.db.set('last_messages', NodesManager.last_messages)
+        # changes are written in batches by flush, nothing to do on the request path
+        NodesManager.init()
+
+    @staticmethod
+    async def flush():
+        dirty = NodesManager.dirty
+        if not dirty:
+            return
+        NodesManager.dirty = set()
+        peers = NodesManager.peers
+        rows = [(url, peers[url].last_message, peers[url].score) for url in dirty if url in peers]
+        removed = [url for url in dirty if url not in peers]
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, NodesStore.write, rows, removed)
+        except Exception:
+            NodesManager.dirty |= dirty
+            raise
 
     @staticmethod
     async def request(url: str, method: str = 'GET', **kwargs):
         async with NodesManager.async_client.stream(method, url, **kwargs) as response:
-            res = ''
+            check_rate_limit(response)
+            chunks = []
+            size = 0
             async for chunk in response.aiter_text():
-                res += chunk
-                if len(res) > MAX_BLOCK_SIZE_HEX * 10:
+                chunks.append(chunk)
+                size += len(chunk)
+                if size > MAX_BLOCK_SIZE_HEX * 10:
                     break
-        return json.loads(res)
+        return json.loads(''.join(chunks))
+
+    @staticmethod
+    async def request_lines(url: str, **kwargs):
+        # yields the JSON lines of a streamed response as soon as they are complete
+        async with NodesManager.async_client.stream('GET', url, **kwargs) as response:
+            check_rate_limit(response)
+            response.raise_for_status()
+            buffer = bytearray()
+            async for chunk in response.aiter_bytes():
+                start = len(buffer)
+                buffer += chunk
+                end = buffer.find(b'\n', start)
+                while end != -1:
+                    if end > MAX_STREAM_LINE_SIZE:
+                        raise Exception('streamed line is too big')
+                    line = bytes(buffer[:end])
+                    del buffer[:end + 1]
+                    if line.strip():
+                        yield json.loads(line)
+                    end = buffer.find(b'\n')
+                if len(buffer) > MAX_STREAM_LINE_SIZE:
+                    raise Exception('streamed line is too big')
 
     @staticmethod
     async def is_node_working(node: str):
@@ -59,60 +165,114 @@ class NodesManager:
     @staticmethod
     def add_node(node: str):
         node = node.strip('/')
-        if len(NodesManager.nodes) > MAX_NODES_COUNT or len(NodesManager.get_zero_nodes()) > 10:
+        NodesManager.init()
+        if node in NodesManager.peers or not len(node):
+            return
+        if len(NodesManager.peers) > MAX_NODES_COUNT or len(NodesManager.get_zero_nodes()) > 10:
             NodesManager.clear_old_nodes()
-        if len(NodesManager.nodes) > MAX_NODES_COUNT:
+        if len(NodesManager.peers) > MAX_NODES_COUNT:
             raise Exception('Too many nodes')
-        NodesManager.init()
-        NodesManager.nodes.append(node)
-        NodesManager.sync()
+        # never heard from, so it goes before every other peer
+        NodesManager.peers[node] = Peer(node)
+        NodesManager.peers.move_to_end(node, last=False)
+        NodesManager.dirty.add(node)
 
     @staticmethod
     def get_nodes():
         NodesManager.init()
-        NodesManager.nodes.extend(NodesManager.last_messages.keys())
-        NodesManager.nodes = [node.strip('/') for node in NodesManager.nodes if len(node)]
-        NodesManager.nodes = list(dict.fromkeys(NodesManager.nodes))
-        NodesManager.sync()
-        return NodesManager.nodes
+        return list(NodesManager.peers)
 
     @staticmethod
     def get_recent_nodes():
-        full_nodes = {node_url: NodesManager.get_last_message(node_url) for node_url in NodesManager.get_nodes()}
-        return [item[0] for item in sorted(full_nodes.items(), key=lambda item: item[1], reverse=True) if item[1] > timestamp() - ACTIVE_NODES_DELTA]
+        NodesManager.init()
+        since = timestamp() - ACTIVE_NODES_DELTA
+        nodes = []
+        for peer in reversed(NodesManager.peers.values()):
+            if peer.last_message <= since:
+                break
+            nodes.append(peer.url)
+        return nodes
 
     @staticmethod
     def get_zero_nodes():
-        return [node for node in NodesManager.get_nodes() if NodesManager.get_last_message(node) == 0]
+        NodesManager.init()
+        return [peer.url for peer in NodesManager.peers.values() if peer.last_message == 0]
 
     @staticmethod
     def get_propagate_nodes():
         active_nodes = NodesManager.get_recent_nodes()
         zero_nodes = NodesManager.get_zero_nodes()
         return (sample(active_nodes, k=10) if len(active_nodes) > 10 else active_nodes) + (sample(zero_nodes, k=10) if len(zero_nodes) > 10 else zero_nodes)
+
     @staticmethod
     def clear_old_nodes():
         NodesManager.init()
-        NodesManager.nodes = [node for node in NodesManager.get_nodes() if NodesManager.get_last_message(node) > timestamp() - INACTIVE_NODES_DELTA]
-        NodesManager.sync()
+        since = timestamp() - INACTIVE_NODES_DELTA
+        for peer in list(NodesManager.peers.values()):
+            if peer.last_message > since:
+                break
+            del NodesManager.peers[peer.url]
+            NodesManager.dirty.add(peer.url)
 
     @staticmethod
     def get_last_message(node_url: str):
         NodesManager.init()
-        last_messages = NodesManager.last_messages
-        return last_messages[node_url] if node_url in last_messages else 0
+        peer = NodesManager.peers.get(node_url)
+        return peer.last_message if peer is not None else 0
 
     @staticmethod
     def update_last_message(node_url: str):
         NodesManager.init()
-        NodesManager.last_messages[node_url.strip('/')] = timestamp()
-        NodesManager.sync()
+        node_url = node_url.strip('/')
+        peer = NodesManager.peers.pop(node_url, None) or Peer(node_url)
+        peer.last_message = timestamp()
+        NodesManager.peers[node_url] = peer
+        NodesManager.dirty.add(node_url)
+
+    @staticmethod
+    def get_score(node_url: str) -> float:
+        NodesManager.init()
+        peer = NodesManager.peers.get(node_url)
+        return peer.score if peer is not None else 0
+
+    @staticmethod
+    def update_score(node_url: str, score: float):
+        NodesManager.init()
+        peer = NodesManager.peers.get(node_url)
+        if peer is not None:
+            peer.score = score
+            NodesManager.dirty.add(node_url)
+
+
+class SyncPeer:
+    # download statistics of a peer during a sync, the fastest peers get the next ranges
+    def __init__(self, node_interface: 'NodeInterface'):
+        self.node_interface = node_interface
+        self.throughput: float = None
+        self.failures = 0
+        # perf_counter time before which the peer is not asked again, after it answered 429
+        self.resume_at = 0.0
+
+    def rate_limited(self, retry_after: float):
+        # not a failure, the peer is only waited for
+        self.resume_at = perf_counter() + retry_after
+
+    def record(self, blocks: int, elapsed: float):
+        speed = blocks / max(elapsed, 0.001)
+        self.throughput = speed if self.throughput is None else self.throughput * 0.7 + speed * 0.3
+
+    def score(self) -> float:
+        # peers which did not download anything yet are tried first
+        if self.throughput is None:
+            return 0.0 if self.failures else float('inf')
+        return self.throughput / (1 + self.failures)
 
 
 class NodeInterface:
     def __init__(self, url: str):
         self.url = url.strip('/')
         self.base_url = self.url.replace('http://', '', 1).replace('https://', '', 1)
+        self.supports_stream = True
 
     async def get_block(self, block_no: int, full_transactions: bool = False):
         res = await self.request('get_block', {'block': block_no, 'full_transactions': full_transactions})
@@ -125,6 +285,27 @@ class NodeInterface:
             raise Exception(res['error'])
         return res['result']
 
+    async def stream_blocks(self, offset: int, limit: int):
+        async for block in NodesManager.request_lines(f'{self.url}/get_blocks_stream', params={'offset': offset, 'limit': limit}, timeout=10):
+            yield block
+
+    async def download_blocks(self, offset: int, limit: int):
+        if self.supports_stream:
+            try:
+                return [block async for block in self.stream_blocks(offset, limit)]
+            except httpx.HTTPStatusError as e:
+                # nodes without the streaming endpoint
+                if e.response.status_code not in (404, 405):
+                    raise
+                self.supports_stream = False
+        return await self.get_blocks(offset, limit)
+
+    async def get_block_headers(self, offset: int, limit: int):
+        res = await self.request('get_block_headers', {'offset': offset, 'limit': limit})
+        if 'result' not in res:
+            raise Exception(res.get('error') or res.get('detail'))
+        return res['result']
+
     async def get_nodes(self):
         res = await self.request('get_nodes')
         return res['result']
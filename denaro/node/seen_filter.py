@@ -0,0 +1,123 @@
+from collections import OrderedDict
+from hashlib import blake2b
+from math import ceil, log
+from time import monotonic
+
+# results of SeenFilter.lookup
+NOT_SEEN = 0
+PROBABLY_SEEN = 1
+SEEN = 2
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float):
+        self.size = max(8, ceil(-capacity * log(error_rate) / log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * log(2)))
+        self.bits = bytearray(ceil(self.size / 8))
+        self.set_bits = 0
+        self.count = 0
+
+    def get_positions(self, key: str):
+        digest = blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key: str) -> None:
+        for position in self.get_positions(key):
+            bit = 1 << (position & 7)
+            if not self.bits[position >> 3] & bit:
+                self.bits[position >> 3] |= bit
+                self.set_bits += 1
+        self.count += 1
+
+    def __contains__(self, key: str):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.get_positions(key))
+
+    def get_error_rate(self) -> float:
+        return (self.set_bits / self.size) ** self.hashes
+
+
+class SeenFilter:
+    # hashes seen in the last max_age seconds: exact for the most recent ones, probable for the older ones.
+    # with no capacity only the exact ones are kept
+    def __init__(self, capacity: int, lru_size: int, max_age: int, error_rate: float = 0.001):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.max_age = max_age
+        # two generations, the older one is dropped when the current one is full or half max_age old
+        self.current = BloomFilter(capacity, error_rate) if capacity else None
+        self.previous = BloomFilter(capacity, error_rate) if capacity else None
+        self.rotated_at = monotonic()
+        self.rotations = 0
+        # hash -> time it has been seen, least recently seen first
+        self.recent: OrderedDict = OrderedDict()
+        self.lru_size = lru_size
+        self.hits = 0
+        self.probable_hits = 0
+        self.misses = 0
+
+    def rotate(self) -> None:
+        self.previous = self.current
+        self.current = BloomFilter(self.capacity, self.error_rate)
+        self.rotated_at = monotonic()
+        self.rotations += 1
+
+    def expire(self, now: float) -> None:
+        if self.current is not None and now - self.rotated_at > self.max_age / 2:
+            self.rotate()
+        recent = self.recent
+        while recent and (len(recent) > self.lru_size or now - next(iter(recent.values())) > self.max_age):
+            recent.popitem(last=False)
+
+    def add(self, key: str) -> None:
+        now = monotonic()
+        self.expire(now)
+        self.recent[key] = now
+        self.recent.move_to_end(key)
+        if self.current is None:
+            return
+        if self.current.count >= self.capacity:
+            self.rotate()
+        if key not in self.current:
+            self.current.add(key)
+
+    def lookup(self, key: str) -> int:
+        now = monotonic()
+        self.expire(now)
+        if key in self.recent:
+            self.hits += 1
+            return SEEN
+        if self.current is not None and (key in self.current or key in self.previous):
+            # older than the exact window, or a false positive: the caller has to check it
+            self.probable_hits += 1
+            return PROBABLY_SEEN
+        self.misses += 1
+        return NOT_SEEN
+
+    def __contains__(self, key: str):
+        # only exact hits, a false positive must never drop a new hash
+        return self.lookup(key) == SEEN
+
+    def __len__(self):
+        if self.current is None:
+            return len(self.recent)
+        return self.current.count + self.previous.count
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.probable_hits + self.misses
+        current_error_rate = self.current.get_error_rate() if self.current is not None else 0
+        previous_error_rate = self.previous.get_error_rate() if self.previous is not None else 0
+        return {
+            'recent': len(self.recent),
+            'lru_size': self.lru_size,
+            'filter_count': len(self),
+            'capacity': self.capacity,
+            'rotations': self.rotations,
+            'hits': self.hits,
+            'probable_hits': self.probable_hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits + self.probable_hits) / lookups if lookups else 0,
+            # chance for a hash which has never been seen to be reported as seen
+            'false_positive_rate': 1 - (1 - current_error_rate) * (1 - previous_error_rate)
+        }
@@ -6,25 +6,52 @@ from ..transactions import TransactionOutput
 
 
 class CoinbaseTransaction:
-    _hex: str = None
-
     def __init__(self, block_hash: str, address: str, amount: Decimal):
-        self.block_hash = block_hash
-        self.address = address
-        self.amount = amount
+        self._bytes: bytes = None
+        self._block_hash = block_hash
+        self._address = address
+        self._amount = amount
         self.outputs = [TransactionOutput(address, amount)]
 
+    # the serialized bytes are cached, every field they depend on drops them when it changes
+
+    @property
+    def block_hash(self) -> str:
+        return self._block_hash
+
+    @block_hash.setter
+    def block_hash(self, block_hash: str):
+        self._block_hash = block_hash
+        self._bytes = None
+
+    @property
+    def address(self) -> str:
+        return self._address
+
+    @address.setter
+    def address(self, address: str):
+        self._address = address
+        self.outputs = [TransactionOutput(address, self._amount)]
+        self._bytes = None
+
+    @property
+    def amount(self) -> Decimal:
+        return self._amount
+
+    @amount.setter
+    def amount(self, amount: Decimal):
+        self._amount = amount
+        self.outputs = [TransactionOutput(self._address, amount)]
+        self._bytes = None
+
     async def verify(self):
         from .. import Database
         block = await (await Database.get()).get_block(self.block_hash)
         return block['address'] == self.address and self.amount == block['reward']
 
-    def hex(self):
-        if self._hex is not None:
-            return self._hex
-        hex_inputs = (bytes.fromhex(self.block_hash) + (0).to_bytes(1, ENDIAN)).hex()
-        hex_outputs = ''.join(tx_output.tobytes().hex() for tx_output in self.outputs)
-
+    def to_bytes(self):
+        if self._bytes is not None:
+            return self._bytes
         if all(len(tx_output.address_bytes) == 64 for tx_output in self.outputs):
             version = 1
         elif all(len(tx_output.address_bytes) == 33 for tx_output in self.outputs):
@@ -32,16 +59,18 @@ class CoinbaseTransaction:
         else:
             raise NotImplementedError()
 
-        self._hex = ''.join([
-            version.to_bytes(1, ENDIAN).hex(),
-            (1).to_bytes(1, ENDIAN).hex(),
-            hex_inputs,
-            (1).to_bytes(1, ENDIAN).hex(),
-            hex_outputs,
-            (36).to_bytes(1, ENDIAN).hex(),
+        self._bytes = b''.join([
+            bytes([version, 1]),
+            bytes.fromhex(self.block_hash) + (0).to_bytes(1, ENDIAN),
+            bytes([1]),
+            *(tx_output.tobytes() for tx_output in self.outputs),
+            bytes([36]),
         ])
 
-        return self._hex
+        return self._bytes
+
+    def hex(self):
+        return self.to_bytes().hex()
 
     def hash(self):
-        return sha256(self.hex())
+        return sha256(self.to_bytes())
@@ -1,5 +1,4 @@
 from decimal import Decimal
-from io import BytesIO
 from typing import List
 
 from fastecdsa import keys
@@ -8,7 +7,8 @@ from icecream import ic
 from . import TransactionInput, TransactionOutput
 from .coinbase_transaction import CoinbaseTransaction
 from ..constants import ENDIAN, SMALLEST, CURVE
-from ..helpers import point_to_string, bytes_to_string, sha256
+from ..helpers import point_to_string, bytes_to_address, sha256
+from ..verification import verify_signatures
 
 print = ic
 
@@ -19,6 +19,8 @@ class Transaction:
             raise Exception(f'You can spend max 255 inputs in a single transactions, not {len(inputs)}')
         if len(outputs) >= 256:
             raise Exception(f'You can have max 255 outputs in a single transactions, not {len(outputs)}')
+        self._bytes: bytes = None
+        self.tx_hash: str = None
         self.inputs = inputs
         self.outputs = outputs
         self.message = message
@@ -32,52 +34,83 @@ class Transaction:
         if version > 3:
             raise NotImplementedError()
         self.version = version
-        self._hex: str = None
         self.fees: Decimal = None
-        self.tx_hash: str = None
-
-    def hex(self, full: bool = True):
+        self.signatures_verified: bool = False
+
+    # the serialization is cached, setting the inputs or the outputs clears it.
+    # the lists must not be changed in place once the transaction is built
+    @property
+    def inputs(self) -> List[TransactionInput]:
+        return self._inputs
+
+    @inputs.setter
+    def inputs(self, inputs: List[TransactionInput]):
+        self._inputs = inputs
+        self.clear_cache()
+
+    @property
+    def outputs(self) -> List[TransactionOutput]:
+        return self._outputs
+
+    @outputs.setter
+    def outputs(self, outputs: List[TransactionOutput]):
+        self._outputs = outputs
+        self.clear_cache()
+
+    @property
+    def message(self) -> bytes:
+        return self._message
+
+    @message.setter
+    def message(self, message: bytes):
+        self._message = message
+        self.clear_cache()
+
+    def clear_cache(self):
+        self._bytes = None
+        self.tx_hash = None
+
+    def to_bytes(self, full: bool = True) -> bytes:
+        if full and self._bytes is not None:
+            return self._bytes
         inputs, outputs = self.inputs, self.outputs
-        hex_inputs = ''.join(tx_input.tobytes().hex() for tx_input in inputs)
-        hex_outputs = ''.join(tx_output.tobytes().hex() for tx_output in outputs)
-
         version = self.version
 
-        self._hex = ''.join([
-            version.to_bytes(1, ENDIAN).hex(),
-            len(inputs).to_bytes(1, ENDIAN).hex(),
-            hex_inputs,
-            (len(outputs)).to_bytes(1, ENDIAN).hex(),
-            hex_outputs
-        ])
+        parts = [bytes([version, len(inputs)])]
+        parts.extend(tx_input.tobytes() for tx_input in inputs)
+        parts.append(bytes([len(outputs)]))
+        parts.extend(tx_output.tobytes() for tx_output in outputs)
 
         if not full and (version <= 2 or self.message is None):
-            return self._hex
+            return b''.join(parts)
 
         if self.message is not None:
             if version <= 2:
-                self._hex += bytes([1, len(self.message)]).hex()
+                parts.append(bytes([1, len(self.message)]))
             else:
-                self._hex += bytes([1]).hex()
-                self._hex += (len(self.message)).to_bytes(2, ENDIAN).hex()
-            self._hex += self.message.hex()
+                parts.append(bytes([1]) + len(self.message).to_bytes(2, ENDIAN))
+            parts.append(self.message)
             if not full:
-                return self._hex
+                return b''.join(parts)
         else:
-            self._hex += (0).to_bytes(1, ENDIAN).hex()
+            parts.append(bytes([0]))
 
         signatures = []
         for tx_input in inputs:
-            signed = tx_input.get_signature()
+            signed = tx_input.get_signature_bytes()
             if signed not in signatures:
                 signatures.append(signed)
-                self._hex += signed
+                parts.append(signed)
 
-        return self._hex
+        self._bytes = b''.join(parts)
+        return self._bytes
+
+    def hex(self, full: bool = True):
+        return self.to_bytes(full).hex()
 
     def hash(self):
         if self.tx_hash is None:
-            self.tx_hash = sha256(self.hex())
+            self.tx_hash = sha256(self.to_bytes())
         return self.tx_hash
 
     def _verify_double_spend_same_transaction(self):
@@ -114,26 +147,38 @@ class Transaction:
                 tx_input.transaction_info = txs[tx_hash]
 
     async def _check_signature(self):
+        checks = await self.get_signature_checks()
+        if checks is None:
+            return False
+        if not all(verify_signatures(checks)):
+            print('signature not valid')
+            return False
+        return True
+
+    async def get_signature_checks(self):
         tx_hex = self.hex(False)
+        checks = []
         checked_signatures = []
         for tx_input in self.inputs:
             if tx_input.signed is None:
                 print('not signed')
-                return False
-            await tx_input.get_public_key()
+                return None
+            try:
+                public_key = await tx_input.get_public_key()
+            except AssertionError:
+                # the spent transaction is not known
+                return None
             signature = (tx_input.public_key, tx_input.signed)
             if signature in checked_signatures:
                 continue
-            if not await tx_input.verify(tx_hex):
-                print('signature not valid')
-                return False
+            checks.append((tx_input.signed, tx_hex, public_key.x, public_key.y))
             checked_signatures.append(signature)
-        return True
+        return checks
 
     def _verify_outputs(self):
         return (self.outputs or self.hash() == '915ddf143e14647ba1e04c44cf61e57084254c44cd4454318240f359a414065c') and all(tx_output.verify() for tx_output in self.outputs)
 
-    async def verify(self, check_double_spend: bool = True) -> bool:
+    async def verify(self, check_double_spend: bool = True, check_signatures: bool = True) -> bool:
         if check_double_spend and not self._verify_double_spend_same_transaction():
             print('double spend inside same transaction')
             return False
@@ -144,7 +189,7 @@ class Transaction:
 
         await self._fill_transaction_inputs()
 
-        if not await self._check_signature():
+        if check_signatures and not await self._check_signature():
             return False
 
         if not self._verify_outputs():
@@ -171,53 +216,69 @@ class Transaction:
         for input in self.inputs:
             if input.private_key is not None:
                 input.sign(self.hex(False))
+        self.clear_cache()
         return self
 
     async def get_fees(self):
-        input_amount = 0
+        input_units = 0
         for tx_input in self.inputs:
-            input_amount += await tx_input.get_amount()
+            input_units += await tx_input.get_units()
 
-        output_amount = sum(tx_output.amount for tx_output in self.outputs)
+        output_units = sum(tx_output.units for tx_output in self.outputs)
 
-        self.fees = input_amount - output_amount
-        assert (self.fees * SMALLEST) % 1 == 0.0
+        self.fees = Decimal(input_units - output_units) / SMALLEST
         return self.fees
 
     @staticmethod
     async def from_hex(hexstring: str, check_signatures: bool = True):
-        tx_bytes = BytesIO(bytes.fromhex(hexstring))
-        version = int.from_bytes(tx_bytes.read(1), ENDIAN)
+        return await Transaction.from_bytes(bytes.fromhex(hexstring), check_signatures)
+
+    @staticmethod
+    async def from_bytes(tx_bytes: bytes, check_signatures: bool = True):
+        # slicing past the end gives empty views, which read as 0 like the previous stream based parser
+        view = memoryview(tx_bytes)
+        version = int.from_bytes(view[0:1], ENDIAN)
         if version > 3:
             raise NotImplementedError()
 
-        inputs_count = int.from_bytes(tx_bytes.read(1), ENDIAN)
+        inputs_count = int.from_bytes(view[1:2], ENDIAN)
+        offset = 2
 
         inputs = []
 
         for i in range(0, inputs_count):
-            tx_hex = tx_bytes.read(32).hex()
-            tx_index = int.from_bytes(tx_bytes.read(1), ENDIAN)
+            tx_hex = view[offset:offset + 32].hex()
+            tx_index = int.from_bytes(view[offset + 32:offset + 33], ENDIAN)
             inputs.append(TransactionInput(tx_hex, index=tx_index))
+            offset += 33
 
-        outputs_count = int.from_bytes(tx_bytes.read(1), ENDIAN)
+        outputs_count = int.from_bytes(view[offset:offset + 1], ENDIAN)
+        offset += 1
 
         outputs = []
+        pubkey_length = 64 if version == 1 else 33
 
         for i in range(0, outputs_count):
-            pubkey = tx_bytes.read(64 if version == 1 else 33)
-            amount_length = int.from_bytes(tx_bytes.read(1), ENDIAN)
-            amount = int.from_bytes(tx_bytes.read(amount_length), ENDIAN) / Decimal(SMALLEST)
-            outputs.append(TransactionOutput(bytes_to_string(pubkey), amount))
-
-        specifier = int.from_bytes(tx_bytes.read(1), ENDIAN)
+            pubkey = bytes(view[offset:offset + pubkey_length])
+            offset += pubkey_length
+            amount_length = int.from_bytes(view[offset:offset + 1], ENDIAN)
+            units = int.from_bytes(view[offset + 1:offset + 1 + amount_length], ENDIAN)
+            offset += 1 + amount_length
+            address, address_bytes = bytes_to_address(pubkey)
+            outputs.append(TransactionOutput(address, units=units, address_bytes=address_bytes))
+
+        specifier = int.from_bytes(view[offset:offset + 1], ENDIAN)
+        offset += 1
         if specifier == 36:
             assert len(inputs) == 1 and len(outputs) == 1
             return CoinbaseTransaction(inputs[0].tx_hash, outputs[0].address, outputs[0].amount)
         else:
             if specifier == 1:
-                message_length = int.from_bytes(tx_bytes.read(1 if version <= 2 else 2), ENDIAN)
-                message = tx_bytes.read(message_length)
+                message_length_size = 1 if version <= 2 else 2
+                message_length = int.from_bytes(view[offset:offset + message_length_size], ENDIAN)
+                offset += message_length_size
+                message = bytes(view[offset:offset + message_length])
+                offset += message_length
             else:
                 message = None
                 assert specifier == 0
@@ -225,7 +286,8 @@ class Transaction:
             signatures = []
 
             while True:
-                signed = (int.from_bytes(tx_bytes.read(32), ENDIAN), int.from_bytes(tx_bytes.read(32), ENDIAN))
+                signed = (int.from_bytes(view[offset:offset + 32], ENDIAN), int.from_bytes(view[offset + 32:offset + 64], ENDIAN))
+                offset += 64
                 if signed[0] == 0:
                     break
                 signatures.append(signed)
@@ -254,7 +316,7 @@ class Transaction:
 
     def __eq__(self, other):
         if isinstance(other, self.__class__):
-            return self.hex() == other.hex()
+            return self.to_bytes() == other.to_bytes()
         else:
             return False
 
@@ -9,22 +9,34 @@ from ..helpers import point_to_string, string_to_point
 
 
 class TransactionInput:
-    public_key = None
+    __slots__ = ('tx_hash', 'index', 'private_key', 'transaction', 'transaction_info', 'units', 'public_key', 'signed')
 
-    signed: Tuple[int, int] = None
-    amount: Decimal = None
-
-    def __init__(self, input_tx_hash: str, index: int, private_key: int = None, transaction=None, amount: Decimal = None, public_key: Point = None):
+    def __init__(self, input_tx_hash: str, index: int, private_key: int = None, transaction=None, amount: Decimal = None, public_key: Point = None, units: int = None):
         self.tx_hash = input_tx_hash
         self.index = index
         self.private_key = private_key
         self.transaction = transaction
         self.transaction_info = None
-        self.amount = amount
+        self.units = units
+        if units is None and amount is not None:
+            self.amount = amount
         self.public_key = public_key
+        self.signed: Tuple[int, int] = None
         if transaction is not None and amount is None:
             self.get_related_output()
 
+    @property
+    def amount(self) -> Decimal:
+        return Decimal(self.units) / SMALLEST if self.units is not None else None
+
+    @amount.setter
+    def amount(self, amount: Decimal):
+        if amount is None:
+            self.units = None
+            return
+        assert (amount * SMALLEST) % 1 == 0.0, 'too many decimal digits'
+        self.units = int(amount * SMALLEST)
+
     async def get_transaction(self):
         if self.transaction is None:
             from .. import Database
@@ -42,22 +54,26 @@ class TransactionInput:
     async def get_related_output(self):
         tx = await self.get_transaction()
         related_output = tx.outputs[self.index]
-        self.amount = related_output.amount
+        self.units = related_output.units
         return related_output
 
     async def get_related_output_info(self):
         tx = await self.get_transaction_info()
-        related_output = {'address': tx['outputs_addresses'][self.index], 'amount': Decimal(tx['outputs_amounts'][self.index]) / SMALLEST}
-        self.amount = related_output['amount']
+        units = int(tx['outputs_amounts'][self.index])
+        related_output = {'address': tx['outputs_addresses'][self.index], 'amount': Decimal(units) / SMALLEST}
+        self.units = units
         return related_output
 
-    async def get_amount(self):
-        if self.amount is None:
+    async def get_units(self) -> int:
+        if self.units is None:
             if self.transaction is not None:
-                return self.transaction.outputs[self.index].amount
+                return self.transaction.outputs[self.index].units
             else:
                 await self.get_related_output_info()
-        return self.amount
+        return self.units
+
+    async def get_amount(self):
+        return Decimal(await self.get_units()) / SMALLEST
 
     async def get_address(self):
         if self.transaction is not None:
@@ -74,8 +90,11 @@ class TransactionInput:
     def tobytes(self):
         return bytes.fromhex(self.tx_hash) + self.index.to_bytes(1, ENDIAN)
 
+    def get_signature_bytes(self):
+        return self.signed[0].to_bytes(32, ENDIAN) + self.signed[1].to_bytes(32, ENDIAN)
+
     def get_signature(self):
-        return self.signed[0].to_bytes(32, ENDIAN).hex() + self.signed[1].to_bytes(32, ENDIAN).hex()
+        return self.get_signature_bytes().hex()
 
     async def verify(self, input_tx) -> bool:
         try:
@@ -90,12 +109,14 @@ class TransactionInput:
 
     @property
     def as_dict(self):
-        self_dict = vars(self).copy()
-        self_dict['signed'] = self_dict['signed'] is not None
-        if 'public_key' in self_dict: self_dict['public_key'] = point_to_string(self_dict['public_key'])
-        if 'transaction' in self_dict: del self_dict['transaction']
-        if 'private_key' in self_dict: del self_dict['private_key']
-        return self_dict
+        return {
+            'tx_hash': self.tx_hash,
+            'index': self.index,
+            'transaction_info': self.transaction_info,
+            'amount': self.amount,
+            'public_key': point_to_string(self.public_key) if self.public_key is not None else None,
+            'signed': self.signed is not None
+        }
 
     def __eq__(self, other):
         assert isinstance(other, self.__class__)
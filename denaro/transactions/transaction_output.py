@@ -5,26 +5,56 @@ from ..helpers import byte_length, string_to_point, string_to_bytes
 
 
 class TransactionOutput:
-    def __init__(self, address: str, amount: Decimal):
+    __slots__ = ('address', 'units', '_address_bytes', '_public_key')
+
+    def __init__(self, address: str, amount: Decimal = None, units: int = None, address_bytes: bytes = None):
         from fastecdsa.point import Point
         if isinstance(address, Point):
             raise Exception('TransactionOutput does not accept Point anymore. Pass the address string instead')
         self.address = address
-        self.address_bytes = string_to_bytes(address)
-        self.public_key = string_to_point(address)
+        self._address_bytes = address_bytes
+        self._public_key = None
+        if units is None:
+            assert (amount * SMALLEST) % 1 == 0.0, 'too many decimal digits'
+            units = int(amount * SMALLEST)
+        self.units = units
+
+    @property
+    def amount(self) -> Decimal:
+        return Decimal(self.units) / SMALLEST
+
+    @amount.setter
+    def amount(self, amount: Decimal):
         assert (amount * SMALLEST) % 1 == 0.0, 'too many decimal digits'
-        self.amount = amount
+        self.units = int(amount * SMALLEST)
+
+    @property
+    def address_bytes(self) -> bytes:
+        if self._address_bytes is None:
+            self._address_bytes = string_to_bytes(self.address)
+        return self._address_bytes
+
+    @property
+    def public_key(self):
+        if self._public_key is None:
+            self._public_key = string_to_point(self.address)
+        return self._public_key
 
     def tobytes(self):
-        amount = int(self.amount * SMALLEST)
+        amount = self.units
         count = byte_length(amount)
         return self.address_bytes + count.to_bytes(1, ENDIAN) + amount.to_bytes(count, ENDIAN)
 
     def verify(self):
-        return self.amount > 0 and CURVE.is_point_on_curve((self.public_key.x, self.public_key.y))
+        if self.units <= 0:
+            return False
+        try:
+            public_key = self.public_key
+        except ValueError:
+            # not a point of the curve
+            return False
+        return CURVE.is_point_on_curve((public_key.x, public_key.y))
 
     @property
     def as_dict(self):
-        res = vars(self).copy()
-        if 'public_key' in res: del res['public_key']
-        return res
+        return {'address': self.address, 'address_bytes': self.address_bytes, 'amount': self.amount}
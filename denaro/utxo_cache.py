@@ -0,0 +1,55 @@
+from collections import OrderedDict
+from typing import List, Tuple
+
+
+class UTXOCache:
+    def __init__(self, max_size: int):
+        # (tx_hash, index) -> (amount in SMALLEST units, address), least recently used first
+        self.outputs: OrderedDict = OrderedDict()
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.outputs)
+
+    def __contains__(self, output: Tuple[str, int]):
+        return output in self.outputs
+
+    def get(self, outputs: List[Tuple[str, int]]) -> Tuple[List[Tuple[str, int]], List[Tuple[str, int]]]:
+        found, missing = [], []
+        for output in outputs:
+            if output in self.outputs:
+                self.outputs.move_to_end(output)
+                found.append(output)
+            else:
+                missing.append(output)
+        self.hits += len(found)
+        self.misses += len(missing)
+        return found, missing
+
+    def add(self, outputs: List[Tuple[str, int, int, str]]) -> None:
+        if not self.max_size:
+            return
+        for tx_hash, index, amount, address in outputs:
+            self.outputs[(tx_hash, index)] = (amount, address)
+            self.outputs.move_to_end((tx_hash, index))
+        while len(self.outputs) > self.max_size:
+            self.outputs.popitem(last=False)
+
+    def remove(self, outputs: List[Tuple[str, int]]) -> None:
+        for output in outputs:
+            self.outputs.pop(output, None)
+
+    def clear(self) -> None:
+        self.outputs.clear()
+
+    def stats(self) -> dict:
+        requests = self.hits + self.misses
+        return {
+            'size': len(self.outputs),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / requests if requests else 0
+        }
@@ -0,0 +1,53 @@
+import os
+from asyncio import get_running_loop, gather
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+
+from fastecdsa import ecdsa
+from fastecdsa.point import Point
+
+from .constants import CURVE
+
+# below this number of signatures the process pool costs more than it saves
+BATCH_MIN_SIGNATURES = 32
+
+
+def verify_signatures(checks: List[Tuple[Tuple[int, int], str, int, int]]) -> List[bool]:
+    results = []
+    for signed, message, x, y in checks:
+        public_key = Point(x, y, CURVE)
+        results.append(
+            ecdsa.verify(signed, bytes.fromhex(message), public_key, CURVE) or
+            ecdsa.verify(signed, message, public_key, CURVE)
+        )
+    return results
+
+
+class SignatureVerifier:
+    enabled: bool = os.environ.get('DENARO_BATCH_VERIFY', '1') == '1'
+    workers: int = int(os.environ.get('DENARO_BATCH_VERIFY_WORKERS', 0)) or os.cpu_count() or 1
+    executor: ProcessPoolExecutor = None
+
+    @staticmethod
+    def get_executor() -> ProcessPoolExecutor:
+        if SignatureVerifier.executor is None:
+            SignatureVerifier.executor = ProcessPoolExecutor(max_workers=SignatureVerifier.workers)
+        return SignatureVerifier.executor
+
+    @staticmethod
+    async def verify(checks: list) -> List[bool]:
+        if len(checks) < BATCH_MIN_SIGNATURES or SignatureVerifier.workers == 1:
+            return verify_signatures(checks)
+        loop = get_running_loop()
+        executor = SignatureVerifier.get_executor()
+        chunk_size = -(-len(checks) // (SignatureVerifier.workers * 4))
+        chunks = [checks[i:i + chunk_size] for i in range(0, len(checks), chunk_size)]
+        results = await gather(*[loop.run_in_executor(executor, verify_signatures, chunk) for chunk in chunks])
+        return sum(results, [])
+
+    @staticmethod
+    async def verify_transactions(transactions: list) -> List[bool]:
+        transactions_checks = [await transaction.get_signature_checks() for transaction in transactions]
+        unique_checks = list(dict.fromkeys(check for checks in transactions_checks if checks is not None for check in checks))
+        results = dict(zip(unique_checks, await SignatureVerifier.verify(unique_checks)))
+        return [checks is not None and all(results[check] for check in checks) for checks in transactions_checks]
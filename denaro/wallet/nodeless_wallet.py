@@ -20,7 +20,7 @@ NODE_URL = 'https://denaro-node.gaetano.eu.org'
 
 
 def get_address_info(address: str):
-    request = requests.get(f'{NODE_URL}/get_address_info', {'address': address, 'transactions_count_limit': 0, 'show_pending': True })
+    request = requests.get(f'{NODE_URL}/get_address_info', {'address': address, 'transactions_count_limit': 0, 'show_pending': True, 'show_outputs': True })
     result = request.json()['result']
     tx_inputs = []
     pending_spent_outputs = [tuple(output) for output in result['pending_spent_outputs']]
@@ -75,9 +75,10 @@ def create_transaction(private_keys, receiving_address, amount, message: bytes =
     if transaction_amount < amount:
         raise Exception(f"Consolidate outputs: send {transaction_amount} denari to yourself")
 
-    transaction = Transaction(transaction_inputs, [TransactionOutput(receiving_address, amount=amount)], message)
+    transaction_outputs = [TransactionOutput(receiving_address, amount=amount)]
     if transaction_amount > amount:
-        transaction.outputs.append(TransactionOutput(send_back_address, transaction_amount - amount))
+        transaction_outputs.append(TransactionOutput(send_back_address, transaction_amount - amount))
+    transaction = Transaction(transaction_inputs, transaction_outputs, message)
 
     transaction.sign(private_keys)
 
@@ -38,9 +38,10 @@ async def create_transaction(private_keys, receiving_address, amount, message: b
 
     transaction_amount = sum(input.amount for input in transaction_inputs)
 
-    transaction = Transaction(transaction_inputs, [TransactionOutput(receiving_address, amount=amount)], message)
+    transaction_outputs = [TransactionOutput(receiving_address, amount=amount)]
     if transaction_amount > amount:
-        transaction.outputs.append(TransactionOutput(send_back_address, transaction_amount - amount))
+        transaction_outputs.append(TransactionOutput(send_back_address, transaction_amount - amount))
+    transaction = Transaction(transaction_inputs, transaction_outputs, message)
 
     transaction.sign(private_keys)
 
@@ -0,0 +1,37 @@
+from django.db import migrations, models
+
+
+def create_missing_table(apps, schema_editor):
+    # the denaro node creates the same table on startup, whichever runs first creates it
+    NodeState = apps.get_model("node", "NodeState")
+    if NodeState._meta.db_table not in schema_editor.connection.introspection.table_names():
+        schema_editor.create_model(NodeState)
+
+
+def delete_table(apps, schema_editor):
+    schema_editor.delete_model(apps.get_model("node", "NodeState"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("node", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name="NodeState",
+                    fields=[
+                        ("key", models.TextField(primary_key=True, serialize=False)),
+                        ("value", models.TextField()),
+                    ],
+                    options={
+                        "db_table": "node_state",
+                    },
+                ),
+            ],
+        ),
+        migrations.RunPython(create_missing_table, delete_table),
+    ]
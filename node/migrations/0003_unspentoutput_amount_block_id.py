@@ -0,0 +1,44 @@
+from django.db import migrations, models
+
+
+def add_missing_columns(apps, schema_editor):
+    # the denaro node adds the same columns on startup, fills them and makes them not null.
+    # whichever runs first adds them, their nullability is left to the node
+    UnspentOutput = apps.get_model("node", "UnspentOutput")
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        columns = {column.name for column in connection.introspection.get_table_description(cursor, UnspentOutput._meta.db_table)}
+    for name in ("amount", "block_id"):
+        if name not in columns:
+            schema_editor.add_field(UnspentOutput, UnspentOutput._meta.get_field(name))
+
+
+def remove_columns(apps, schema_editor):
+    UnspentOutput = apps.get_model("node", "UnspentOutput")
+    for name in ("amount", "block_id"):
+        schema_editor.remove_field(UnspentOutput, UnspentOutput._meta.get_field(name))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("node", "0002_nodestate"),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddField(
+                    model_name="unspentoutput",
+                    name="amount",
+                    field=models.BigIntegerField(null=True),
+                ),
+                migrations.AddField(
+                    model_name="unspentoutput",
+                    name="block_id",
+                    field=models.IntegerField(null=True),
+                ),
+            ],
+        ),
+        migrations.RunPython(add_missing_columns, remove_columns),
+    ]
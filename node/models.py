@@ -33,6 +33,8 @@ class UnspentOutput(models.Model):
     tx_hash = models.ForeignKey(Transaction, on_delete=models.CASCADE)
     index = models.IntegerField()
     address = models.TextField()
+    amount = models.BigIntegerField(null=True)
+    block_id = models.IntegerField(null=True)
     class Meta:
         db_table = 'unspent_outputs'
 
@@ -52,3 +54,9 @@ class PendingSpentOutputs(models.Model):
     address = models.TextField()
     class Meta:
         db_table = 'pending_spent_outputs'
+
+class NodeState(models.Model):
+    key = models.TextField(primary_key=True)
+    value = models.TextField()
+    class Meta:
+        db_table = 'node_state'
@@ -20,7 +20,7 @@ from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
 
 from denaro.helpers import timestamp, sha256, transaction_to_json
-from denaro.manager import create_block, get_difficulty, Manager, get_transactions_merkle_tree, \
+from denaro.manager import create_block, get_difficulty, get_transactions_merkle_tree, \
     split_block_content, calculate_difficulty, clear_pending_transactions, block_to_bytes, get_transactions_merkle_tree_ordered
 from denaro.node.nodes_manager import NodesManager, NodeInterface
 from denaro.node.utils import ip_is_local
@@ -34,14 +34,16 @@ from denaro.constants import VERSION, ENDIAN
 transactions_cache = deque(maxlen=100)
 
 from django.http import JsonResponse
-from .models import UnspentOutput
+from .models import NodeState
 from .database import Database
 
 db = Database()
 
 def root(request):
-    output = UnspentOutput.objects.order_by('tx_hash','index')
-    unspent_outputs_hash = sha256(''.join(row.tx_hash + bytes([row.index]).hex() for row in output))
+    # incrementally maintained by the denaro node, see Database.update_utxo_commitment
+    commitment = NodeState.objects.filter(key='utxo_commitment').values_list('value', flat=True).first()
+    # the commitment is only written by the denaro node, a zero hash would be indistinguishable from an empty set
+    unspent_outputs_hash = '%064x' % int(commitment) if commitment is not None else None
     return JsonResponse({"version": VERSION, "unspent_outputs_hash": unspent_outputs_hash})
 
 
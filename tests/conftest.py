@@ -0,0 +1,148 @@
+import os
+import tempfile
+from decimal import Decimal
+from itertools import count
+
+import asyncpg
+import pytest
+from fastecdsa import keys
+
+from denaro import Database, manager
+from denaro.constants import CURVE, ENDIAN
+from denaro.helpers import point_to_string, sha256
+from denaro.transactions import CoinbaseTransaction, Transaction, TransactionInput, TransactionOutput
+
+# the node modules open the peer store when they are imported, the tests must not touch the real one
+os.environ.setdefault('DENARO_NODES_DB', os.path.join(tempfile.mkdtemp(), 'nodes.db'))
+
+REWARD = Decimal(100)
+SCHEMA = os.path.join(os.path.dirname(__file__), 'schema.sql')
+
+
+@pytest.fixture
+def scratch_database():
+    # the database tests wipe the configured database, they only run when one is given explicitly
+    name = os.environ.get('DENARO_TEST_DATABASE_NAME')
+    if not name:
+        pytest.skip('DENARO_TEST_DATABASE_NAME is not set')
+    credentials = {
+        'user': os.environ.get('DENARO_TEST_DATABASE_USER', 'denaro'),
+        'password': os.environ.get('DENARO_TEST_DATABASE_PASSWORD', ''),
+        'database': name,
+        'host': os.environ.get('DENARO_TEST_DATABASE_HOST', '127.0.0.1')
+    }
+
+    async def create() -> Database:
+        connection = await asyncpg.connect(**credentials)
+        try:
+            await connection.execute('DROP SCHEMA public CASCADE; CREATE SCHEMA public')
+            with open(SCHEMA) as f:
+                await connection.execute(f.read())
+        finally:
+            await connection.close()
+        manager.ChainState.invalidate()
+        return await Database.create(**credentials)
+
+    yield create
+    Database.instance = None
+    manager.ChainState.invalidate()
+
+
+@pytest.fixture
+def database_snapshot():
+    async def snapshot(database) -> dict:
+        async with database.pool.acquire() as connection:
+            tables = {
+                table: sorted(tuple(row) for row in await connection.fetch(f'SELECT * FROM {table}'))
+                for table in ('blocks', 'transactions', 'unspent_outputs', 'address_transactions')
+            }
+        tables['address_balances'] = await database.get_stored_address_balances()
+        tables['utxo_commitment'] = await database.get_utxo_commitment()
+        return tables
+
+    return snapshot
+
+
+@pytest.fixture
+def make_blocks():
+    # a chain where every block spends the reward of the previous one
+    private_key = keys.gen_private_key(CURVE)
+    public_key = keys.get_public_key(private_key, CURVE)
+    address = point_to_string(public_key)
+
+    async def make(count: int, start: int = 1, previous_coinbase: CoinbaseTransaction = None, seed: str = '', receiver: str = None) -> list:
+        blocks = []
+        for block_id in range(start, start + count):
+            block_hash = sha256(f'{seed}{block_id}'.encode())
+            transactions = []
+            if previous_coinbase is not None:
+                transaction = Transaction([TransactionInput(previous_coinbase.hash(), 0, public_key=public_key, amount=REWARD)], [TransactionOutput(receiver or address, REWARD)])
+                transaction.sign([private_key])
+                # set by the verification in the node
+                await transaction.get_fees()
+                transactions.append(transaction)
+            previous_coinbase = CoinbaseTransaction(block_hash, address, REWARD)
+            blocks.append({
+                'id': block_id,
+                'hash': block_hash,
+                'content': block_hash,
+                'address': address,
+                'random': 0,
+                'difficulty': Decimal('6.0'),
+                'reward': REWARD,
+                'timestamp': 1_700_000_000 + block_id * 180,
+                'transactions': transactions,
+                'coinbase_transaction': previous_coinbase
+            })
+        return blocks
+
+    return make
+
+
+@pytest.fixture
+def mine_blocks(monkeypatch):
+    # blocks which pass the consensus checks, with a difficulty low enough to mine them here
+    # and a retarget every 10 blocks
+    monkeypatch.setattr(manager, 'START_DIFFICULTY', Decimal('1.0'))
+    monkeypatch.setattr(manager, 'BLOCKS_COUNT', Decimal(10))
+    private_key = keys.gen_private_key(CURVE)
+    address = point_to_string(keys.get_public_key(private_key, CURVE))
+
+    async def mine(blocks_count: int, chain: list = (), block_time: int = 180, signer: int = None) -> list:
+        # blocks as /get_blocks returns them, from the tip of chain on. every block spends the reward of the
+        # previous one, signed by signer when it is given
+        chain = list(chain)
+        for _ in range(blocks_count):
+            last_block = chain[-1]['block'] if chain else {}
+            block_id = last_block['id'] + 1 if last_block else 1
+            window_start = chain[manager.get_window_start_id(last_block['id']) - 1]['block'] if last_block else None
+            difficulty = manager.get_next_difficulty(last_block, window_start)
+            transactions = []
+            if last_block:
+                previous_coinbase = CoinbaseTransaction(last_block['hash'], address, last_block['reward'])
+                transaction = Transaction([TransactionInput(previous_coinbase.hash(), 0, private_key=signer or private_key)], [TransactionOutput(address, last_block['reward'])])
+                transactions.append(transaction.sign())
+            merkle_tree = manager.get_transactions_merkle_tree_ordered([transaction.to_bytes() for transaction in transactions])
+            block_timestamp = (last_block['timestamp'] if last_block else 1_600_000_000) + block_time
+            previous_hash = last_block['hash'] if last_block else (30_06_2005).to_bytes(32, ENDIAN).hex()
+            for random in count():
+                content = manager.block_to_bytes(previous_hash, {'address': address, 'merkle_tree': merkle_tree, 'timestamp': block_timestamp, 'difficulty': difficulty, 'random': random}).hex()
+                if await manager.check_block_is_valid(content, (difficulty, last_block)):
+                    break
+            block_hash = sha256(content)
+            chain.append({
+                'block': {
+                    'id': block_id,
+                    'hash': block_hash,
+                    'content': content,
+                    'address': address,
+                    'random': random,
+                    'difficulty': difficulty,
+                    'reward': REWARD,
+                    'timestamp': block_timestamp
+                },
+                'transactions': [CoinbaseTransaction(block_hash, address, REWARD).hex()] + [transaction.hex() for transaction in transactions]
+            })
+        return chain[len(chain) - blocks_count:]
+
+    return mine
@@ -0,0 +1,59 @@
+import asyncio
+from decimal import Decimal
+
+from fastecdsa import keys
+
+from denaro.constants import CURVE
+from denaro.database import Database
+from denaro.helpers import AddressFormat, point_to_string
+from denaro.mempool import get_address_key
+
+RECEIVER_POINT = keys.get_public_key(keys.gen_private_key(CURVE), CURVE)
+RECEIVER = point_to_string(RECEIVER_POINT)
+
+
+def test_deltas_are_summed_per_address():
+    records = [('a', 1, 'x', 5), ('b', 1, 'x', -5), ('a', 2, 'y', 3)]
+    assert Database.get_address_deltas(records) == {'a': 8, 'b': -5}
+
+
+async def assert_balances(database, expected: dict):
+    assert await database.get_stored_address_balances() == await database.compute_address_balances()
+    for address, balance in expected.items():
+        assert await database.get_address_balance(address) == Decimal(balance)
+    # the cached balances are adjusted too
+    for address, balance in expected.items():
+        assert await database.get_address_balance(address) == Decimal(balance)
+
+
+def test_balances_follow_connect_and_disconnect(scratch_database, make_blocks):
+    async def run():
+        database = await scratch_database()
+        try:
+            blocks = await make_blocks(20, receiver=RECEIVER)
+            miner = blocks[0]['address']
+            await database.add_blocks(blocks[:10])
+            await assert_balances(database, {miner: 100, RECEIVER: 900})
+            for block in blocks[10:]:
+                await database.add_blocks([block])
+            await assert_balances(database, {miner: 100, RECEIVER: 1900})
+            # any format of the address has the same balance
+            assert await database.get_address_balance(point_to_string(RECEIVER_POINT, AddressFormat.FULL_HEX)) == 1900
+            assert get_address_key(RECEIVER) in await database.get_stored_address_balances()
+
+            await database.remove_blocks(16)
+            await assert_balances(database, {miner: 100, RECEIVER: 1400})
+            await database.remove_blocks(2)
+            await assert_balances(database, {miner: 100, RECEIVER: 0})
+
+            fork = await make_blocks(5, 2, blocks[0]['coinbase_transaction'], 'fork')
+            await database.add_blocks(fork)
+            await assert_balances(database, {miner: 600, RECEIVER: 0})
+
+            await database.delete_blocks(0)
+            assert await database.get_stored_address_balances() == {}
+            assert await database.get_address_balance(miner) == 0
+        finally:
+            await database.pool.close()
+
+    asyncio.run(run())
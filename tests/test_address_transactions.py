@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+from fastecdsa import keys
+
+from denaro.constants import CURVE
+from denaro.helpers import point_to_string
+
+RECEIVER = point_to_string(keys.get_public_key(keys.gen_private_key(CURVE), CURVE))
+
+
+async def get_pages(database, address: str, limit: int) -> list:
+    pages = []
+    cursor = None
+    while True:
+        txs, cursor = await database.get_address_transactions_page(address, limit, cursor)
+        pages.append([transaction.hash() for transaction in txs])
+        if cursor is None:
+            return pages
+
+
+async def clear_index(database):
+    async with database.pool.acquire() as connection:
+        await connection.execute('TRUNCATE address_transactions, address_balances')
+        await connection.execute("DELETE FROM node_state WHERE key IN ('address_transactions_indexed', 'address_balances_indexed', 'address_transactions_backfill')")
+    database.address_transactions_indexed = database.address_balances_indexed = False
+    database.balance_cache.clear()
+
+
+@pytest.fixture
+def chain(scratch_database, make_blocks):
+    # every block after the first one sends the previous reward to RECEIVER
+    async def create():
+        database = await scratch_database()
+        blocks = await make_blocks(31, receiver=RECEIVER)
+        await database.add_blocks(blocks)
+        # newest first
+        expected = [transaction.hash() for block in reversed(blocks) for transaction in block['transactions']]
+        return database, expected
+
+    return create
+
+
+def test_pages_follow_each_other(chain):
+    async def run():
+        database, expected = await chain()
+        try:
+            pages = await get_pages(database, RECEIVER, 7)
+            assert [len(page) for page in pages] == [7, 7, 7, 7, 2]
+            assert sum(pages, []) == expected
+            # a last page which is full is followed by an empty one
+            assert (await get_pages(database, RECEIVER, 10))[-1] == []
+
+            # the same pages are read from the transactions table before the index is built
+            await clear_index(database)
+            assert await get_pages(database, RECEIVER, 7) == pages
+        finally:
+            await database.pool.close()
+
+    asyncio.run(run())
+
+
+def test_backfill_resumes_after_an_interruption(chain, database_snapshot):
+    async def run():
+        database, expected = await chain()
+        try:
+            indexed = await database_snapshot(database)
+            await clear_index(database)
+
+            get_records = database.get_address_transactions_records
+
+            async def failing_get_records(transaction, block_id):
+                if block_id >= 15:
+                    raise ConnectionError('interrupted')
+                return await get_records(transaction, block_id)
+
+            database.get_address_transactions_records = failing_get_records
+            with pytest.raises(ConnectionError):
+                await database.backfill_address_transactions(10)
+            # the batches done before the interruption are kept
+            assert await database.get_node_state('address_transactions_backfill') == '10'
+            assert not database.address_transactions_indexed
+
+            del database.get_address_transactions_records
+            await database.backfill_address_transactions(10)
+            assert await database_snapshot(database) == indexed
+            assert await database.get_node_state('address_balances_indexed') == '1'
+            assert sum(await get_pages(database, RECEIVER, 7), []) == expected
+        finally:
+            await database.pool.close()
+
+    asyncio.run(run())
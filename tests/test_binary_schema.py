@@ -0,0 +1,44 @@
+import asyncio
+
+import pytest
+
+from denaro.database import encode_hex
+
+
+@pytest.mark.parametrize('value, encoded', [
+    ('00ff' * 16, b'\x00\xff' * 16),
+    ('ABcd', b'\xab\xcd'),
+    (b'\x01\x02', b'\x01\x02'),
+    (bytearray(b'\x01\x02'), b'\x01\x02'),
+    (memoryview(b'\x01\x02'), b'\x01\x02'),
+    ('', b''),
+    # not hashes, they are sent as they are and match no row
+    ('xyz', b'xyz'),
+    ('abc', b'abc'),
+])
+def test_hex_is_encoded_to_bytes(value, encoded):
+    assert encode_hex(value) == encoded
+
+
+def test_migrated_database_reads_the_same(scratch_database, make_blocks, database_snapshot):
+    async def run():
+        database = await scratch_database()
+        try:
+            blocks = await make_blocks(30)
+            await database.add_blocks(blocks[:20])
+            before = await database_snapshot(database)
+            await database.migrate_binary_schema()
+            assert database.binary_schema
+            # hashes and transactions are still read as hex strings
+            assert await database_snapshot(database) == before
+
+            transaction = blocks[10]['transactions'][0]
+            assert (await database.get_transaction(transaction.hash(), False)).hex() == transaction.hex()
+            assert await database.get_transaction('not an hash', False) is None
+            await database.add_blocks(blocks[20:])
+            await database.remove_blocks(21)
+            assert await database_snapshot(database) == before
+        finally:
+            await database.pool.close()
+
+    asyncio.run(run())
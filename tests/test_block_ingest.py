@@ -0,0 +1,155 @@
+import asyncio
+from decimal import Decimal
+
+import asyncpg
+import pytest
+from fastecdsa import keys
+
+from denaro import Database, manager
+from denaro.constants import CURVE
+from denaro.helpers import point_to_string, sha256
+from denaro.manager import BlockIngest
+from denaro.transactions import CoinbaseTransaction, Transaction, TransactionInput, TransactionOutput
+
+PRIVATE_KEY = keys.gen_private_key(CURVE)
+PUBLIC_KEY = keys.get_public_key(PRIVATE_KEY, CURVE)
+ADDRESS = point_to_string(PUBLIC_KEY)
+DIFFICULTY = Decimal('6.0')
+
+
+def make_transaction(tx_hash: str, index: int = 0) -> Transaction:
+    transaction = Transaction([TransactionInput(tx_hash, index, public_key=PUBLIC_KEY)], [TransactionOutput(ADDRESS, units=1)])
+    transaction.sign([PRIVATE_KEY])
+    return transaction
+
+
+def make_block(block_id: int, transactions=()) -> dict:
+    block_hash = sha256(str(block_id).encode())
+    return {
+        'id': block_id,
+        'hash': block_hash,
+        'content': block_hash,
+        'address': ADDRESS,
+        'random': 0,
+        'difficulty': DIFFICULTY,
+        'reward': Decimal(100),
+        'timestamp': 1_700_000_000 + block_id * 180,
+        'fees': Decimal(0),
+        'transactions': list(transactions),
+        'coinbase_transaction': CoinbaseTransaction(block_hash, ADDRESS, Decimal(100))
+    }
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.added = []
+
+    async def add_blocks(self, blocks):
+        self.added.append([block['id'] for block in blocks])
+
+
+@pytest.fixture
+def database(monkeypatch):
+    database = FakeDatabase()
+    monkeypatch.setattr(Database, 'instance', database)
+
+    async def calculate_difficulty():
+        return DIFFICULTY, {'id': -1}
+
+    monkeypatch.setattr(manager, 'calculate_difficulty', calculate_difficulty)
+    return database
+
+
+def test_depends_on_buffered_transaction():
+    ingest = BlockIngest()
+    buffered = make_transaction(sha256(b'spent'))
+    block = make_block(1, [buffered])
+    ingest.add(block)
+    assert ingest.depends_on([make_transaction(buffered.hash())])
+    assert ingest.depends_on([make_transaction(block['coinbase_transaction'].hash())])
+    assert not ingest.depends_on([make_transaction(sha256(b'other'))])
+
+
+def test_depends_on_buffered_spent_output():
+    ingest = BlockIngest()
+    ingest.add(make_block(1, [make_transaction(sha256(b'spent'), 1)]))
+    assert ingest.depends_on([make_transaction(sha256(b'spent'), 1)])
+    assert not ingest.depends_on([make_transaction(sha256(b'spent'), 2)])
+
+
+def test_depends_on_ignores_coinbase():
+    ingest = BlockIngest()
+    ingest.add(make_block(1))
+    assert not ingest.depends_on([CoinbaseTransaction(sha256(b'block'), ADDRESS, Decimal(1))])
+
+
+def test_get_difficulty_uses_buffered_tip(database):
+    ingest = BlockIngest()
+    difficulty, last_block = asyncio.run(ingest.get_difficulty([]))
+    assert (difficulty, last_block['id']) == (DIFFICULTY, -1)
+    block = make_block(1)
+    ingest.add(block)
+    difficulty, last_block = asyncio.run(ingest.get_difficulty([]))
+    assert difficulty == DIFFICULTY
+    assert last_block == manager.get_block_record(block)
+    assert database.added == []
+
+
+def test_get_difficulty_flushes_dependencies(database):
+    ingest = BlockIngest()
+    buffered = make_transaction(sha256(b'spent'))
+    ingest.add(make_block(1, [buffered]))
+    ingest.add(make_block(2))
+    asyncio.run(ingest.get_difficulty([make_transaction(buffered.hash())]))
+    assert database.added == [[1, 2]]
+    assert not ingest.blocks and not ingest.tx_hashes and not ingest.spent_outputs
+
+
+def test_get_difficulty_flushes_full_buffer_and_retarget(database):
+    ingest = BlockIngest(max_blocks=3)
+    for block_id in range(1, 4):
+        ingest.add(make_block(block_id))
+    asyncio.run(ingest.get_difficulty([]))
+    assert database.added == [[1, 2, 3]]
+
+    ingest = BlockIngest()
+    ingest.add(make_block(int(manager.BLOCKS_COUNT)))
+    asyncio.run(ingest.get_difficulty([]))
+    assert database.added[-1] == [int(manager.BLOCKS_COUNT)]
+
+
+def test_bulk_ingest_matches_single_blocks(scratch_database, make_blocks, database_snapshot):
+    async def run():
+        database = await scratch_database()
+        try:
+            blocks = await make_blocks(30)
+            for block in blocks:
+                await database.add_blocks([block])
+            single = await database_snapshot(database)
+            await database.delete_blocks(0)
+            await database.add_blocks(blocks)
+            assert await database_snapshot(database) == single
+        finally:
+            await database.pool.close()
+
+    asyncio.run(run())
+
+
+def test_existing_row_rolls_back_the_batch(scratch_database, make_blocks, database_snapshot):
+    async def run():
+        database = await scratch_database()
+        try:
+            blocks = await make_blocks(10)
+            await database.add_blocks(blocks[:5])
+            before = await database_snapshot(database)
+            cached = dict(database.utxo_cache.outputs)
+            with pytest.raises(asyncpg.UniqueViolationError):
+                await database.add_blocks(blocks[5:8] + [blocks[4]])
+            assert await database_snapshot(database) == before
+            assert database.utxo_cache.outputs == cached
+            await database.add_blocks(blocks[5:])
+            assert await database.get_next_block_id() == 11
+        finally:
+            await database.pool.close()
+
+    asyncio.run(run())
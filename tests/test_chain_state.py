@@ -0,0 +1,58 @@
+import asyncio
+from decimal import Decimal
+
+from denaro import manager
+from denaro.manager import ChainState
+
+
+async def assert_state_is_stored(database):
+    # the state kept in memory is the one a fresh load reads from the database
+    difficulty, last_block = await ChainState.get()
+    state = (difficulty, last_block, ChainState.window_start, await database.get_next_block_id())
+    ChainState.invalidate()
+    assert (*await ChainState.get(), ChainState.window_start, await database.get_next_block_id()) == state
+    return state
+
+
+def test_state_follows_the_stored_chain(scratch_database, make_blocks, monkeypatch):
+    # a retarget every 10 blocks
+    monkeypatch.setattr(manager, 'BLOCKS_COUNT', Decimal(10))
+
+    async def run():
+        database = await scratch_database()
+        try:
+            blocks = await make_blocks(35)
+            for block in blocks:
+                # faster than the target, so that every retarget changes the difficulty
+                block['timestamp'] = 1_700_000_000 + block['id'] * 120
+            assert await assert_state_is_stored(database) == (Decimal('6.0'), {}, None, 1)
+
+            difficulties = set()
+            for block_ids in ((1, 9), (10, 10), (11, 11), (12, 24), (25, 30), (31, 35)):
+                await ChainState.get()
+                await database.add_blocks(blocks[block_ids[0] - 1:block_ids[1]])
+                # adding blocks keeps the state in memory
+                assert ChainState.difficulty is not None
+                difficulty, last_block, window_start, next_id = await assert_state_is_stored(database)
+                assert last_block['id'] == block_ids[1] and next_id == block_ids[1] + 1
+                assert window_start['id'] == manager.get_window_start_id(block_ids[1])
+                difficulties.add(difficulty)
+            assert len(difficulties) > 1
+
+            # back to the last block of a retarget period, then into the previous one
+            await database.remove_blocks(21)
+            difficulty, last_block, window_start, next_id = await assert_state_is_stored(database)
+            assert (last_block['id'], window_start['id'], next_id) == (20, 11, 21)
+            await database.delete_blocks(15)
+            difficulty, last_block, window_start, next_id = await assert_state_is_stored(database)
+            assert (last_block['id'], window_start['id'], next_id) == (15, 11, 16)
+
+            await database.add_blocks(blocks[15:22])
+            _, last_block, window_start, _ = await assert_state_is_stored(database)
+            assert (last_block['id'], window_start['id']) == (22, 21)
+            await database.delete_blocks(0)
+            assert await assert_state_is_stored(database) == (Decimal('6.0'), {}, None, 1)
+        finally:
+            await database.pool.close()
+
+    asyncio.run(run())
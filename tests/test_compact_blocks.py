@@ -0,0 +1,157 @@
+import asyncio
+import json
+from decimal import Decimal
+
+import httpx
+import pytest
+from fastecdsa import keys
+
+from denaro import mempool as mempool_module
+from denaro.constants import CURVE
+from denaro.helpers import point_to_string, sha256
+from denaro.manager import block_to_bytes, get_transactions_merkle_tree
+from denaro.mempool import Mempool, get_short_id
+from denaro.node import main
+from denaro.node.gossip import Gossip, GossipPeer
+from denaro.node.seen_filter import SeenFilter
+from denaro.transactions import Transaction, TransactionInput, TransactionOutput
+
+PRIVATE_KEY = keys.gen_private_key(CURVE)
+PUBLIC_KEY = keys.get_public_key(PRIVATE_KEY, CURVE)
+ADDRESS = point_to_string(PUBLIC_KEY)
+TRANSACTIONS = []
+for seed in range(4):
+    TRANSACTIONS.append(Transaction([TransactionInput(sha256(str(seed).encode()), 0, public_key=PUBLIC_KEY)], [TransactionOutput(ADDRESS, units=seed + 1)]).sign([PRIVATE_KEY]))
+
+
+def make_block_content(txs_hex) -> str:
+    return block_to_bytes(sha256(b'previous'), {
+        'address': ADDRESS,
+        'merkle_tree': get_transactions_merkle_tree(txs_hex),
+        'timestamp': 1_700_000_000,
+        'difficulty': Decimal('6.0'),
+        'random': 0
+    }).hex()
+
+
+def make_compact(transactions) -> dict:
+    block_content = make_block_content([transaction.hex() for transaction in transactions])
+    salt = bytes.fromhex(sha256(block_content))[:8]
+    return {'block_content': block_content, 'block_no': 2, 'salt': salt.hex(), 'short_ids': [get_short_id(salt, transaction.hash()) for transaction in transactions]}
+
+
+class FakeDatabase:
+    def __init__(self, transactions=()):
+        self.mempool = Mempool()
+        for transaction in transactions:
+            self.mempool.add(transaction, transaction.hex(), [ADDRESS], Decimal(1))
+
+
+@pytest.fixture
+def node(monkeypatch):
+    received = []
+
+    async def receive_block(request, background_tasks, block_content, txs, block_no=None):
+        received.append(txs)
+        return {'ok': True}
+
+    monkeypatch.setattr(main, 'receive_block', receive_block)
+    monkeypatch.setattr(main, 'is_syncing', False)
+    monkeypatch.setattr(Gossip, 'seen_blocks', SeenFilter(100, 10, 60))
+
+    def with_mempool(transactions):
+        database = FakeDatabase(transactions)
+        monkeypatch.setattr(main, 'db', database)
+        return database
+
+    with_mempool.received = received
+    return with_mempool
+
+
+def push(body: dict) -> dict:
+    return asyncio.run(main.push_compact_block(None, None, body))
+
+
+def test_short_ids_resolve_from_the_mempool(node):
+    node(TRANSACTIONS)
+    assert push(make_compact(TRANSACTIONS[2:0:-1])) == {'ok': True}
+    assert node.received == [[transaction.hex() for transaction in TRANSACTIONS[2:0:-1]]]
+
+
+def test_unknown_short_ids_are_asked_for(node):
+    node(TRANSACTIONS[:2])
+    compact = make_compact(TRANSACTIONS[:3])
+    res = push(compact)
+    assert res['missing'] == [2] and not node.received
+    assert push(dict(compact, txs={'2': TRANSACTIONS[2].hex()})) == {'ok': True}
+    assert node.received == [[transaction.hex() for transaction in TRANSACTIONS[:3]]]
+
+
+def colliding(block_transaction: Transaction, decoy: Transaction):
+    # decoy gets the short id of block_transaction, whatever the salt
+    def get_colliding_short_id(salt: bytes, tx_hash: str) -> str:
+        return get_short_id(salt, block_transaction.hash() if tx_hash == decoy.hash() else tx_hash)
+    return get_colliding_short_id
+
+
+def test_colliding_short_ids_are_asked_for(node, monkeypatch):
+    monkeypatch.setattr(mempool_module, 'get_short_id', colliding(TRANSACTIONS[0], TRANSACTIONS[3]))
+    node([TRANSACTIONS[0], TRANSACTIONS[1], TRANSACTIONS[3]])
+    assert push(make_compact(TRANSACTIONS[:2]))['missing'] == [0]
+
+
+def test_wrong_match_falls_back_to_every_transaction(node, monkeypatch):
+    monkeypatch.setattr(mempool_module, 'get_short_id', colliding(TRANSACTIONS[0], TRANSACTIONS[3]))
+    node([TRANSACTIONS[1], TRANSACTIONS[3]])
+    compact = make_compact(TRANSACTIONS[:3])
+    # the decoy matches the first short id, the merkle tree tells it apart
+    assert push(dict(compact, txs={'2': TRANSACTIONS[2].hex()}))['missing'] == [0, 1]
+    assert not node.received
+
+
+def test_seen_block_does_not_hash_the_mempool(node):
+    database = node(TRANSACTIONS)
+    compact = make_compact(TRANSACTIONS)
+    Gossip.seen_blocks.add(sha256(compact['block_content']))
+    assert push(compact) == {'ok': False, 'error': 'Block just added'}
+    assert database.mempool.short_ids_salt is None
+
+
+@pytest.fixture
+def peer():
+    requests = []
+    routes = {}
+
+    def handler(request: httpx.Request):
+        body = json.loads(request.content)
+        requests.append((request.url.path, body))
+        return routes[request.url.path](body)
+
+    peer = GossipPeer('http://peer')
+    peer.client = httpx.AsyncClient(base_url=peer.url, transport=httpx.MockTransport(handler))
+    peer.routes = routes
+    peer.requests = requests
+    return peer
+
+
+def broadcast(peer: GossipPeer, transactions) -> dict:
+    txs = [transaction.hex() for transaction in transactions]
+    compact = make_compact(transactions)
+    legacy = {'block_content': compact['block_content'], 'block_no': 2, 'txs': txs}
+    return asyncio.run(peer.push_block(compact, legacy, txs, ''))
+
+
+def test_missing_transactions_are_sent_in_a_second_round(peer):
+    peer.routes['/push_compact_block'] = lambda body: httpx.Response(200, json={'ok': True} if 'txs' in body else {'ok': False, 'missing': [1]})
+    assert broadcast(peer, TRANSACTIONS[:2]) == {'ok': True}
+    assert [path for path, _ in peer.requests] == ['/push_compact_block'] * 2
+    assert peer.requests[1][1]['txs'] == {'1': TRANSACTIONS[1].hex()}
+
+
+def test_nodes_without_compact_blocks_get_the_full_block(peer):
+    peer.routes['/push_compact_block'] = lambda body: httpx.Response(404)
+    peer.routes['/push_block'] = lambda body: httpx.Response(200, json={'ok': True})
+    assert broadcast(peer, TRANSACTIONS[:2]) == {'ok': True}
+    assert broadcast(peer, TRANSACTIONS[:2]) == {'ok': True}
+    assert [path for path, _ in peer.requests] == ['/push_compact_block', '/push_block', '/push_block']
+    assert peer.requests[1][1]['txs'] == [transaction.hex() for transaction in TRANSACTIONS[:2]]
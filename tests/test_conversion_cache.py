@@ -0,0 +1,71 @@
+import pytest
+from fastecdsa import keys
+
+from denaro import helpers
+from denaro.constants import CURVE
+from denaro.helpers import AddressFormat, ConversionCache, point_to_string, string_to_bytes, string_to_point
+
+
+def test_get_computes_once():
+    cache = ConversionCache(2)
+    calls = []
+    assert cache.get('a', lambda: calls.append('a') or 1) == 1
+    assert cache.get('a', lambda: calls.append('a') or 2) == 1
+    assert calls == ['a']
+    assert cache.stats() == {'size': 1, 'max_size': 2, 'hits': 1, 'misses': 1, 'hit_rate': 0.5}
+
+
+def test_least_recently_used_is_evicted():
+    cache = ConversionCache(2)
+    cache.get('a', lambda: 1)
+    cache.get('b', lambda: 2)
+    cache.get('a', lambda: 1)
+    cache.get('c', lambda: 3)
+    assert list(cache.values) == ['a', 'c']
+    assert cache.get('b', lambda: 4) == 4
+
+
+def test_zero_size_does_not_store():
+    cache = ConversionCache(0)
+    assert cache.get('a', lambda: 1) == 1
+    assert cache.get('a', lambda: 2) == 2
+    assert len(cache) == 0
+    assert cache.stats()['misses'] == 2
+
+
+def test_resize_and_clear():
+    cache = ConversionCache(3)
+    for key in 'abc':
+        cache.get(key, lambda: key)
+    cache.resize(1)
+    assert list(cache.values) == ['c']
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.stats()['hit_rate'] == 0
+
+
+@pytest.fixture
+def caches(monkeypatch):
+    caches = {name: ConversionCache(10) for name in helpers.conversion_caches}
+    monkeypatch.setattr(helpers, 'conversion_caches', caches)
+    return caches
+
+
+@pytest.mark.parametrize('address_format', [AddressFormat.COMPRESSED, AddressFormat.FULL_HEX])
+def test_cached_conversions_match_uncached(caches, address_format):
+    point = keys.get_public_key(keys.gen_private_key(CURVE), CURVE)
+    address = helpers._point_to_string(point, address_format)
+    for _ in range(2):
+        assert point_to_string(point, address_format) == address
+        assert string_to_point(address) == point
+        assert string_to_bytes(address) == helpers._string_to_bytes(address)
+    assert all(cache.hits >= 1 for name, cache in caches.items() if name != 'bytes_to_point')
+
+
+def test_set_conversion_cache_size(caches):
+    for i in range(5):
+        point_to_string(keys.get_public_key(i + 1, CURVE))
+    helpers.set_conversion_cache_size(2)
+    stats = helpers.get_conversion_cache_stats()
+    assert stats['point_to_string']['size'] == 2
+    assert all(cache_stats['max_size'] == 2 for cache_stats in stats.values())
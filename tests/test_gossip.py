@@ -0,0 +1,188 @@
+import asyncio
+import json
+from collections import OrderedDict
+
+import httpx
+import pytest
+
+from denaro.helpers import sha256
+from denaro.node import gossip, main
+from denaro.node.gossip import Gossip, GossipPeer
+from denaro.node.nodes_manager import NodesManager
+from denaro.node.seen_filter import SeenFilter
+
+TXS = {sha256(tx_hex): tx_hex for tx_hex in ('aa' * 10, 'bb' * 10, 'cc' * 10, 'dd' * 10)}
+
+
+def make_peer(url: str, requests: list, routes: dict) -> GossipPeer:
+    def handler(request: httpx.Request):
+        body = json.loads(request.content)
+        requests.append((url, request.url.path, body))
+        return routes[request.url.path](body)
+
+    peer = GossipPeer(url)
+    peer.client = httpx.AsyncClient(base_url=peer.url, transport=httpx.MockTransport(handler))
+    return peer
+
+
+@pytest.fixture
+def peers(monkeypatch):
+    # peers answering through routes, every request they get is in requests
+    requests = []
+    routes = {
+        '/announce_txs': lambda body: httpx.Response(200, json={'ok': True, 'result': body['hashes']}),
+        '/push_txs': lambda body: httpx.Response(200, json={'ok': True}),
+        '/push_tx': lambda body: httpx.Response(200, json={'ok': True})
+    }
+    monkeypatch.setattr(Gossip, 'peers', {})
+    monkeypatch.setattr(Gossip, 'queue', OrderedDict())
+    monkeypatch.setattr(Gossip, 'self_url', 'http://self')
+    monkeypatch.setattr(Gossip, 'seen', SeenFilter(0, 100, 60))
+    monkeypatch.setattr(NodesManager, 'get_propagate_nodes', staticmethod(lambda: ['http://a', 'http://b']))
+
+    def get_peer(url: str) -> GossipPeer:
+        if url not in Gossip.peers:
+            Gossip.peers[url] = make_peer(url, requests, routes)
+        return Gossip.peers[url]
+
+    get_peer.requests = requests
+    get_peer.routes = routes
+    return get_peer
+
+
+def pushed(requests: list) -> list:
+    return [body['txs'] for _, path, body in requests if path == '/push_txs']
+
+
+def test_transactions_are_split_in_batches(peers, monkeypatch):
+    monkeypatch.setattr(gossip, 'GOSSIP_BATCH_SIZE', 45)
+    asyncio.run(peers('http://a').push_transactions(TXS, ''))
+    assert pushed(peers.requests) == [list(TXS.values())[:2], list(TXS.values())[2:]]
+
+
+def test_nodes_without_push_txs_get_one_transaction_at_a_time(peers):
+    peers.routes['/push_txs'] = lambda body: httpx.Response(404)
+    peer = peers('http://a')
+    asyncio.run(peer.push_transactions(TXS, ''))
+    asyncio.run(peer.push_transactions(TXS, ''))
+    assert not peer.supports_batch
+    assert [path for _, path, _ in peers.requests].count('/push_txs') == 1
+    assert [body['tx_hex'] for _, path, body in peers.requests if path == '/push_tx'] == list(TXS.values()) * 2
+    # a missing endpoint is not a failure
+    assert peer.failures == 0 and peer.is_available()
+
+
+def test_failing_peers_are_backed_off(peers, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(gossip, 'monotonic', lambda: now[0])
+    peers.routes['/announce_txs'] = peers.routes['/push_txs'] = lambda body: httpx.Response(500)
+    peer = peers('http://a')
+    delays = []
+    for _ in range(10):
+        with pytest.raises(httpx.HTTPStatusError):
+            asyncio.run(peer.push_transactions(TXS, ''))
+        assert not peer.is_available()
+        delays.append(peer.backoff_until - now[0])
+        now[0] = peer.backoff_until
+        assert peer.is_available()
+    assert gossip.GOSSIP_BACKOFF_MIN <= delays[0] <= gossip.GOSSIP_BACKOFF_MIN * 1.5
+    assert all(delays[i] < delays[i + 1] for i in range(3))
+    assert all(gossip.GOSSIP_BACKOFF_MAX <= delay <= gossip.GOSSIP_BACKOFF_MAX * 1.5 for delay in delays[-2:])
+
+    # backed off peers are not relayed to
+    peer.failed()
+    assert Gossip.get_targets(nodes=['http://a', 'http://b']) == [peers('http://b')]
+    # and an answer ends the back-off
+    peers.routes['/announce_txs'] = lambda body: httpx.Response(200, json={'ok': True, 'result': body['hashes']})
+    peers.routes['/push_txs'] = lambda body: httpx.Response(200, json={'ok': True})
+    now[0] = peer.backoff_until
+    asyncio.run(peer.push_transactions(TXS, ''))
+    assert peer.failures == 0
+
+
+def test_transactions_are_not_sent_back(peers):
+    for url in ('http://a', 'http://b'):
+        peers(url)
+    Gossip.add_transactions(list(TXS.values())[:2], 'http://a/')
+    Gossip.add_transactions(list(TXS.values())[2:])
+    asyncio.run(Gossip.send_transactions(Gossip.queue))
+    sent = {url: body['txs'] for url, path, body in peers.requests if path == '/push_txs'}
+    assert sent == {'http://a': list(TXS.values())[2:], 'http://b': list(TXS.values())}
+
+
+def test_targets_skip_this_node(peers):
+    assert Gossip.get_targets(nodes=['http://self/', 'http://a', 'http://a/']) == [peers('http://a')]
+
+
+class Stop(BaseException):
+    pass
+
+
+def test_transactions_added_meanwhile_go_in_the_same_batch(peers, monkeypatch):
+    batches = []
+
+    async def sleep(seconds):
+        # added while the relay waits for the batch delay
+        Gossip.add_transactions(list(TXS.values())[2:])
+
+    async def send_transactions(queue):
+        batches.append(list(queue))
+
+    async def close_idle_peers():
+        raise Stop()
+
+    monkeypatch.setattr(gossip, 'sleep', sleep)
+    monkeypatch.setattr(Gossip, 'event', None)
+    monkeypatch.setattr(Gossip, 'send_transactions', staticmethod(send_transactions))
+    monkeypatch.setattr(Gossip, 'close_idle_peers', staticmethod(close_idle_peers))
+
+    async def run():
+        Gossip.add_transactions(list(TXS.values())[:2])
+        await Gossip.run()
+
+    with pytest.raises(Stop):
+        asyncio.run(run())
+    assert batches == [list(TXS)]
+    assert not Gossip.queue
+
+
+def test_only_the_missing_transactions_are_pushed(peers, monkeypatch):
+    monkeypatch.setattr(gossip, 'GOSSIP_ANNOUNCE_SIZE', 3)
+    hashes = list(TXS)
+    peers.routes['/announce_txs'] = lambda body: httpx.Response(200, json={'ok': True, 'result': [tx_hash for tx_hash in body['hashes'] if tx_hash != hashes[1]]})
+    asyncio.run(peers('http://a').push_transactions(TXS, ''))
+    # the hashes are announced in chunks
+    assert [body['hashes'] for _, path, body in peers.requests if path == '/announce_txs'] == [hashes[:3], hashes[3:]]
+    assert pushed(peers.requests) == [[TXS[hashes[0]], TXS[hashes[2]], TXS[hashes[3]]]]
+
+
+def test_nothing_is_pushed_when_the_peer_knows_everything(peers):
+    peers.routes['/announce_txs'] = lambda body: httpx.Response(200, json={'ok': True, 'result': []})
+    asyncio.run(peers('http://a').push_transactions(TXS, ''))
+    assert [path for _, path, _ in peers.requests] == ['/announce_txs']
+
+
+def test_nodes_without_announce_txs_get_every_transaction(peers):
+    peers.routes['/announce_txs'] = lambda body: httpx.Response(405)
+    peer = peers('http://a')
+    asyncio.run(peer.push_transactions(TXS, ''))
+    assert not peer.supports_batch and peer.failures == 0
+    assert [body['tx_hex'] for _, path, body in peers.requests if path == '/push_tx'] == list(TXS.values())
+
+
+def test_announced_hashes_are_filtered(peers, monkeypatch):
+    hashes = list(TXS)
+    looked_up = []
+
+    class FakeDatabase:
+        @staticmethod
+        async def get_known_transactions_hashes(tx_hashes):
+            looked_up.append(tx_hashes)
+            return [hashes[1]]
+
+    monkeypatch.setattr(main, 'db', FakeDatabase)
+    Gossip.seen.add(hashes[0])
+    res = asyncio.run(main.announce_txs({'hashes': hashes + hashes[2:3]}))
+    assert res == {'ok': True, 'result': hashes[2:]}
+    # the recently seen hashes are not looked up
+    assert looked_up == [hashes[1:]]
@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+
+from denaro.node import main
+
+
+class Stop(BaseException):
+    pass
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    # the sleeps of the loop, the loop is stopped after a few of them
+    sleeps = []
+
+    async def sleep(seconds):
+        sleeps.append(seconds)
+        if len(sleeps) > 4:
+            raise Stop()
+
+    monkeypatch.setattr(main, 'sleep', sleep)
+    return sleeps
+
+
+def run(job, interval: int, delay: int = None):
+    with pytest.raises(Stop):
+        asyncio.run(main.run_periodically(job, interval, delay))
+
+
+def test_job_runs_after_the_delay_and_then_every_interval(sleeps):
+    runs = []
+
+    async def job():
+        runs.append(len(sleeps))
+
+    run(job, 100, 5)
+    assert sleeps[0] == 5
+    assert all(100 <= seconds <= 100 * (1 + main.MAINTENANCE_JITTER) for seconds in sleeps[1:])
+    # the job runs once between two sleeps
+    assert runs == [1, 2, 3, 4]
+
+
+def test_first_run_is_spread_without_a_delay(sleeps):
+    async def job():
+        pass
+
+    run(job, 100)
+    assert 0 <= sleeps[0] <= 100 * main.MAINTENANCE_JITTER
+
+
+def test_failing_job_is_run_again(sleeps):
+    runs = []
+
+    async def job():
+        runs.append(len(sleeps))
+        raise ValueError('peer is down')
+
+    run(job, 100, 0)
+    assert runs == [1, 2, 3, 4]
@@ -0,0 +1,155 @@
+from decimal import Decimal
+
+import pytest
+from fastecdsa import keys
+
+from denaro import mempool as mempool_module
+from denaro.constants import CURVE
+from denaro.helpers import AddressFormat, point_to_string, sha256
+from denaro.mempool import Mempool, get_short_id
+from denaro.transactions import Transaction, TransactionInput, TransactionOutput
+
+PRIVATE_KEY = keys.gen_private_key(CURVE)
+PUBLIC_KEY = keys.get_public_key(PRIVATE_KEY, CURVE)
+ADDRESS = point_to_string(PUBLIC_KEY)
+RECEIVER = point_to_string(keys.get_public_key(keys.gen_private_key(CURVE), CURVE))
+
+
+def make_transaction(spent: list, outputs: int = 1, receiver: str = RECEIVER) -> Transaction:
+    inputs = [TransactionInput(sha256(str(tx).encode()), index, public_key=PUBLIC_KEY) for tx, index in spent]
+    transaction = Transaction(inputs, [TransactionOutput(receiver, units=i + 1) for i in range(outputs)])
+    return transaction.sign([PRIVATE_KEY])
+
+
+def add(mempool: Mempool, transaction: Transaction, fees: str = '1') -> bool:
+    return mempool.add(transaction, transaction.hex(), [ADDRESS], Decimal(fees))
+
+
+def spent(tx: int, index: int = 0):
+    return sha256(str(tx).encode()), index
+
+
+@pytest.fixture
+def mempool():
+    return Mempool()
+
+
+def test_add_indexes_spent_outputs_and_addresses(mempool):
+    transaction = make_transaction([(1, 0), (1, 1)])
+    assert add(mempool, transaction)
+    tx_hash = transaction.hash()
+    assert tx_hash in mempool and len(mempool) == 1
+    assert mempool.get_conflicts([spent(1, 1), spent(2)]) == [tx_hash]
+    assert mempool.get_spent_outputs([spent(1, 0), spent(1, 2)]) == [spent(1, 0)]
+    assert mempool.get_inputs([tx_hash, sha256(b'unknown')]) == [spent(1, 0), spent(1, 1)]
+    assert [entry.tx_hash for entry in mempool.get_address_transactions(RECEIVER)] == [tx_hash]
+    assert mempool.get(tx_hash).inputs_addresses == {ADDRESS}
+    assert mempool.size == len(transaction.hex())
+
+
+def test_address_formats_share_an_entry(mempool):
+    transaction = make_transaction([(1, 0)])
+    add(mempool, transaction)
+    full_address = point_to_string(PUBLIC_KEY, AddressFormat.FULL_HEX)
+    assert [entry.tx_hash for entry in mempool.get_address_transactions(full_address)] == [transaction.hash()]
+
+
+def test_duplicates_and_conflicts_are_rejected(mempool):
+    transaction = make_transaction([(1, 0)])
+    assert add(mempool, transaction)
+    version = mempool.version
+    assert not add(mempool, transaction)
+    assert not add(mempool, make_transaction([(2, 0), (1, 0)]))
+    assert len(mempool) == 1 and mempool.version == version
+    assert add(mempool, make_transaction([(2, 0)]))
+
+
+def test_remove_cleans_every_index(mempool):
+    first, second = make_transaction([(1, 0)]), make_transaction([(2, 0)], receiver=ADDRESS)
+    add(mempool, first)
+    add(mempool, second)
+    removed = mempool.remove([first.hash(), sha256(b'unknown')])
+    assert [entry.tx_hash for entry in removed] == [first.hash()]
+    assert first.hash() not in mempool
+    assert mempool.get_conflicts([spent(1)]) == []
+    assert mempool.get_address_transactions(RECEIVER) == []
+    assert RECEIVER not in mempool.addresses
+    assert [entry.tx_hash for entry in mempool.get_ordered()] == [second.hash()]
+    assert mempool.size == len(second.hex())
+    # the output can be spent again once its spender is gone
+    assert add(mempool, make_transaction([(1, 0)], outputs=2))
+
+
+def test_remove_nothing_keeps_version(mempool):
+    add(mempool, make_transaction([(1, 0)]))
+    version = mempool.version
+    assert mempool.remove([sha256(b'unknown')]) == []
+    assert mempool.version == version
+
+
+def test_clear(mempool):
+    add(mempool, make_transaction([(1, 0)]))
+    mempool.clear()
+    assert len(mempool) == 0 and mempool.size == 0
+    assert not mempool.spenders and not mempool.addresses and not mempool.fee_order
+
+
+def test_ordered_by_fee_rate(mempool):
+    transactions = [(make_transaction([(i, 0)], outputs=1 + i % 3), str(Decimal(i % 4) / 10)) for i in range(12)]
+    for transaction, fees in transactions:
+        add(mempool, transaction, fees)
+    # the order of the old ORDER BY fees / LENGTH(tx_hex) DESC, LENGTH(tx_hex), tx_hex
+    expected = sorted(transactions, key=lambda item: (-Decimal(item[1]) / len(item[0].hex()), len(item[0].hex()), item[0].hex()))
+    assert [entry.tx_hash for entry in mempool.get_ordered()] == [transaction.hash() for transaction, _ in expected]
+
+
+def test_ordered_stops_at_limit(mempool):
+    cheap, expensive, small = make_transaction([(1, 0)], outputs=3), make_transaction([(2, 0)], outputs=3), make_transaction([(3, 0)])
+    add(mempool, cheap, '0.1')
+    add(mempool, expensive, '10')
+    add(mempool, small, '0.01')
+    limit = len(expensive.hex()) + len(cheap.hex()) - 1
+    # the template stops at the first transaction which does not fit, even if a later one would
+    assert [entry.tx_hash for entry in mempool.get_ordered(limit)] == [expensive.hash()]
+    assert len(mempool.get_ordered(mempool.size)) == 3
+    assert mempool.get_ordered(0) == []
+
+
+def test_version_follows_changes(mempool):
+    versions = [mempool.version]
+    transaction = make_transaction([(1, 0)])
+    add(mempool, transaction)
+    versions.append(mempool.version)
+    mempool.remove([transaction.hash()])
+    versions.append(mempool.version)
+    mempool.clear()
+    versions.append(mempool.version)
+    assert versions == sorted(set(versions))
+
+
+def test_short_ids_follow_the_mempool(mempool):
+    transactions = [make_transaction([(i, 0)]) for i in range(3)]
+    add(mempool, transactions[0])
+    salt = bytes(8)
+    short_ids = mempool.get_short_ids(salt)
+    assert short_ids == {get_short_id(salt, transactions[0].hash()): [transactions[0].hash()]}
+    add(mempool, transactions[1])
+    add(mempool, transactions[2])
+    mempool.remove([transactions[0].hash()])
+    # kept up to date instead of hashed again
+    assert mempool.get_short_ids(salt) is short_ids
+    assert short_ids == {get_short_id(salt, transaction.hash()): [transaction.hash()] for transaction in transactions[1:]}
+    other = mempool.get_short_ids(bytes([1] * 8))
+    assert other == {get_short_id(bytes([1] * 8), transaction.hash()): [transaction.hash()] for transaction in transactions[1:]}
+    mempool.clear()
+    assert mempool.get_short_ids(bytes([1] * 8)) == {}
+
+
+def test_short_id_collisions_are_kept(mempool, monkeypatch):
+    monkeypatch.setattr(mempool_module, 'get_short_id', lambda salt, tx_hash: 'collision')
+    transactions = [make_transaction([(i, 0)]) for i in range(2)]
+    for transaction in transactions:
+        add(mempool, transaction)
+    assert mempool.get_short_ids(bytes(8)) == {'collision': [transaction.hash() for transaction in transactions]}
+    mempool.remove([transactions[0].hash()])
+    assert mempool.get_short_ids(bytes(8)) == {'collision': [transactions[1].hash()]}
@@ -0,0 +1,99 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from denaro.exceptions import RateLimitedException
+from denaro.node import nodes_manager
+from denaro.node.nodes_manager import NodeInterface, NodesManager
+
+BLOCKS = [{'block': {'id': i, 'hash': str(i) * 64}, 'transactions': ['ab' * i]} for i in range(1, 6)]
+
+
+async def stream(chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+def ndjson_chunks(blocks, chunk_size: int):
+    data = b''.join(json.dumps(block).encode() + b'\n' for block in blocks)
+    return stream([data[i:i + chunk_size] for i in range(0, len(data), chunk_size)])
+
+
+@pytest.fixture
+def transport(monkeypatch):
+    routes = {}
+
+    def handler(request: httpx.Request):
+        return routes[request.url.path](request)
+
+    monkeypatch.setattr(NodesManager, 'async_client', httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    return routes
+
+
+def download(offset: int = 1, limit: int = 5, interface: NodeInterface = None):
+    interface = interface or NodeInterface('http://node')
+    return asyncio.run(interface.download_blocks(offset, limit)), interface
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 10_000])
+def test_lines_are_split_across_chunks(transport, chunk_size):
+    transport['/get_blocks_stream'] = lambda request: httpx.Response(200, content=ndjson_chunks(BLOCKS, chunk_size))
+    blocks, _ = download()
+    assert blocks == BLOCKS
+
+
+def test_blank_lines_and_missing_final_newline(transport):
+    data = b'\n'.join(json.dumps(block).encode() for block in BLOCKS[:2]) + b'\n\n'
+    transport['/get_blocks_stream'] = lambda request: httpx.Response(200, content=data)
+    blocks, _ = download()
+    assert blocks == BLOCKS[:2]
+
+
+@pytest.mark.parametrize('chunks', [
+    [b'{"block": "' + b'a' * 60, b'a' * 60 + b'"}\n'],
+    # the end of the line never comes
+    [b'{"block": "' + b'a' * 60, b'a' * 60],
+])
+def test_line_size_is_bounded(transport, monkeypatch, chunks):
+    monkeypatch.setattr(nodes_manager, 'MAX_STREAM_LINE_SIZE', 100)
+    transport['/get_blocks_stream'] = lambda request: httpx.Response(200, content=stream(chunks))
+    with pytest.raises(Exception, match='too big'):
+        download()
+
+
+@pytest.mark.parametrize('status_code', [404, 405])
+def test_falls_back_to_get_blocks(transport, status_code):
+    transport['/get_blocks_stream'] = lambda request: httpx.Response(status_code)
+    transport['/get_blocks'] = lambda request: httpx.Response(200, json={'ok': True, 'result': BLOCKS[int(request.url.params['offset']) - 1:]})
+    blocks, interface = download()
+    assert blocks == BLOCKS
+    assert not interface.supports_stream
+    # the streaming endpoint is not asked again
+    transport['/get_blocks_stream'] = None
+    assert download(3, interface=interface)[0] == BLOCKS[2:]
+
+
+def test_other_errors_are_raised(transport):
+    transport['/get_blocks_stream'] = lambda request: httpx.Response(500)
+    with pytest.raises(httpx.HTTPStatusError):
+        download()
+
+
+@pytest.mark.parametrize('path, call', [
+    ('/get_blocks_stream', lambda interface: interface.download_blocks(1, 5)),
+    ('/get_block_headers', lambda interface: interface.get_block_headers(1, 5)),
+])
+def test_rate_limits_are_raised_with_the_delay(transport, path, call):
+    transport[path] = lambda request: httpx.Response(429, headers={'Retry-After': '7'}, json={'error': 'Rate limit exceeded: 10 per 1 minute'})
+    with pytest.raises(RateLimitedException) as e:
+        asyncio.run(call(NodeInterface('http://node')))
+    assert e.value.retry_after == 7
+
+
+def test_rate_limit_without_delay(transport):
+    transport['/get_blocks'] = lambda request: httpx.Response(429, json={'error': 'Rate limit exceeded: 10 per 1 minute'})
+    with pytest.raises(RateLimitedException) as e:
+        asyncio.run(NodeInterface('http://node').get_blocks(1, 5))
+    assert e.value.retry_after == nodes_manager.RATE_LIMIT_RETRY_AFTER
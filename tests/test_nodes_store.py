@@ -0,0 +1,70 @@
+import asyncio
+import json
+
+import pytest
+
+from denaro.helpers import timestamp
+from denaro.node import nodes_manager
+from denaro.node.nodes_manager import DEFAULT_NODE, NodesManager, NodesStore
+
+
+@pytest.fixture
+def store(monkeypatch, tmp_path):
+    monkeypatch.setattr(nodes_manager, 'db_path', str(tmp_path / 'nodes.db'))
+    monkeypatch.setattr(nodes_manager, 'path', str(tmp_path / 'nodes.json'))
+    monkeypatch.setattr(NodesManager, 'peers', None)
+    monkeypatch.setattr(NodesManager, 'dirty', set())
+    return tmp_path
+
+
+def restart():
+    # what a new process reads back
+    NodesManager.peers = None
+    NodesManager.init()
+    return {url: (peer.last_message, peer.score) for url, peer in NodesManager.peers.items()}
+
+
+def test_peers_are_written_by_flush(store):
+    assert NodesManager.get_nodes() == [DEFAULT_NODE]
+    NodesManager.peers[DEFAULT_NODE].last_message -= 10
+    NodesManager.add_node('http://a/')
+    NodesManager.add_node('http://b')
+    NodesManager.update_last_message('http://b')
+    NodesManager.update_score('http://b', 2.5)
+    # nothing is written before the flush
+    assert NodesStore.load() == []
+    asyncio.run(NodesManager.flush())
+    assert not NodesManager.dirty
+    peers = restart()
+    assert list(peers) == ['http://a', DEFAULT_NODE, 'http://b']
+    assert peers['http://a'] == (0, 0) and peers['http://b'][1] == 2.5
+    assert NodesManager.get_recent_nodes() == ['http://b', DEFAULT_NODE]
+
+
+def test_removed_peers_are_deleted(store):
+    NodesStore.write([('http://old', 1, 0), ('http://new', timestamp(), 0)], [])
+    NodesManager.init()
+    NodesManager.clear_old_nodes()
+    asyncio.run(NodesManager.flush())
+    assert list(restart()) == ['http://new']
+
+
+def test_failed_flush_keeps_the_changes(store, monkeypatch):
+    def write(rows, removed):
+        raise OSError('disk full')
+
+    NodesManager.add_node('http://a')
+    monkeypatch.setattr(NodesStore, 'write', staticmethod(write))
+    with pytest.raises(OSError):
+        asyncio.run(NodesManager.flush())
+    assert NodesManager.dirty == {DEFAULT_NODE, 'http://a'}
+
+
+def test_nodes_json_is_imported_once(store):
+    (store / 'nodes.json').write_text(json.dumps({
+        'nodes': ['http://a/', 'http://b', '/'],
+        'last_messages': {'http://a': 5, 'http://a/': 7, 'http://c': 3}
+    }))
+    assert sorted(NodesStore.load()) == [('http://a', 7, 0), ('http://b', 0, 0), ('http://c', 3, 0)]
+    (store / 'nodes.json').write_text(json.dumps({'nodes': ['http://d']}))
+    assert len(NodesStore.load()) == 3
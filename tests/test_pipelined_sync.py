@@ -0,0 +1,167 @@
+import asyncio
+from copy import deepcopy
+
+import pytest
+from fastecdsa import keys
+
+from denaro.constants import CURVE
+from denaro.node import main
+from denaro.node.nodes_manager import NodesManager
+from denaro.verification import SignatureVerifier
+
+
+class FakeInterface:
+    # url -> blocks served by the peer, as /get_blocks returns them
+    chains = {}
+    # names of the methods which fail
+    failing = set()
+
+    def __init__(self, url: str):
+        self.url = url.strip('/')
+        self.base_url = self.url
+
+    def get_range(self, offset: int, limit: int) -> list:
+        # the node changes the blocks it is given, every answer is a new copy
+        return deepcopy(FakeInterface.chains[self.url][offset - 1:offset - 1 + limit])
+
+    async def get_block(self, block_no: int, full_transactions: bool = False):
+        return self.get_range(block_no, 1)[0]
+
+    async def get_blocks(self, offset: int, limit: int):
+        return self.get_range(offset, limit)
+
+    async def download_blocks(self, offset: int, limit: int):
+        if 'download_blocks' in FakeInterface.failing:
+            raise Exception('peer is down')
+        return self.get_range(offset, limit)
+
+    async def get_block_headers(self, offset: int, limit: int):
+        return [
+            {key: block_info['block'][key] for key in ('id', 'hash', 'content', 'difficulty', 'timestamp')}
+            for block_info in self.get_range(offset, limit)
+        ]
+
+
+@pytest.fixture
+def node(monkeypatch, scratch_database):
+    monkeypatch.setattr(main, 'NodeInterface', FakeInterface)
+    monkeypatch.setattr(FakeInterface, 'chains', {})
+    monkeypatch.setattr(FakeInterface, 'failing', set())
+    # a few blocks per range, so that the stages overlap
+    monkeypatch.setattr(main, 'SYNC_BODIES_RANGE', 7)
+    for name in ('sync', 'update_score', 'update_last_message'):
+        monkeypatch.setattr(NodesManager, name, staticmethod(lambda *args: None))
+
+    async def create():
+        database = await scratch_database()
+        monkeypatch.setattr(main, 'db', database)
+        return database
+
+    return create
+
+
+async def sync(chain: list, pipelined: bool = True):
+    FakeInterface.chains['http://peer'] = chain
+    main.PIPELINED_SYNC = pipelined
+    try:
+        await main._sync_blockchain('http://peer')
+    finally:
+        main.PIPELINED_SYNC = True
+
+
+def test_pipelined_sync_matches_the_serial_one(node, mine_blocks, database_snapshot, monkeypatch):
+    verified = []
+
+    async def verify_transactions(transactions):
+        verified.append(len(transactions))
+        return await original_verify(transactions)
+
+    original_verify = SignatureVerifier.verify_transactions
+    monkeypatch.setattr(SignatureVerifier, 'verify_transactions', staticmethod(verify_transactions))
+
+    async def run():
+        chain = await mine_blocks(60)
+        database = await node()
+        try:
+            await sync(chain, pipelined=False)
+            serial = await database_snapshot(database)
+        finally:
+            await database.pool.close()
+        assert [row[0] for row in serial['blocks']] == list(range(1, 61))
+
+        verified.clear()
+        database = await node()
+        try:
+            await sync(chain)
+            assert await database_snapshot(database) == serial
+        finally:
+            await database.pool.close()
+
+    asyncio.run(run())
+    # each block spends an output of the previous one, still in flight when it is verified.
+    # the signatures are all checked ahead by the verify stage, none is left to the commit stage
+    assert sum(verified) == 59
+
+
+@pytest.fixture
+def forked(node, mine_blocks, database_snapshot):
+    # the local chain and a longer one from the peer, forked 10 blocks before the local tip
+    async def create(peer_blocks: list = None):
+        local = await mine_blocks(520)
+        database = await node()
+        await sync(local, pipelined=False)
+        assert await database.get_next_block_id() == 521
+        before = await database_snapshot(database)
+        peer = local[:510] + (peer_blocks or await mine_blocks(20, local[:510], block_time=170))
+        return database, before, peer
+
+    return create
+
+
+def test_download_failure_restores_the_local_chain(forked, database_snapshot):
+    async def run():
+        database, before, peer = await forked()
+        try:
+            FakeInterface.failing.add('download_blocks')
+            await sync(peer)
+            assert await database_snapshot(database) == before
+        finally:
+            await database.pool.close()
+
+    asyncio.run(run())
+
+
+def test_verify_failure_restores_the_local_chain(forked, database_snapshot, monkeypatch):
+    prepare_block = main.prepare_block
+
+    async def run():
+        database, before, peer = await forked()
+
+        async def failing_prepare_block(block_info, last_block):
+            if block_info['block']['hash'] == peer[527]['block']['hash']:
+                raise ValueError('corrupt block')
+            return await prepare_block(block_info, last_block)
+
+        try:
+            monkeypatch.setattr(main, 'prepare_block', failing_prepare_block)
+            await sync(peer)
+            assert await database_snapshot(database) == before
+        finally:
+            await database.pool.close()
+
+    asyncio.run(run())
+
+
+def test_commit_failure_restores_the_local_chain(forked, mine_blocks, database_snapshot):
+    async def run():
+        database, before, peer = await forked()
+        try:
+            # block 516 of the peer spends the previous reward with a wrong signature
+            peer = peer[:515] + await mine_blocks(1, peer[:515], block_time=170, signer=keys.gen_private_key(CURVE))
+            peer += await mine_blocks(10, peer, block_time=170)
+            await sync(peer)
+            assert await database_snapshot(database) == before
+        finally:
+            await database.pool.close()
+
+    asyncio.run(run())
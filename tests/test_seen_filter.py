@@ -0,0 +1,129 @@
+import pytest
+
+from denaro.helpers import sha256
+from denaro.node import seen_filter
+from denaro.node.seen_filter import NOT_SEEN, PROBABLY_SEEN, SEEN, BloomFilter, SeenFilter
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(seen_filter, 'monotonic', clock)
+    return clock
+
+
+def keys(count: int, prefix: str = ''):
+    return [sha256(f'{prefix}{i}'.encode()) for i in range(count)]
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(1000, 0.01)
+    added = keys(1000)
+    for key in added:
+        bloom.add(key)
+    assert all(key in bloom for key in added)
+    false_positives = sum(key in bloom for key in keys(10_000, 'other'))
+    assert false_positives / 10_000 < 0.03
+    assert 0.005 < bloom.get_error_rate() < 0.02
+
+
+def test_recent_keys_are_seen(clock):
+    seen = SeenFilter(100, 10, 60)
+    key = keys(1)[0]
+    assert seen.lookup(key) == NOT_SEEN
+    seen.add(key)
+    assert seen.lookup(key) == SEEN
+    assert key in seen
+
+
+def test_keys_out_of_the_lru_are_probably_seen(clock):
+    seen = SeenFilter(100, 10, 60)
+    added = keys(20)
+    for key in added:
+        seen.add(key)
+    assert seen.lookup(added[0]) == PROBABLY_SEEN
+    # a probable hit must never be reported as seen, the caller checks it
+    assert added[0] not in seen
+    assert seen.lookup(added[-1]) == SEEN
+    assert seen.stats()['probable_hits'] == 2
+
+
+def test_lru_expires_after_max_age(clock):
+    seen = SeenFilter(100, 10, 60)
+    key = keys(1)[0]
+    seen.add(key)
+    clock.now += 25
+    assert seen.lookup(key) == SEEN
+    clock.now += 40
+    assert seen.lookup(key) == PROBABLY_SEEN
+
+
+def test_generations_rotate_and_forget(clock):
+    seen = SeenFilter(100, 1, 60)
+    key = keys(1)[0]
+    seen.add(key)
+    clock.now += 31
+    seen.add(keys(1, 'new')[0])
+    assert seen.rotations == 1
+    assert seen.lookup(key) == PROBABLY_SEEN
+    clock.now += 31
+    assert seen.lookup(key) == NOT_SEEN
+    assert seen.rotations == 2
+
+
+def test_full_generation_rotates(clock):
+    seen = SeenFilter(50, 10, 60)
+    added = keys(120)
+    for key in added:
+        seen.add(key)
+    assert seen.rotations == 2
+    assert seen.lookup(added[0]) == NOT_SEEN
+    assert seen.lookup(added[60]) == PROBABLY_SEEN
+    assert len(seen) <= 100
+
+
+def test_readding_keeps_the_count(clock):
+    seen = SeenFilter(100, 10, 60)
+    key = keys(1)[0]
+    for _ in range(5):
+        seen.add(key)
+    assert len(seen) == 1 and len(seen.recent) == 1
+
+
+def test_false_positive_rate(clock):
+    seen = SeenFilter(2000, 10, 600, error_rate=0.01)
+    for key in keys(2000):
+        seen.add(key)
+    probable = sum(seen.lookup(key) != NOT_SEEN for key in keys(20_000, 'other'))
+    assert probable / 20_000 < 0.03
+    assert seen.stats()['false_positive_rate'] < 0.03
+
+
+def test_set_bits_are_counted():
+    bloom = BloomFilter(100, 0.01)
+    for key in keys(100):
+        bloom.add(key)
+    assert bloom.set_bits == bin(int.from_bytes(bloom.bits, 'little')).count('1')
+    bloom.add(keys(1)[0])
+    assert bloom.set_bits == bin(int.from_bytes(bloom.bits, 'little')).count('1')
+
+
+def test_exact_only_without_capacity(clock):
+    seen = SeenFilter(0, 10, 60)
+    added = keys(20)
+    for key in added:
+        seen.add(key)
+    assert seen.lookup(added[0]) == NOT_SEEN
+    assert seen.lookup(added[-1]) == SEEN
+    clock.now += 61
+    assert seen.lookup(added[-1]) == NOT_SEEN
+    assert len(seen) == 0
+    assert seen.stats()['false_positive_rate'] == 0
@@ -0,0 +1,97 @@
+import asyncio
+
+import pytest
+from fastecdsa import keys
+
+from denaro import Database
+from denaro import verification
+from denaro.constants import CURVE
+from denaro.helpers import point_to_string, sha256
+from denaro.transactions import Transaction, TransactionInput, TransactionOutput
+from denaro.verification import SignatureVerifier, verify_signatures
+
+
+def make_transaction(seed: int, inputs: int = 1) -> Transaction:
+    private_key = keys.gen_private_key(CURVE)
+    public_key = keys.get_public_key(private_key, CURVE)
+    transaction_inputs = [
+        TransactionInput(sha256(f'{seed}-{i}'.encode()), i, private_key=private_key, public_key=public_key)
+        for i in range(inputs)
+    ]
+    transaction = Transaction(transaction_inputs, [TransactionOutput(point_to_string(public_key), units=seed + 1)])
+    transaction.sign([private_key])
+    return transaction
+
+
+def tamper(transaction: Transaction) -> Transaction:
+    r, s = transaction.inputs[0].signed
+    transaction.inputs[0].signed = (r, s ^ 1)
+    return transaction
+
+
+def serial_results(transactions):
+    results = []
+    for transaction in transactions:
+        checks = asyncio.run(transaction.get_signature_checks())
+        results.append(checks is not None and all(verify_signatures(checks)))
+    return results
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(verification, 'BATCH_MIN_SIGNATURES', 2)
+    monkeypatch.setattr(SignatureVerifier, 'workers', 2)
+    monkeypatch.setattr(SignatureVerifier, 'executor', None)
+    yield
+    if SignatureVerifier.executor is not None:
+        SignatureVerifier.executor.shutdown()
+
+
+def test_verify_signatures_rejects_tampered():
+    transaction = make_transaction(0)
+    checks = asyncio.run(transaction.get_signature_checks())
+    assert verify_signatures(checks) == [True]
+    tamper(transaction)
+    checks = asyncio.run(transaction.get_signature_checks())
+    assert verify_signatures(checks) == [False]
+
+
+def test_shared_signature_is_checked_once():
+    transaction = make_transaction(0, inputs=3)
+    assert len(asyncio.run(transaction.get_signature_checks())) == 1
+
+
+@pytest.mark.parametrize('batched', [False, True])
+def test_verify_transactions_matches_serial(request, batched):
+    if batched:
+        request.getfixturevalue('pool')
+    transactions = [make_transaction(i, inputs=1 + i % 3) for i in range(12)]
+    for i in (1, 5, 10):
+        tamper(transactions[i])
+    expected = serial_results(transactions)
+    assert expected.count(False) == 3
+    assert asyncio.run(SignatureVerifier.verify_transactions(transactions)) == expected
+    if batched:
+        assert SignatureVerifier.executor is not None
+
+
+def test_duplicate_transactions_share_results(pool):
+    transaction = make_transaction(0)
+    invalid = tamper(make_transaction(1))
+    transactions = [transaction, invalid, transaction, invalid]
+    assert asyncio.run(SignatureVerifier.verify_transactions(transactions)) == [True, False, True, False]
+
+
+def test_unsigned_and_unknown_inputs_are_invalid(monkeypatch):
+    class UnknownTransactions:
+        async def get_transaction_info(self, tx_hash):
+            return None
+
+    monkeypatch.setattr(Database, 'instance', UnknownTransactions())
+    unsigned = make_transaction(0)
+    unsigned.inputs[0].signed = None
+    unknown = make_transaction(1)
+    unknown.inputs[0].public_key = None
+    valid = make_transaction(2)
+    assert asyncio.run(unknown.get_signature_checks()) is None
+    assert asyncio.run(SignatureVerifier.verify_transactions([unsigned, unknown, valid])) == [False, False, True]
@@ -0,0 +1,94 @@
+import asyncio
+
+import pytest
+
+from denaro.exceptions import RateLimitedException
+from denaro.helpers import sha256
+from denaro.node import main
+from denaro.node.nodes_manager import SyncPeer
+
+
+def make_headers(start: int, count: int):
+    return [{'id': block_id, 'hash': sha256(str(block_id).encode())} for block_id in range(start, start + count)]
+
+
+class FakeInterface:
+    def __init__(self, url: str, headers: list, rate_limits: int = 0, corrupt: bool = False):
+        self.url = url
+        self.headers = {header['id']: header for header in headers}
+        self.rate_limits = rate_limits
+        self.corrupt = corrupt
+        self.requests = []
+
+    async def download_blocks(self, offset: int, limit: int):
+        self.requests.append((offset, limit))
+        await asyncio.sleep(0)
+        if self.rate_limits:
+            self.rate_limits -= 1
+            raise RateLimitedException(0.01)
+        blocks = [{'block': dict(self.headers[block_id]), 'transactions': []} for block_id in range(offset, offset + limit) if block_id in self.headers]
+        if self.corrupt:
+            for block in blocks:
+                block['block']['hash'] = sha256(b'other')
+        return blocks
+
+    async def get_block_headers(self, offset: int, limit: int):
+        await asyncio.sleep(0)
+        if self.rate_limits:
+            self.rate_limits -= 1
+            raise RateLimitedException(0.01)
+        return [self.headers[block_id] for block_id in range(offset, offset + limit) if block_id in self.headers]
+
+
+def download(peers, headers):
+    queue = asyncio.Queue()
+    stats = {'download': [0, 0.0]}
+    asyncio.run(main._download_bodies(peers, headers, queue, stats))
+    blocks = []
+    while not queue.empty():
+        blocks.extend(queue.get_nowait())
+    return blocks
+
+
+def test_ranges_fit_the_rate_limit():
+    # 10 requests per minute per peer must cover a full headers window in a minute
+    assert main.SYNC_BODIES_RANGE * 10 >= main.SYNC_HEADERS_WINDOW
+
+
+def test_bodies_are_queued_in_order():
+    headers = make_headers(1, 2500)
+    peers = [SyncPeer(FakeInterface(f'node{i}', headers)) for i in range(3)]
+    blocks = download(peers, headers)
+    assert [block['block']['id'] for block in blocks] == list(range(1, 2501))
+    assert all(len(peer.node_interface.requests) >= 1 for peer in peers)
+
+
+def test_rate_limited_peers_are_waited_for():
+    headers = make_headers(1, 3000)
+    peers = [SyncPeer(FakeInterface(f'node{i}', headers, rate_limits=2)) for i in range(2)]
+    blocks = download(peers, headers)
+    assert [block['block']['id'] for block in blocks] == list(range(1, 3001))
+    assert all(peer.failures == 0 for peer in peers)
+
+
+def test_peers_serving_other_blocks_fail():
+    headers = make_headers(1, 2000)
+    bad, good = SyncPeer(FakeInterface('bad', headers, corrupt=True)), SyncPeer(FakeInterface('good', headers))
+    blocks = download([bad, good], headers)
+    assert [block['block']['id'] for block in blocks] == list(range(1, 2001))
+    assert bad.failures >= 1 and good.failures == 0
+
+
+def test_no_usable_peer_left():
+    headers = make_headers(1, 10)
+    peers = [SyncPeer(FakeInterface('bad', headers, corrupt=True))]
+    with pytest.raises(Exception, match='no peer left'):
+        download(peers, headers)
+
+
+def test_headers_wait_for_rate_limited_peers():
+    headers = make_headers(5, 20)
+    peers = [SyncPeer(FakeInterface(f'node{i}', headers, rate_limits=1)) for i in range(2)]
+    peer, downloaded = asyncio.run(main._download_headers(peers, 5))
+    assert downloaded == headers
+    assert all(peer.failures == 0 for peer in peers)
@@ -0,0 +1,115 @@
+import asyncio
+from collections import OrderedDict
+
+import pytest
+from fastecdsa import keys
+
+from denaro.constants import CURVE
+from denaro.helpers import point_to_string, sha256
+from denaro.node import main
+from denaro.node.gossip import Gossip
+from denaro.node.seen_filter import SeenFilter
+from denaro.transactions import Transaction, TransactionInput, TransactionOutput
+
+PRIVATE_KEY = keys.gen_private_key(CURVE)
+PUBLIC_KEY = keys.get_public_key(PRIVATE_KEY, CURVE)
+
+
+def make_transaction(seed: int) -> Transaction:
+    transaction = Transaction([TransactionInput(sha256(str(seed).encode()), 0, public_key=PUBLIC_KEY)], [TransactionOutput(point_to_string(PUBLIC_KEY), units=seed + 1)])
+    return transaction.sign([PRIVATE_KEY])
+
+
+class FakeDatabase:
+    def __init__(self, known=()):
+        self.known = set(known)
+        self.added = []
+
+    async def get_known_transactions_hashes(self, tx_hashes):
+        return [tx_hash for tx_hash in tx_hashes if tx_hash in self.known]
+
+    async def add_pending_transactions(self, transactions):
+        added = [transaction.hash() for transaction in transactions if transaction.hash() not in self.known]
+        self.known.update(added)
+        self.added.extend(added)
+        return added
+
+
+@pytest.fixture
+def node(monkeypatch):
+    database = FakeDatabase()
+
+    async def check_pending_transactions(transactions):
+        return [True] * len(transactions)
+
+    monkeypatch.setattr(main, 'db', database)
+    monkeypatch.setattr(main, 'check_pending_transactions', check_pending_transactions)
+    monkeypatch.setattr(Gossip, 'seen', SeenFilter(1000, 100, 60))
+    monkeypatch.setattr(Gossip, 'queue', OrderedDict())
+    monkeypatch.setattr(Gossip, 'event', None)
+    return database
+
+
+def relayed():
+    return [tx_hex for tx_hex, _ in Gossip.queue.values()]
+
+
+def admit(txs_hex):
+    return asyncio.run(main.TransactionAdmission.admit(txs_hex))
+
+
+def test_accepted_transactions_are_relayed(node):
+    database = node
+    transactions = [make_transaction(i) for i in range(3)]
+    results = admit([transaction.hex() for transaction in transactions])
+    assert all(result['ok'] for result in results)
+    assert database.added == [transaction.hash() for transaction in transactions]
+    assert relayed() == [transaction.hex() for transaction in transactions]
+
+
+def test_duplicates(node):
+    database = node
+    transaction, known, seen = make_transaction(0), make_transaction(1), make_transaction(2)
+    database.known.add(known.hash())
+    Gossip.seen.add(seen.hash())
+    results = admit([transaction.hex(), transaction.hex(), known.hex(), seen.hex()])
+    assert [result['ok'] for result in results] == [True, True, False, False]
+    assert results[2]['error'] == 'Transaction already present'
+    assert results[3]['error'] == 'Transaction just added'
+    assert database.added == [transaction.hash()]
+    # admitted again later, it is a duplicate
+    assert admit([transaction.hex()])[0]['error'] == 'Transaction just added'
+
+
+def test_renamed_hashes(node):
+    database = node
+    transaction, known = make_transaction(0), make_transaction(1)
+    database.known.add(known.hash())
+    # trailing bytes are ignored by the parser, the raw hash is not the transaction hash
+    renamed = transaction.hex() + '00'
+    results = admit([transaction.hex(), renamed, known.hex() + '00'])
+    assert [result['ok'] for result in results] == [True, False, False]
+    assert results[1]['error'] == 'Transaction just added'
+    assert results[2]['error'] == 'Transaction already present'
+    assert admit([transaction.hex() + '0000'])[0]['error'] == 'Transaction just added'
+    assert database.added == [transaction.hash()]
+    assert relayed() == [transaction.hex()]
+
+
+def test_renamed_first_is_relayed_canonical(node):
+    database = node
+    transaction = make_transaction(0)
+    assert admit([transaction.hex() + '00'])[0]['ok']
+    assert relayed() == [transaction.hex()]
+    assert Gossip.seen.lookup(transaction.hash()) == main.SEEN
+
+
+def test_malformed_entries_do_not_drop_the_batch(node):
+    database = node
+    first, second = make_transaction(0), make_transaction(1)
+    results = admit([first.hex(), 5, ['list'], None, 'zz', '0102', second.hex()])
+    assert [result['ok'] for result in results] == [True, False, False, False, False, False, True]
+    assert [result['error'] for result in results[1:5]] == ['Invalid transaction: TypeError'] * 3 + ['Invalid transaction: ValueError']
+    # hex which does not parse is rejected by the parse stage alone
+    assert results[5]['error'].startswith('Invalid transaction')
+    assert database.added == [first.hash(), second.hash()]
@@ -0,0 +1,113 @@
+import asyncio
+from decimal import Decimal
+
+import pytest
+from fastecdsa import keys
+
+from denaro.constants import CURVE, ENDIAN
+from denaro.helpers import AddressFormat, point_to_string, sha256
+from denaro.transactions import CoinbaseTransaction, Transaction, TransactionInput, TransactionOutput
+
+
+def make_key():
+    private_key = keys.gen_private_key(CURVE)
+    return private_key, keys.get_public_key(private_key, CURVE)
+
+
+def make_transaction(message: bytes = None, address_format: AddressFormat = AddressFormat.COMPRESSED, keys_count: int = 1) -> Transaction:
+    key_pairs = [make_key() for _ in range(keys_count)]
+    inputs = [
+        TransactionInput(sha256(str(i).encode()), i, public_key=key_pairs[i % keys_count][1])
+        for i in range(3)
+    ]
+    outputs = [TransactionOutput(point_to_string(public_key, address_format), units=i * 300 + 1) for i, (_, public_key) in enumerate(key_pairs)]
+    transaction = Transaction(inputs, outputs, message)
+    transaction.sign([private_key for private_key, _ in key_pairs])
+    return transaction
+
+
+def parse(tx_bytes: bytes) -> Transaction:
+    return asyncio.run(Transaction.from_bytes(tx_bytes, False))
+
+
+def test_layout():
+    transaction = make_transaction()
+    tx_input, tx_output = transaction.inputs[0], transaction.outputs[0]
+    expected = bytes([3, 3]) + b''.join(tx_input.tobytes() for tx_input in transaction.inputs)
+    expected += bytes([1]) + tx_output.address_bytes + bytes([1]) + (1).to_bytes(1, ENDIAN)
+    expected += bytes([0]) + tx_input.signed[0].to_bytes(32, ENDIAN) + tx_input.signed[1].to_bytes(32, ENDIAN)
+    assert transaction.to_bytes() == expected
+    assert transaction.hex() == expected.hex()
+    assert transaction.hash() == sha256(expected.hex())
+
+
+@pytest.mark.parametrize('address_format', [AddressFormat.COMPRESSED, AddressFormat.FULL_HEX])
+@pytest.mark.parametrize('message', [None, b'hello'])
+@pytest.mark.parametrize('keys_count', [1, 3])
+def test_round_trip(address_format, message, keys_count):
+    transaction = make_transaction(message, address_format, keys_count)
+    parsed = parse(transaction.to_bytes())
+    assert parsed.version == (3 if address_format is AddressFormat.COMPRESSED else 1)
+    assert parsed.message == message
+    assert parsed.to_bytes() == transaction.to_bytes()
+    assert parsed.hash() == transaction.hash()
+    assert [tx_input.signed for tx_input in parsed.inputs] == [tx_input.signed for tx_input in transaction.inputs]
+    assert asyncio.run(Transaction.from_hex(transaction.hex(), False)) == transaction
+
+
+def test_unsigned_serialization_excludes_signatures():
+    transaction = make_transaction(b'message')
+    assert not transaction.to_bytes(False).endswith(transaction.inputs[0].get_signature_bytes())
+    assert transaction.to_bytes().startswith(transaction.to_bytes(False))
+
+
+def test_coinbase_round_trip():
+    _, public_key = make_key()
+    coinbase = CoinbaseTransaction(sha256(b'block'), point_to_string(public_key), Decimal('6.5'))
+    parsed = parse(coinbase.to_bytes())
+    assert isinstance(parsed, CoinbaseTransaction)
+    assert (parsed.block_hash, parsed.address, parsed.amount) == (coinbase.block_hash, coinbase.address, coinbase.amount)
+    assert parsed.hash() == coinbase.hash()
+
+
+@pytest.mark.parametrize('field', ['block_hash', 'address', 'amount'])
+def test_coinbase_changes_clear_the_cache(field):
+    _, public_key = make_key()
+    _, other_key = make_key()
+    values = {'block_hash': sha256(b'other block'), 'address': point_to_string(other_key), 'amount': Decimal('7.25')}
+    coinbase = CoinbaseTransaction(sha256(b'block'), point_to_string(public_key), Decimal('6.5'))
+    old_hash = coinbase.hash()
+    setattr(coinbase, field, values[field])
+    fields = {'block_hash': coinbase.block_hash, 'address': coinbase.address, 'amount': coinbase.amount}
+    assert coinbase.hash() != old_hash
+    assert coinbase.to_bytes() == CoinbaseTransaction(**fields).to_bytes()
+    assert (coinbase.outputs[0].address, coinbase.outputs[0].amount) == (coinbase.address, coinbase.amount)
+
+
+def test_changes_clear_the_cache():
+    transaction = make_transaction()
+    tx_bytes = transaction.to_bytes()
+    transaction.outputs = transaction.outputs + [TransactionOutput(transaction.outputs[0].address, units=5)]
+    assert transaction.to_bytes() != tx_bytes
+    assert transaction.hash() == sha256(transaction.to_bytes())
+    assert parse(transaction.to_bytes()).hash() == transaction.hash()
+
+    tx_hash = transaction.hash()
+    transaction.message = b'changed'
+    assert transaction.hash() != tx_hash
+    assert parse(transaction.to_bytes()).message == b'changed'
+
+    tx_hash = transaction.hash()
+    transaction.inputs = transaction.inputs[:2]
+    assert transaction.hash() != tx_hash
+    assert len(parse(transaction.to_bytes()).inputs) == 2
+
+
+def test_sign_clears_the_cache():
+    private_key, public_key = make_key()
+    transaction = Transaction([TransactionInput(sha256(b'spent'), 0, public_key=public_key)], [TransactionOutput(point_to_string(public_key), units=1)])
+    transaction.inputs[0].signed = (1, 1)
+    unsigned_hash = transaction.hash()
+    transaction.sign([private_key])
+    assert transaction.hash() != unsigned_hash
+    assert transaction.hash() == sha256(transaction.hex())
@@ -0,0 +1,48 @@
+import asyncio
+from decimal import Decimal
+
+import pytest
+from fastecdsa import keys
+
+from denaro.constants import CURVE, SMALLEST
+from denaro.helpers import point_to_string, sha256
+from denaro.transactions import Transaction, TransactionInput, TransactionOutput
+
+PRIVATE_KEY = keys.gen_private_key(CURVE)
+PUBLIC_KEY = keys.get_public_key(PRIVATE_KEY, CURVE)
+ADDRESS = point_to_string(PUBLIC_KEY)
+TX_HASH = sha256(b'spent')
+
+
+@pytest.mark.parametrize('instance', [TransactionInput(TX_HASH, 0), TransactionOutput(ADDRESS, units=1)])
+def test_no_instance_dict(instance):
+    assert not hasattr(instance, '__dict__')
+    with pytest.raises(AttributeError):
+        instance.unknown = 1
+
+
+def test_amount_is_stored_as_units():
+    tx_input = TransactionInput(TX_HASH, 0, amount=Decimal('1.5'))
+    assert tx_input.units == 3 * SMALLEST // 2
+    assert tx_input.amount == Decimal('1.5')
+    tx_input.amount = Decimal('0.000001')
+    assert tx_input.units == 1
+    tx_input.amount = None
+    assert tx_input.units is None and tx_input.amount is None
+    assert TransactionInput(TX_HASH, 0, units=7).amount == Decimal(7) / SMALLEST
+    assert TransactionOutput(ADDRESS, Decimal('2.25')).units == 9 * SMALLEST // 4
+
+
+@pytest.mark.parametrize('cls', [TransactionInput, TransactionOutput])
+def test_fractions_of_the_smallest_unit_are_rejected(cls):
+    instance = cls(TX_HASH, 0, units=1) if cls is TransactionInput else cls(ADDRESS, units=1)
+    with pytest.raises(AssertionError):
+        instance.amount = Decimal('0.0000015')
+    assert instance.units == 1
+    with pytest.raises(AssertionError):
+        cls(TX_HASH, 0, amount=Decimal('1.0000001')) if cls is TransactionInput else cls(ADDRESS, Decimal('1.0000001'))
+
+
+def test_fees_from_units():
+    transaction = Transaction([TransactionInput(TX_HASH, 0, public_key=PUBLIC_KEY, amount=Decimal('3.000003'))], [TransactionOutput(ADDRESS, units=2 * SMALLEST)])
+    assert asyncio.run(transaction.get_fees()) == Decimal('1.000003')
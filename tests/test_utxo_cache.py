@@ -0,0 +1,67 @@
+import asyncio
+
+from denaro.utxo_cache import UTXOCache
+
+OUTPUTS = [(str(i) * 64, 0, i, 'address') for i in range(5)]
+
+
+def test_least_recently_used_is_evicted():
+    cache = UTXOCache(3)
+    cache.add(OUTPUTS[:3])
+    cache.get([OUTPUTS[0][:2]])
+    cache.add(OUTPUTS[3:4])
+    assert OUTPUTS[0][:2] in cache
+    assert OUTPUTS[1][:2] not in cache
+    assert len(cache) == 3
+
+
+def test_disabled_cache_stays_empty():
+    cache = UTXOCache(0)
+    cache.add(OUTPUTS)
+    assert len(cache) == 0
+    assert cache.get([OUTPUTS[0][:2]]) == ([], [OUTPUTS[0][:2]])
+
+
+async def assert_cache_matches(database):
+    async with database.pool.acquire() as connection:
+        rows = await connection.fetch('SELECT tx_hash, index, amount, address FROM unspent_outputs')
+    stored = {(row['tx_hash'], row['index']): (row['amount'], row['address']) for row in rows}
+    for output, value in database.utxo_cache.outputs.items():
+        assert stored.get(output) == value, output
+    return stored
+
+
+def test_cache_follows_add_spend_and_rollback(scratch_database, make_blocks):
+    async def run():
+        database = await scratch_database()
+        try:
+            # more blocks than remove_blocks loads at once
+            blocks = await make_blocks(600)
+            for i in range(0, len(blocks), 100):
+                await database.add_blocks(blocks[i:i + 100])
+            stored = await assert_cache_matches(database)
+            tip = (blocks[-1]['coinbase_transaction'].hash(), 0)
+            # the reward of each block but the last one has been spent
+            assert len(stored) == 600 and tip in stored
+            assert tip in database.utxo_cache
+            assert (blocks[0]['coinbase_transaction'].hash(), 0) not in database.utxo_cache
+
+            await database.remove_blocks(50)
+            stored = await assert_cache_matches(database)
+            restored = (blocks[48]['coinbase_transaction'].hash(), 0)
+            assert len(stored) == 49 and restored in stored
+            assert await database.get_unspent_outputs([restored, tip]) == [restored]
+            assert restored in database.utxo_cache
+
+            fork = await make_blocks(10, 50, blocks[48]['coinbase_transaction'], 'fork')
+            await database.add_blocks(fork)
+            stored = await assert_cache_matches(database)
+            assert restored not in stored and (fork[-1]['coinbase_transaction'].hash(), 0) in stored
+
+            await database.delete_blocks(10)
+            await database.get_unspent_outputs([tip, restored])
+            await assert_cache_matches(database)
+        finally:
+            await database.pool.close()
+
+    asyncio.run(run())
@@ -0,0 +1,56 @@
+import asyncio
+import random
+
+from denaro.database import Database
+from denaro.helpers import UTXO_COMMITMENT_MODULUS, get_utxo_commitment, sha256
+
+OUTPUTS = [(sha256(str(i).encode()), i % 5) for i in range(200)]
+
+
+def test_empty_set():
+    assert get_utxo_commitment([]) == 0
+
+
+def test_order_independent():
+    shuffled = OUTPUTS[:]
+    random.Random(0).shuffle(shuffled)
+    assert get_utxo_commitment(shuffled) == get_utxo_commitment(OUTPUTS)
+
+
+def test_chunks_add_up():
+    chunks = sum(get_utxo_commitment(OUTPUTS[i:i + 30]) for i in range(0, len(OUTPUTS), 30))
+    assert chunks % UTXO_COMMITMENT_MODULUS == get_utxo_commitment(OUTPUTS)
+    assert 0 <= get_utxo_commitment(OUTPUTS) < UTXO_COMMITMENT_MODULUS
+
+
+def test_index_is_committed():
+    tx_hash = OUTPUTS[0][0]
+    assert get_utxo_commitment([(tx_hash, 0)]) != get_utxo_commitment([(tx_hash, 1)])
+
+
+def test_add_remove_symmetry():
+    commitment = get_utxo_commitment(OUTPUTS[:100])
+    added, removed = OUTPUTS[100:], OUTPUTS[:50]
+    commitment = (commitment + get_utxo_commitment(added) - get_utxo_commitment(removed)) % UTXO_COMMITMENT_MODULUS
+    assert commitment == get_utxo_commitment(OUTPUTS[50:])
+    commitment = (commitment - get_utxo_commitment(added) + get_utxo_commitment(removed)) % UTXO_COMMITMENT_MODULUS
+    assert commitment == get_utxo_commitment(OUTPUTS[:100])
+
+
+class FakeConnection:
+    def __init__(self, commitment: int):
+        self.commitment = commitment
+        self.updates = 0
+
+    async def execute(self, query, delta, modulus):
+        self.updates += 1
+        # NUMERIC is exact, unlike Decimal arithmetic in the default context
+        self.commitment = (self.commitment + int(delta)) % int(modulus)
+
+
+def test_update_utxo_commitment():
+    connection = FakeConnection(get_utxo_commitment(OUTPUTS[:120]))
+    asyncio.run(Database.update_utxo_commitment(None, connection, OUTPUTS[120:], OUTPUTS[:20]))
+    assert connection.commitment == get_utxo_commitment(OUTPUTS[20:])
+    asyncio.run(Database.update_utxo_commitment(None, connection, OUTPUTS[:5], OUTPUTS[:5]))
+    assert connection.updates == 1